@@ -0,0 +1,414 @@
+r"""Generate the completions of a JSONL file of prompts in bulk.
+
+The input has a request per line in the trace format of the load tests: the
+fields of GenerationRequest, of which only "prompt" is required and the others
+default to those of the load tests, and an optional "id" that is copied to the
+result.
+
+    PYTHONPATH=src:src/client:test/load_test python scripts/bulk_generate.py \
+        prompts.jsonl results.jsonl \
+        --url localhost:8001 --batch-size 8 --concurrency 16
+
+Requests with the same batch key are packed into batched ensemble requests,
+and a bounded number of batches is in flight, so the dynamic batcher of Triton
+stays full while the input is read only as fast as the batches complete. The
+memory does not grow with the input.
+
+Each result is appended to the output as it completes, with the number of its
+input line, the completion of each beam without the prompt and its generated
+tokens, and the log probs if they are requested:
+
+    {"line": 0, "id": "a", "completions": ["\n    return a + b"], "tokens": [9]}
+
+A request that fails after the retries, or an invalid line, has an "error"
+instead. The checkpoint next to the output (results.jsonl.checkpoint) has the
+line below which every request is done, the lines done above it, the failed
+lines and the size of the output then, so an interrupted run resumes where it
+stopped when it is run again. The failed requests are retried then, and their
+new results are appended after their errors.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import IO, Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from client.batcher import split_outputs
+from client.request_builder import GenerationRequest, RequestTemplate
+from client.streaming import StreamDecoder
+from client.triton_client import TritonClientPool
+from workload import parse_request
+
+# Requests waiting for a full batch of their key, in batches. Beyond that, the
+# batch with the oldest request is sent as it is.
+MAX_PENDING_BATCHES = 4
+
+# The input line, the record and its request.
+Item = Tuple[int, Dict[str, Any], GenerationRequest]
+
+
+@dataclass
+class Checkpoint:
+    """The progress of a run."""
+
+    input: str
+    # Every input line below done_below and those in done_above have a result
+    # in the first output_bytes.
+    done_below: int = 0
+    done_above: List[int] = field(default_factory=list)
+    output_bytes: int = 0
+    # The lines whose last result is an error, retried on resume.
+    failed: List[int] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Checkpoint"]:
+        """Read a checkpoint if it exists."""
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as checkpoint:
+            return cls(**json.load(checkpoint))
+
+    def save(self, path: str) -> None:
+        """Replace the checkpoint atomically."""
+        with open(path + ".tmp", "w", encoding="utf-8") as checkpoint:
+            json.dump(asdict(self), checkpoint)
+        os.replace(path + ".tmp", path)
+
+
+@dataclass
+class Progress:
+    """Counters of a run for the throughput and the ETA."""
+
+    total: int
+    done: int = 0
+    resumed: int = 0
+    errors: int = 0
+    tokens: int = 0
+    start: float = field(default_factory=time.perf_counter)
+
+    def report(self) -> str:
+        """Get a line of progress."""
+        elapsed = time.perf_counter() - self.start
+        rate = (self.done - self.resumed) / elapsed if elapsed else 0.0
+        eta = (self.total - self.done) / rate if rate else float("inf")
+        return (
+            f"{self.done}/{self.total} requests ({self.done / max(self.total, 1):.1%})"
+            f", {rate:.1f} requests/s, {self.tokens / max(elapsed, 1e-9):.0f} "
+            f"tokens/s, {self.errors} errors, ETA {format_seconds(eta)}"
+        )
+
+
+class BulkGenerator:
+    """Send the batches of the requests and write their results.
+
+    At most concurrency batches are in flight. The input is consumed as slots
+    free up, so the pending requests are bounded. The client pool spreads the
+    batches over its channels and retries them while the server is
+    unavailable or overloaded.
+    """
+
+    def __init__(
+        self,
+        client: TritonClientPool,
+        output: IO[str],
+        progress: Progress,
+        model_name: str = "ensemble",
+        batch_size: int = 8,
+        concurrency: int = 16,
+        done: Optional[Set[int]] = None,
+        failed: Optional[Set[int]] = None,
+    ) -> None:
+        """Initialize.
+
+        The done lines are those skipped, since they already have results,
+        and the failed ones those retried.
+        """
+        self.client = client
+        self.output = output
+        self.progress = progress
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.template = RequestTemplate()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending: Dict[Tuple, List[Item]] = {}
+        self._inflight: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._done = set(done or ())
+        self.failed = set(failed or ())
+        self._read_below = 0
+
+    def watermark(self) -> Tuple[int, List[int]]:
+        """Get the line below which every request read is done and those above.
+
+        The lines below it are forgotten.
+        """
+        lines = [line for batch in self._pending.values() for line, _, _ in batch]
+        done_below = min([self._read_below, *self._inflight, *lines])
+        self._done = {line for line in self._done if line >= done_below}
+        return done_below, sorted(self._done)
+
+    async def run(self, lines: Iterator[Tuple[int, str]]) -> None:
+        """Generate the results of the input lines."""
+        for line, text in lines:
+            self._read_below = line + 1
+            record: Any = None
+            try:
+                record = json.loads(text)
+                request = parse_request(record)
+            except Exception as exception:  # pylint: disable=broad-except
+                record = record if isinstance(record, dict) else {}
+                self._write(line, record, {"error": f"Invalid request: {exception}"})
+                continue
+            batch = self._pending.setdefault(request.batch_key, [])
+            batch.append((line, record, request))
+            if len(batch) >= self.batch_size:
+                await self._send(request.batch_key)
+            elif self._pending_requests() > self.batch_size * MAX_PENDING_BATCHES:
+                oldest = min(self._pending, key=lambda key: self._pending[key][0][0])
+                await self._send(oldest)
+        for key in list(self._pending):
+            await self._send(key)
+        await asyncio.gather(*self._tasks)
+
+    async def _send(self, key: Tuple) -> None:
+        """Send the pending batch of the key once a slot is free."""
+        await self._semaphore.acquire()
+        batch = self._pending.pop(key)
+        self._inflight.update(line for line, _, _ in batch)
+        task = asyncio.ensure_future(self._generate(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _generate(self, batch: List[Item]) -> None:
+        """Generate a batch and write the results, or the error of the batch."""
+        try:
+            requests = [request for _, _, request in batch]
+            result = await self.client.infer(
+                self.model_name,
+                self.template.inputs(requests),
+                outputs=self.template.outputs(requests),
+            )
+            outputs_of = split_outputs(result, len(batch))
+            results = [
+                completion(request, arrays, self.progress)
+                for (_, _, request), arrays in zip(batch, outputs_of)
+            ]
+        except Exception as exception:  # pylint: disable=broad-except
+            error = {"error": f"{type(exception).__name__}: {exception}"}
+            results = [error] * len(batch)
+        finally:
+            self._inflight.difference_update(line for line, _, _ in batch)
+            self._semaphore.release()
+        for (line, record, _), result in zip(batch, results):
+            self._write(line, record, result)
+
+    def _write(self, line: int, record: Dict[str, Any], result: Dict[str, Any]) -> None:
+        """Append the result of a line to the output.
+
+        A failed line is not done, so that it is retried on resume.
+        """
+        head: Dict[str, Any] = {"line": line}
+        if "id" in record:
+            head["id"] = record["id"]
+        self.output.write(json.dumps({**head, **result}) + "\n")
+        if "error" in result:
+            self.failed.add(line)
+            self.progress.errors += 1
+        else:
+            self._done.add(line)
+            self.failed.discard(line)
+        self.progress.done += 1
+
+    def _pending_requests(self) -> int:
+        """Get the number of requests waiting for a batch."""
+        return sum(map(len, self._pending.values()))
+
+
+def read_lines(
+    path: str, skip_below: int, skip: Set[int], retry: Set[int]
+) -> Iterator[Tuple[int, str]]:
+    """Read the lines of the input one by one, skipping those done.
+
+    The lines to retry are read even below skip_below.
+    """
+    with open(path, encoding="utf-8") as lines:
+        for line, text in enumerate(lines):
+            if not text.strip():
+                continue
+            if line in retry or (line >= skip_below and line not in skip):
+                yield line, text
+
+
+def count_requests(path: str) -> int:
+    """Count the non-empty lines of the input."""
+    with open(path, encoding="utf-8") as lines:
+        return sum(1 for text in lines if text.strip())
+
+
+def resume(output_path: str, checkpoint: Checkpoint) -> Tuple[Set[int], Set[int], int]:
+    """Get the lines done above the watermark, the failed lines and the done count.
+
+    A partly written last result is cut off.
+    """
+    done, failed = set(checkpoint.done_above), set(checkpoint.failed)
+    with open(output_path, "rb+") as output:
+        valid = min(checkpoint.output_bytes, output.seek(0, os.SEEK_END))
+        output.seek(valid)
+        for text in output:
+            if not text.endswith(b"\n"):
+                break
+            result = json.loads(text)
+            if "error" in result:
+                failed.add(result["line"])
+            else:
+                done.add(result["line"])
+                failed.discard(result["line"])
+            valid += len(text)
+        output.truncate(valid)
+    with open(output_path, "rb") as output:
+        results = (json.loads(text) for text in output)
+        return done, failed, sum(1 for result in results if "error" not in result)
+
+
+def completion(
+    request: GenerationRequest, arrays: Dict[str, Any], progress: Progress
+) -> Dict[str, Any]:
+    """Get the result of a request from its outputs."""
+    completions, tokens = [], []
+    for output in arrays["OUTPUT_0"].reshape(-1):
+        decoder = StreamDecoder(request.stop_words)
+        decoder.feed(output)
+        text = decoder.flush()
+        if text.startswith(request.prompt):
+            text = text[len(request.prompt) :]
+        completions.append(text)
+        tokens.append(request.max_tokens - decoder.padding)
+    progress.tokens += sum(tokens)
+    result: Dict[str, Any] = {"completions": completions, "tokens": tokens}
+    # One log prob per beam, and one per beam and token.
+    if "cum_log_probs" in arrays:
+        result["cum_log_probs"] = arrays["cum_log_probs"].reshape(-1).tolist()
+    if "output_log_probs" in arrays:
+        output_log_probs = arrays["output_log_probs"].reshape(request.beams, -1)
+        result["output_log_probs"] = output_log_probs.tolist()
+    return result
+
+
+def format_seconds(seconds: float) -> str:
+    """Format a duration as h:mm:ss."""
+    if seconds == float("inf"):
+        return "?"
+    minutes, secs = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{secs:02d}"
+
+
+async def report(
+    generator: BulkGenerator,
+    checkpoint: Checkpoint,
+    checkpoint_path: str,
+    interval: float,
+) -> None:
+    """Checkpoint and print the progress periodically."""
+    while True:
+        await asyncio.sleep(interval)
+        save(generator, checkpoint, checkpoint_path)
+        print(generator.progress.report(), file=sys.stderr)
+
+
+def save(generator: BulkGenerator, checkpoint: Checkpoint, path: str) -> None:
+    """Flush the output and record the progress."""
+    generator.output.flush()
+    os.fsync(generator.output.fileno())
+    done_below, checkpoint.done_above = generator.watermark()
+    checkpoint.done_below = max(checkpoint.done_below, done_below)
+    checkpoint.failed = sorted(generator.failed)
+    checkpoint.output_bytes = generator.output.tell()
+    checkpoint.save(path)
+
+
+async def main(args: argparse.Namespace) -> int:
+    """Generate the results of the input and return the exit code."""
+    checkpoint_path = args.output + ".checkpoint"
+    if args.overwrite:
+        for path in (args.output, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+    input_path = os.path.abspath(args.input)
+    checkpoint = Checkpoint.load(checkpoint_path) or Checkpoint(input_path)
+    if checkpoint.input != input_path:
+        print(f"{checkpoint_path} is of {checkpoint.input}", file=sys.stderr)
+        return 2
+    progress = Progress(count_requests(args.input))
+    done: Set[int] = set()
+    failed: Set[int] = set()
+    if os.path.exists(args.output):
+        done, failed, progress.resumed = resume(args.output, checkpoint)
+        progress.done = progress.resumed
+        print(
+            f"Resuming with {progress.done} requests done and {len(failed)} "
+            "to retry",
+            file=sys.stderr,
+        )
+
+    client = TritonClientPool(
+        args.url, args.channels, args.timeout or None, args.retries
+    )
+    try:
+        if not await client.get_client().is_model_ready(args.model):
+            print(f"{args.model} is not ready on {args.url}", file=sys.stderr)
+            return 2
+        with open(args.output, "a", encoding="utf-8") as output:
+            generator = BulkGenerator(
+                client,
+                output,
+                progress,
+                args.model,
+                args.batch_size,
+                args.concurrency,
+                done,
+                failed,
+            )
+            reporter = asyncio.ensure_future(
+                report(generator, checkpoint, checkpoint_path, args.report_interval)
+            )
+            try:
+                await generator.run(
+                    read_lines(args.input, checkpoint.done_below, done, failed)
+                )
+            finally:
+                reporter.cancel()
+                save(generator, checkpoint, checkpoint_path)
+                print(progress.report(), file=sys.stderr)
+    finally:
+        await client.close()
+    return 1 if progress.errors else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="JSONL file of requests.")
+    parser.add_argument("output", help="JSONL file of results, appended to.")
+    parser.add_argument("--url", default="localhost:8001", help="gRPC endpoint.")
+    parser.add_argument("--model", default="ensemble")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="Batches in flight."
+    )
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument(
+        "--timeout", type=float, default=600, help="Of a batch, 0 for none."
+    )
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=10,
+        help="Seconds between the checkpoints and the progress reports.",
+    )
+    parser.add_argument(
+        "--overwrite", action="store_true", help="Start over instead of resuming."
+    )
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -33,14 +33,16 @@ import tritonclient.grpc as grpcclient
 import tritonclient.http as httpclient
 from tritonclient.utils import np_to_triton_dtype
 
+from client.request_builder import END_ID, START_ID, GenerationRequest, RequestTemplate
+
 FLAGS = None
 
 START_LEN = 8
 OUTPUT_LEN = 24
 BATCH_SIZE = 8
 
-start_id = 220
-end_id = 50256
+start_id = START_ID
+end_id = END_ID
 
 
 def prepare_tensor(name, input, protocol):
@@ -240,55 +242,31 @@ if __name__ == "__main__":
     with create_inference_server_client(
         FLAGS.protocol, FLAGS.url, concurrency=1, verbose=FLAGS.verbose
     ) as client:
-        input0 = [
-            ["def print_hello_world():"],
-            ["def get_file_size(filepath):"],
-            ["def count_lines(filename):"],
-            ["def count_words(filename):"],
-            ["def two_sum(nums, target):"],
+        prompts = [
+            "def print_hello_world():",
+            "def get_file_size(filepath):",
+            "def count_lines(filename):",
+            "def count_words(filename):",
+            "def two_sum(nums, target):",
         ]
-        bad_words_list = np.array([[""], [""], [""], [""], [""]], dtype=object)
-        stop_words_list = np.array([[""], [""], [""], [""], [""]], dtype=object)
-        input0_data = np.array(input0).astype(object)
-        output0_len = np.ones_like(input0).astype(np.uint32) * OUTPUT_LEN
-        runtime_top_k = (FLAGS.topk * np.ones([input0_data.shape[0], 1])).astype(
-            np.uint32
-        )
-        runtime_top_p = FLAGS.topp * np.ones([input0_data.shape[0], 1]).astype(
-            np.float32
-        )
-        beam_search_diversity_rate = 0.0 * np.ones([input0_data.shape[0], 1]).astype(
-            np.float32
-        )
-        temperature = 1.0 * np.ones([input0_data.shape[0], 1]).astype(np.float32)
-        len_penalty = 1.0 * np.ones([input0_data.shape[0], 1]).astype(np.float32)
-        repetition_penalty = 1.0 * np.ones([input0_data.shape[0], 1]).astype(np.float32)
-        random_seed = 0 * np.ones([input0_data.shape[0], 1]).astype(np.uint64)
-        is_return_log_probs = True * np.ones([input0_data.shape[0], 1]).astype(bool)
-        beam_width = (FLAGS.beam_width * np.ones([input0_data.shape[0], 1])).astype(
-            np.uint32
-        )
-        start_ids = start_id * np.ones([input0_data.shape[0], 1]).astype(np.uint32)
-        end_ids = end_id * np.ones([input0_data.shape[0], 1]).astype(np.uint32)
-        inputs = [
-            prepare_tensor("INPUT_0", input0_data, FLAGS.protocol),
-            prepare_tensor("INPUT_1", output0_len, FLAGS.protocol),
-            prepare_tensor("INPUT_2", bad_words_list, FLAGS.protocol),
-            prepare_tensor("INPUT_3", stop_words_list, FLAGS.protocol),
-            prepare_tensor("runtime_top_k", runtime_top_k, FLAGS.protocol),
-            prepare_tensor("runtime_top_p", runtime_top_p, FLAGS.protocol),
-            prepare_tensor(
-                "beam_search_diversity_rate", beam_search_diversity_rate, FLAGS.protocol
-            ),
-            prepare_tensor("temperature", temperature, FLAGS.protocol),
-            prepare_tensor("len_penalty", len_penalty, FLAGS.protocol),
-            prepare_tensor("repetition_penalty", repetition_penalty, FLAGS.protocol),
-            prepare_tensor("random_seed", random_seed, FLAGS.protocol),
-            prepare_tensor("is_return_log_probs", is_return_log_probs, FLAGS.protocol),
-            prepare_tensor("beam_width", beam_width, FLAGS.protocol),
-            prepare_tensor("start_id", start_ids, FLAGS.protocol),
-            prepare_tensor("end_id", end_ids, FLAGS.protocol),
+        requests = [
+            GenerationRequest(
+                prompt=prompt,
+                max_tokens=OUTPUT_LEN,
+                top_k=FLAGS.topk,
+                top_p=FLAGS.topp,
+                diversity=0.0,
+                temperature=1.0,
+                len_penalty=1.0,
+                repetition_penalty=1.0,
+                seed=0,
+                beams=FLAGS.beam_width,
+                return_log_probs=True,
+            )
+            for prompt in prompts
         ]
+        client_util = httpclient if FLAGS.protocol == "http" else grpcclient
+        inputs = RequestTemplate(client_util.InferInput).inputs(requests)
 
         try:
             result = client.infer(model_name, inputs)
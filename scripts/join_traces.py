@@ -0,0 +1,230 @@
+"""Join the traces of the chat client with the trace file of Triton.
+
+The client writes its sampled traces with CLIENT_TRACE_RATE, and Triton its
+timestamps with --trace-file, --trace-level=TIMESTAMPS and --trace-rate. The
+request ID of a request to Triton is the trace ID of the chat request, or
+those of a batch joined by commas, so each client trace is matched to the
+ensemble (or direct model) request that served it and its composing models:
+
+    python scripts/join_traces.py client_traces.jsonl trace.json --slowest 10
+
+prints a timeline per request in milliseconds from the start of bot(), with
+the queue, compute input, infer and output times of each model. Triton
+timestamps come from its own monotonic clock, so each request is placed in
+the middle of its client RPC span, which leaves the network and serialization
+time split evenly before and after it. --json writes the timelines as JSONL.
+"""
+import argparse
+import json
+import sys
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+# The phases of an execution of a model, between two of its timestamps.
+PHASES = (
+    ("queue", "QUEUE_START", "COMPUTE_START"),
+    ("compute_input", "COMPUTE_START", "COMPUTE_INPUT_END"),
+    ("infer", "COMPUTE_INPUT_END", "COMPUTE_OUTPUT_START"),
+    ("output", "COMPUTE_OUTPUT_START", "COMPUTE_END"),
+)
+# The client span that carries the request to Triton.
+RPC_SPAN = "infer"
+
+
+@dataclass
+class TritonRequest:
+    """A traced request to a model and the requests to its composing models."""
+
+    model_name: str
+    timestamps: Dict[str, int]
+    children: List["TritonRequest"] = field(default_factory=list)
+
+    @property
+    def start(self) -> int:
+        """Get the first timestamp."""
+        return min(self.timestamps.values())
+
+    @property
+    def end(self) -> int:
+        """Get the last timestamp."""
+        return max(self.timestamps.values())
+
+    def phases(self) -> Dict[str, float]:
+        """Get the milliseconds of the phases the request has timestamps of."""
+        return {
+            name: (self.timestamps[end] - self.timestamps[start]) / 1e6
+            for name, start, end in PHASES
+            if start in self.timestamps and end in self.timestamps
+        }
+
+
+@dataclass
+class Row:
+    """A line of a timeline."""
+
+    name: str
+    start_ms: float
+    duration_ms: float
+    depth: int
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+def read_client_traces(path: str) -> Iterator[Dict[str, Any]]:
+    """Read the traces of the client, skipping a partly written last line."""
+    with open(path, encoding="utf-8") as traces:
+        for line in traces:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def parse_trace_file(text: str) -> List[Dict[str, Any]]:
+    """Parse the JSON array of a Triton trace file, even if it is unfinished."""
+    text = text.strip()
+    if text and not text.endswith("]"):
+        text = text.rstrip(",") + "]"
+    return json.loads(text) if text else []
+
+
+def read_triton_traces(paths: Sequence[str]) -> Dict[str, List[TritonRequest]]:
+    """Get the top-level requests of the trace files by their request IDs.
+
+    The trace IDs start over in each file, e.g. on each Triton pod.
+    """
+    requests: Dict[str, List[TritonRequest]] = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as trace_file:
+            entries = parse_trace_file(trace_file.read())
+        models: Dict[int, Dict[str, Any]] = {}
+        timestamps: Dict[int, Dict[str, int]] = {}
+        for entry in entries:
+            if "model_name" in entry:
+                models[entry["id"]] = entry
+            for timestamp in entry.get("timestamps", []):
+                times = timestamps.setdefault(entry["id"], {})
+                name, ns = timestamp["name"], int(timestamp["ns"])
+                # A decoupled model repeats some of them: keep the span of all.
+                if name in times:
+                    last = name.endswith("_END")
+                    ns = max(ns, times[name]) if last else min(ns, times[name])
+                times[name] = ns
+        traced = {
+            trace_id: TritonRequest(model["model_name"], timestamps[trace_id])
+            for trace_id, model in models.items()
+            if timestamps.get(trace_id)
+        }
+        for trace_id, request in traced.items():
+            parent = traced.get(models[trace_id].get("parent_id", 0))
+            if parent is not None:
+                parent.children.append(request)
+                continue
+            for request_id in models[trace_id].get("request_id", "").split(","):
+                if request_id:
+                    requests.setdefault(request_id, []).append(request)
+    return requests
+
+
+def timeline(
+    trace: Dict[str, Any], triton: Dict[str, List[TritonRequest]]
+) -> List[Row]:
+    """Get the rows of the client spans and the Triton requests of a trace."""
+    spans = trace["spans"]
+    origin = spans[0]["start"]
+    depths = {"": -1}
+    rows = []
+    served = list(triton.get(trace["trace_id"], []))
+    for span in sorted(spans, key=lambda span: span["start"]):
+        depth = depths.get(span["parent_id"], 0) + 1
+        depths[span["span_id"]] = depth
+        rows.append(
+            Row(
+                span["name"],
+                (span["start"] - origin) / 1e6,
+                (span["end"] - span["start"]) / 1e6,
+                depth,
+                span["attributes"],
+            )
+        )
+        if span["name"] == RPC_SPAN and served:
+            rows.extend(triton_rows(served.pop(0), span, origin, depth + 1))
+    return rows
+
+
+def triton_rows(
+    request: TritonRequest, span: Dict[str, Any], origin: int, depth: int
+) -> List[Row]:
+    """Get the rows of a Triton request centred in its client RPC span."""
+    server = request.end - request.start
+    client = span["end"] - span["start"]
+    offset = span["start"] + (client - server) / 2 - request.start
+    rows = []
+
+    def add(request: TritonRequest, depth: int, **attributes: Any) -> None:
+        """Add the row of a request and those of its composing models."""
+        attributes.update(request.phases())
+        rows.append(
+            Row(
+                request.model_name,
+                (request.start + offset - origin) / 1e6,
+                (request.end - request.start) / 1e6,
+                depth,
+                attributes,
+            )
+        )
+        for child in sorted(request.children, key=lambda child: child.start):
+            add(child, depth + 1)
+
+    add(request, depth, overhead=(client - server) / 1e6)
+    return rows
+
+
+def format_row(row: Row) -> str:
+    """Format a row of a timeline."""
+    attributes = " ".join(
+        f"{key} {value:.2f}" if isinstance(value, float) else f"{key}={value}"
+        for key, value in row.attributes.items()
+    )
+    name = "  " * row.depth + row.name
+    return f"{row.start_ms:10.2f} {row.duration_ms:10.2f}  {name}  {attributes}"
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Print the joined timelines."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("client_traces", help="JSONL file of CLIENT_TRACE_FILE.")
+    parser.add_argument("triton_traces", nargs="+", help="Trace files of Triton.")
+    parser.add_argument(
+        "--slowest", type=int, default=0, help="Only the N slowest requests."
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Write the timelines as JSONL."
+    )
+    args = parser.parse_args(argv)
+
+    triton = read_triton_traces(args.triton_traces)
+    traces = list(read_client_traces(args.client_traces))
+    if args.slowest:
+        traces.sort(key=lambda t: t["spans"][0]["start"] - t["spans"][0]["end"])
+        traces = traces[: args.slowest]
+    joined = 0
+    for trace in traces:
+        joined += trace["trace_id"] in triton
+        rows = timeline(trace, triton)
+        if args.json:
+            record = {"trace_id": trace["trace_id"], "rows": list(map(asdict, rows))}
+            print(json.dumps(record))
+            continue
+        print(f"{trace['trace_id']}  {rows[0].duration_ms:.2f} ms")
+        print(f"{'start ms':>10} {'ms':>10}")
+        for row in rows:
+            print(format_row(row))
+        print()
+    print(
+        f"Joined {joined} of {len(traces)} client traces with a Triton trace.",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""Profile each model of the pipeline and the ensemble.
+
+Every combination of batch size, output length, beam width and client
+concurrency is sent to preprocessing, codegen-350M-mono-gptj,
+postprocessing and ensemble in turn. The inputs of each model are the
+outputs of the previous one, as in the ensemble. The report has the latency
+percentiles and the throughput of each model, and how much the ensemble adds
+on top of its models. The client round trips saved by the ensemble can make it
+negative. With --metrics-url, it also has the share of each model in the
+compute time of the ensemble requests, from the metrics of Triton:
+
+    PYTHONPATH=src python scripts/profile_pipeline.py --url localhost:8001 \
+        --batch-sizes 1,8 --output-lens 8,128 --concurrency 1,8 \
+        --metrics-url localhost:8002 --output report.json --csv report.csv
+
+A report can be compared with an earlier one with --baseline. The exit code is
+1 if the p99 latency or the throughput of a row regressed by more than
+--tolerance.
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+import tritonclient.grpc as grpcclient
+import tritonclient.grpc.aio as aiogrpcclient
+from tritonclient.utils import np_to_triton_dtype
+
+from client.request_builder import GenerationRequest, RequestTemplate
+from exporter.triton_exporter import scrape
+
+PREPROCESSING = "preprocessing"
+GPTJ = "codegen-350M-mono-gptj"
+POSTPROCESSING = "postprocessing"
+ENSEMBLE = "ensemble"
+STAGES = (PREPROCESSING, GPTJ, POSTPROCESSING)
+
+PROMPTS = (
+    "def print_hello_world():",
+    "def get_file_size(filepath):",
+    "def count_lines(filename):",
+    "def count_words(filename):",
+    "def two_sum(nums, target):",
+)
+# Ensemble inputs of the preprocessing.
+PREPROCESSING_INPUTS = {
+    "INPUT_0": "QUERY",
+    "INPUT_1": "REQUEST_OUTPUT_LEN",
+    "INPUT_2": "BAD_WORDS_DICT",
+    "INPUT_3": "STOP_WORDS_DICT",
+}
+# Preprocessing outputs of the FasterTransformer model.
+GPTJ_INPUTS = {
+    "INPUT_ID": "input_ids",
+    "REQUEST_INPUT_LEN": "input_lengths",
+    "REQUEST_OUTPUT_LEN": "request_output_len",
+    "BAD_WORDS_IDS": "bad_words_list",
+    "STOP_WORDS_IDS": "stop_words_list",
+}
+COMPUTE_METRIC = "nv_inference_compute_infer_duration_us"
+PERCENTILES = (50, 90, 99)
+KEY_FIELDS = ("model", "batch_size", "output_len", "beams", "concurrency")
+
+
+@dataclass(frozen=True)
+class Config:
+    """A point of the sweep."""
+
+    batch_size: int
+    output_len: int
+    beams: int
+    concurrency: int
+
+
+def tensor(name: str, array: np.ndarray) -> grpcclient.InferInput:
+    """Create a gRPC input."""
+    infer_input = grpcclient.InferInput(
+        name, array.shape, np_to_triton_dtype(array.dtype)
+    )
+    infer_input.set_data_from_numpy(array)
+    return infer_input
+
+
+async def model_inputs(
+    client: aiogrpcclient.InferenceServerClient, config: Config
+) -> Dict[str, List[grpcclient.InferInput]]:
+    """Get the inputs of each model by running the pipeline once."""
+    requests = [
+        GenerationRequest(
+            prompt=PROMPTS[i % len(PROMPTS)],
+            max_tokens=config.output_len,
+            beams=config.beams,
+        )
+        for i in range(config.batch_size)
+    ]
+    ensemble = RequestTemplate(grpcclient.InferInput).inputs(requests)
+    arrays = {
+        "INPUT_0": np.array([[r.prompt] for r in requests], dtype=object),
+        "INPUT_1": np.full((len(requests), 1), config.output_len, np.uint32),
+        "INPUT_2": np.full((len(requests), 1), "", dtype=object),
+        "INPUT_3": np.full((len(requests), 1), "", dtype=object),
+    }
+    preprocessing = [
+        tensor(name, arrays[ensemble_name])
+        for ensemble_name, name in PREPROCESSING_INPUTS.items()
+    ]
+    result = await client.infer(PREPROCESSING, preprocessing)
+    gptj = [
+        tensor(name, result.as_numpy(preprocessing_name))
+        for preprocessing_name, name in GPTJ_INPUTS.items()
+    ]
+    # The sampling inputs of the ensemble go to the model as they are.
+    gptj += [i for i in ensemble if i.name() not in PREPROCESSING_INPUTS]
+    result = await client.infer(GPTJ, gptj)
+    postprocessing = [tensor("TOKENS_BATCH", result.as_numpy("output_ids"))]
+    return {
+        PREPROCESSING: preprocessing,
+        GPTJ: gptj,
+        POSTPROCESSING: postprocessing,
+        ENSEMBLE: ensemble,
+    }
+
+
+async def measure(
+    clients: Sequence[aiogrpcclient.InferenceServerClient],
+    model_name: str,
+    inputs: List[grpcclient.InferInput],
+    concurrency: int,
+    requests: int,
+    warmup: int,
+) -> Tuple[List[float], float]:
+    """Send the requests with the concurrency.
+
+    It returns the latencies in seconds and the time taken by all requests.
+    """
+    for _ in range(warmup):
+        await clients[0].infer(model_name, inputs)
+    latencies: List[float] = []
+    counter = itertools.count()
+
+    async def worker(index: int) -> None:
+        client = clients[index % len(clients)]
+        while next(counter) < requests:
+            start = time.perf_counter()
+            await client.infer(model_name, inputs)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def summarize(
+    model_name: str, config: Config, latencies: List[float], seconds: float
+) -> Dict[str, Any]:
+    """Get a row of the report."""
+    row: Dict[str, Any] = {"model": model_name, **asdict(config)}
+    for p, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        row[f"p{p}_ms"] = float(value) * 1e3
+    row["mean_ms"] = float(np.mean(latencies)) * 1e3
+    row["requests_per_second"] = len(latencies) / seconds
+    row["inferences_per_second"] = len(latencies) * config.batch_size / seconds
+    return row
+
+
+def overhead(config: Config, rows: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Compare the ensemble with the sum of its models."""
+    stages = sum(rows[stage]["mean_ms"] for stage in STAGES)
+    return {
+        **asdict(config),
+        "stages_ms": stages,
+        "ensemble_ms": rows[ENSEMBLE]["mean_ms"],
+        "ensemble_overhead_ms": rows[ENSEMBLE]["mean_ms"] - stages,
+        **{f"{stage}_share": rows[stage]["mean_ms"] / stages for stage in STAGES},
+    }
+
+
+def compare(
+    rows: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[Dict[str, Any]]:
+    """Compare the rows with the baseline rows of the same model and config."""
+    previous = {tuple(row[f] for f in KEY_FIELDS): row for row in baseline}
+    comparisons = []
+    for row in rows:
+        old = previous.get(tuple(row[f] for f in KEY_FIELDS))
+        if old is None:
+            continue
+        p99 = row["p99_ms"] / old["p99_ms"]
+        throughput = row["requests_per_second"] / old["requests_per_second"]
+        comparisons.append(
+            {
+                **{f: row[f] for f in KEY_FIELDS},
+                "p99_ratio": p99,
+                "throughput_ratio": throughput,
+                "regressed": p99 > 1 + tolerance or throughput < 1 - tolerance,
+            }
+        )
+    return comparisons
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the sweep."""
+    configs = [
+        Config(*values)
+        for values in itertools.product(
+            parse_ints(args.batch_sizes),
+            parse_ints(args.output_lens),
+            parse_ints(args.beams),
+            parse_ints(args.concurrency),
+        )
+    ]
+    clients = [
+        aiogrpcclient.InferenceServerClient(args.url) for _ in range(args.channels)
+    ]
+    rows, overheads = [], []
+    try:
+        for config in configs:
+            inputs = await model_inputs(clients[0], config)
+            config_rows = {}
+            for model_name in (*STAGES, ENSEMBLE):
+                if model_name == ENSEMBLE and args.metrics_url:
+                    before = scrape([args.metrics_url], args.timeout)
+                latencies, seconds = await measure(
+                    clients,
+                    model_name,
+                    inputs[model_name],
+                    config.concurrency,
+                    args.requests,
+                    args.warmup,
+                )
+                row = summarize(model_name, config, latencies, seconds)
+                config_rows[model_name] = row
+                rows.append(row)
+                print(
+                    f"{model_name:>24} {config}  p50 {row['p50_ms']:>8.2f} ms  "
+                    f"p99 {row['p99_ms']:>8.2f} ms  "
+                    f"{row['requests_per_second']:>8.1f} req/s",
+                    file=sys.stderr,
+                )
+            overheads.append(overhead(config, config_rows))
+            if args.metrics_url:
+                after = scrape([args.metrics_url], args.timeout)
+                compute = {
+                    stage: after[COMPUTE_METRIC, stage] - before[COMPUTE_METRIC, stage]
+                    for stage in STAGES
+                }
+                overheads[-1].update(
+                    {
+                        f"{stage}_compute_share": duration / sum(compute.values())
+                        for stage, duration in compute.items()
+                    }
+                )
+    finally:
+        await asyncio.gather(*(client.close() for client in clients))
+    return {
+        "url": args.url,
+        "requests": args.requests,
+        "rows": rows,
+        "overheads": overheads,
+    }
+
+
+def parse_ints(text: str) -> List[int]:
+    """Parse comma-separated integers."""
+    return [int(value) for value in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="localhost:8001", help="gRPC endpoint.")
+    parser.add_argument("--batch-sizes", default="1,8")
+    parser.add_argument("--output-lens", default="8,128")
+    parser.add_argument("--beams", default="1")
+    parser.add_argument("--concurrency", default="1,8")
+    parser.add_argument("--requests", type=int, default=100, help="Per model.")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument(
+        "--metrics-url", default="", help="Triton metrics, e.g. localhost:8002."
+    )
+    parser.add_argument("--timeout", type=float, default=5.0, help="Of a scrape.")
+    parser.add_argument("--output", default="", help="JSON file, stdout if empty.")
+    parser.add_argument("--csv", default="", help="CSV file of the rows.")
+    parser.add_argument("--baseline", default="", help="JSON report to compare.")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline:
+            comparisons = compare(
+                report["rows"], json.load(baseline)["rows"], args.tolerance
+            )
+        report["comparison"] = comparisons
+        for comparison in comparisons:
+            if comparison["regressed"]:
+                print(f"Regressed: {comparison}", file=sys.stderr)
+                exit_code = 1
+    if args.csv:
+        with open(args.csv, "w", encoding="utf-8", newline="") as output:
+            writer = csv.DictWriter(output, fieldnames=list(report["rows"][0]))
+            writer.writeheader()
+            writer.writerows(report["rows"])
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(text)
+    else:
+        print(text)
+    sys.exit(exit_code)
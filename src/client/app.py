@@ -3,27 +3,164 @@
 - Author: Curt Park
 - Email: www.jwpark.co.kr@gmail.com
 """
+import asyncio
 import os
-from typing import List, Tuple
+import time
+from functools import partial
+from typing import Any, AsyncIterator, List, Tuple
 
-import gradio as gr
-import numpy as np
-import tritonclient.grpc as grpcclient
-from tritonclient.utils import np_to_triton_dtype
+from prometheus_client import start_http_server
+
+from batcher import MicroBatcher, Outputs, split_outputs
+from cache import ResponseCache
+from cancellation import Generation, Generations
+from context import ChatSession, ContextBuilder, LocalTokenCounter, TritonTokenCounter
+from direct import MODEL_NAME, DirectTemplate
+from metrics import (
+    ERRORS,
+    GENERATED_TOKENS,
+    INFLIGHT,
+    PROMPT_TOKENS,
+    STAGE_SECONDS,
+    STATS,
+    TOKENS_PER_SECOND,
+    timed,
+)
+from request_builder import STOP_PRESETS, GenerationRequest, RequestTemplate
+from router import Lane, Router
+from scheduler import FairScheduler, Overloaded, estimate_cost
+from startup import Startup, process_seconds
+from streaming import StopStats, StreamDecoder
+from tokenizer import BPETokenizer
+from tracing import Trace, Tracer
+
+startup = Startup()
+startup.record("imports", process_seconds())
+initialized = time.perf_counter()
 
 URL = os.getenv("TRITON_SERVER_URL", "localhost:8001")
-tritonclient = grpcclient.InferenceServerClient(URL)
+POOL_SIZE = int(os.getenv("TRITON_POOL_SIZE", "4"))
+REQUEST_TIMEOUT = float(os.getenv("TRITON_REQUEST_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("TRITON_MAX_RETRIES", "2"))
+HEALTH_INTERVAL = float(os.getenv("TRITON_HEALTH_INTERVAL", "5"))
+REFRESH_INTERVAL = float(os.getenv("TRITON_REFRESH_INTERVAL", "30"))
+EJECT_AFTER = int(os.getenv("TRITON_EJECT_AFTER", "3"))
+EJECT_TIME = float(os.getenv("TRITON_EJECT_TIME", "30"))
+CONCURRENCY = int(os.getenv("GRADIO_CONCURRENCY", "256"))
+TOKENIZER_PATH = os.getenv("CLIENT_TOKENIZER_PATH", "")
+TOKENIZER_CACHE = int(os.getenv("CLIENT_TOKENIZER_CACHE", "4096"))
+MODEL = os.getenv("TRITON_DIRECT_MODEL", MODEL_NAME) if TOKENIZER_PATH else "ensemble"
+STREAMING = os.getenv("TRITON_STREAMING", "0") == "1"
+STREAM_MODEL = os.getenv("TRITON_STREAM_MODEL", MODEL)
+BATCHING = os.getenv("TRITON_BATCHING", "0") == "1"
+MAX_BATCH_SIZE = int(os.getenv("TRITON_MAX_BATCH_SIZE", "8"))
+BATCH_WAIT_MS = float(os.getenv("TRITON_BATCH_WAIT_MS", "5"))
+CACHE = os.getenv("RESPONSE_CACHE", "0") == "1"
+CACHE_MAX_MB = float(os.getenv("RESPONSE_CACHE_MAX_MB", "64"))
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", "")
+CACHE_DISK_MAX_MB = float(os.getenv("RESPONSE_CACHE_DISK_MAX_MB", "1024"))
+LANES = os.getenv("TRITON_LANES", "")
+SHM_REGIONS = int(os.getenv("TRITON_SHARED_MEMORY_REGIONS", "0"))
+SHM_REGION_MB = float(os.getenv("TRITON_SHARED_MEMORY_MB", "1"))
+COMPRESSION = os.getenv("TRITON_COMPRESSION", "")
+COMPRESSION_MIN_BYTES = int(os.getenv("TRITON_COMPRESSION_MIN_BYTES", "4096"))
+CONTEXT_TOKENS = int(
+    os.getenv("CHAT_CONTEXT_TOKENS", "1024" if TOKENIZER_PATH else "0")
+)
+CONTEXT_POLICY = os.getenv("CHAT_CONTEXT_POLICY", "truncate")
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "0"))
+SCHEDULER_DEADLINE = float(os.getenv("SCHEDULER_DEADLINE", str(REQUEST_TIMEOUT)))
+SCHEDULER_TOKEN_RATE = float(os.getenv("SCHEDULER_TOKEN_RATE", "200"))
+HEARTBEAT_INTERVAL = float(os.getenv("CHAT_HEARTBEAT_INTERVAL", "1"))
+TRACE_RATE = float(os.getenv("CLIENT_TRACE_RATE", "0"))
+TRACE_FILE = os.getenv("CLIENT_TRACE_FILE", "client_traces.jsonl")
+METRICS_PORT = int(os.getenv("CLIENT_METRICS_PORT", "8090"))
+SERVER_NAME = os.getenv("GRADIO_SERVER_NAME", "127.0.0.1")
+SERVER_PORT = int(os.getenv("GRADIO_SERVER_PORT", "7860"))
+WARMUP_PROMPTS_PATH = os.getenv("CLIENT_WARMUP_PROMPTS", "")
+WARMUP_TOKENS = [
+    int(tokens)
+    for tokens in os.getenv("CLIENT_WARMUP_TOKENS", "8,64").split(",")
+    if tokens
+]
+WARMUP_PROMPT = "def hello_world():"
+router = Router.from_config(
+    LANES,
+    URL,
+    CONCURRENCY,
+    pool_size=POOL_SIZE,
+    timeout=REQUEST_TIMEOUT,
+    max_retries=MAX_RETRIES,
+    health_interval=HEALTH_INTERVAL,
+    refresh_interval=REFRESH_INTERVAL,
+    eject_after=EJECT_AFTER,
+    eject_time=EJECT_TIME,
+    shared_memory_regions=SHM_REGIONS,
+    shared_memory_size=int(SHM_REGION_MB * 2**20),
+    compression=COMPRESSION or None,
+    compression_min_bytes=COMPRESSION_MIN_BYTES,
+    # The model of the lanes without one, whose readiness is checked.
+    model_name=STREAM_MODEL if STREAMING else MODEL,
+)
+# With a tokenizer, the client calls the FasterTransformer model directly.
+tokenizer = (
+    BPETokenizer.from_directory(TOKENIZER_PATH, TOKENIZER_CACHE)
+    if TOKENIZER_PATH
+    else None
+)
+template = RequestTemplate() if tokenizer is None else DirectTemplate(tokenizer)
+batchers = {
+    lane.name: MicroBatcher(lane, MODEL, MAX_BATCH_SIZE, BATCH_WAIT_MS / 1000, template)
+    for lane in router.lanes
+    if BATCHING
+}
+cache = (
+    ResponseCache(
+        int(CACHE_MAX_MB * 2**20),
+        CACHE_TTL,
+        CACHE_PATH or None,
+        int(CACHE_DISK_MAX_MB * 2**20),
+    )
+    if CACHE
+    else None
+)
+# Without a tokenizer, the preprocessing model tokenizes like the ensemble does,
+# at the cost of an RPC per turn, so the context is off by default.
+context_builder = ContextBuilder(
+    TritonTokenCounter(router.lanes[0].client)
+    if tokenizer is None
+    else LocalTokenCounter(tokenizer),
+    CONTEXT_TOKENS,
+    CONTEXT_POLICY,
+)
+scheduler = FairScheduler(SCHEDULER_CONCURRENCY, SCHEDULER_TOKEN_RATE)
+generations = Generations()
+tracer = Tracer(TRACE_FILE, TRACE_RATE)
+stop_stats = StopStats()
+STATS.add("client_stop", stop_stats)
+STATS.add("client_context", context_builder.stats)
+STATS.add("client_scheduler", scheduler.stats, gauges=("waiting", "queued_cost"))
+if cache is not None:
+    STATS.add("client_cache", cache.stats)
+for lane in router.lanes:
+    STATS.add("client_lane", lane.stats, {"lane": lane.name}, gauges=("waiting",))
+# The balancers of the lanes, which lanes on the same URL share.
+clients = list(dict.fromkeys(lane.client for lane in router.lanes))
+startup.record("init", time.perf_counter() - initialized)
 
 
-def add_text(history: List[Tuple[str, str]], text: str) -> List[str]:
-    """Add the input text."""
+def add_text(history: List[Tuple[str, str]], text: str) -> Tuple[List[str], float]:
+    """Add the input text, with the time it was submitted."""
     history += [(text, None)]
-    return history
+    return history, time.perf_counter()
 
 
-# pylint: disable=too-many-locals,broad-except
-def bot(
+# pylint: disable=too-many-arguments,broad-except
+async def bot(
     history: List[Tuple[str]],
+    submitted: float,
+    session: ChatSession,
     max_tokens: int,
     top_k: int,
     top_p: float,
@@ -33,156 +170,459 @@ def bot(
     rep_penalty: float,
     seed: int,
     beams: int,
-) -> str:
-    """Predict."""
-    gen_prompt = history[-1][0]
-    input0 = [[gen_prompt]]
-    input0_data = np.array(input0).astype(object)
-    output0_len = np.ones_like(input0).astype(np.uint32) * max_tokens
-    bad_words_list = np.array([[""]], dtype=object)
-    stop_words_list = np.array([[""]], dtype=object)
-    runtime_top_k = top_k * np.ones([1, 1]).astype(np.uint32)
-    runtime_top_p = top_p * np.ones([1, 1]).astype(np.float32)
-    temperature = temp * np.ones([1, 1]).astype(np.float32)
-    len_penalty = len_penalty_ * np.ones([1, 1]).astype(np.float32)
-    repetition_penalty = rep_penalty * np.ones([1, 1]).astype(np.float32)
-    random_seed = seed * np.ones([1, 1]).astype(np.uint64)
-    is_return_log_probs = np.ones([1, 1]).astype(bool)
-    beam_width = beams * np.ones([1, 1]).astype(np.uint32)
-    beam_diversity = diversity * np.ones([1, 1]).astype(np.float32)
-    start_ids = 220 * np.ones([1, 1]).astype(np.uint32)
-    end_ids = 50256 * np.ones([1, 1]).astype(np.uint32)
-
-    inputs = [
-        prepare_tensor("INPUT_0", input0_data),
-        prepare_tensor("INPUT_1", output0_len),
-        prepare_tensor("INPUT_2", bad_words_list),
-        prepare_tensor("INPUT_3", stop_words_list),
-        prepare_tensor("runtime_top_k", runtime_top_k),
-        prepare_tensor("runtime_top_p", runtime_top_p),
-        prepare_tensor("temperature", temperature),
-        prepare_tensor("len_penalty", len_penalty),
-        prepare_tensor("repetition_penalty", repetition_penalty),
-        prepare_tensor("random_seed", random_seed),
-        prepare_tensor("is_return_log_probs", is_return_log_probs),
-        prepare_tensor("beam_width", beam_width),
-        prepare_tensor("beam_search_diversity_rate", beam_diversity),
-        prepare_tensor("start_id", start_ids),
-        prepare_tensor("end_id", end_ids),
-    ]
+    stop_presets: List[str],
+) -> AsyncIterator[List[Tuple[str, str]]]:
+    """Predict.
 
+    The response is generated in a task, which is cancelled when the session
+    submits another prompt or disconnects. Gradio notices a disconnect when
+    this yields, so the response is yielded as it changes, and at least every
+    heartbeat.
+    """
+    generation = generations.start(id(session))
+    task = generation.run(
+        respond(
+            generation,
+            history,
+            submitted,
+            session,
+            max_tokens,
+            top_k,
+            top_p,
+            diversity,
+            temp,
+            len_penalty_,
+            rep_penalty,
+            seed,
+            beams,
+            stop_presets,
+        )
+    )
+    task.add_done_callback(lambda _: generations.finish(id(session), generation))
     try:
-        result = tritonclient.infer("ensemble", inputs)
-        output0 = result.as_numpy("OUTPUT_0")
-    except Exception as exception:
-        print(exception)
+        while not await generation.wait(HEARTBEAT_INTERVAL or None):
+            yield history
+    except asyncio.CancelledError:
+        # Gradio cancels the event when the session submits another prompt.
+        generation.cancel("superseded")
+        raise
+    except GeneratorExit:
+        generation.cancel("disconnected")
+        raise
+    if task.cancelled():  # Superseded, and the new response is on its way.
+        return
+    task.result()
+    yield history
 
-    resp = output0[0].decode("utf-8")
-    idx = resp.find("<|endoftext|>")
-    resp = resp[:idx]
-    history[-1][1] = "```\n" + resp + """\n```"""
 
-    return history
+async def respond(
+    generation: Generation,
+    history: List[Tuple[str]],
+    submitted: float,
+    session: ChatSession,
+    max_tokens: int,
+    top_k: int,
+    top_p: float,
+    diversity: float,
+    temp: float,
+    len_penalty_: float,
+    rep_penalty: float,
+    seed: int,
+    beams: int,
+    stop_presets: List[str],
+) -> None:
+    """Generate the response into the history.
 
+    The prompt has the earlier turns of the session that fit in the context
+    budget. The scheduler queues the request fairly among the sessions by its
+    cost, or rejects it if it would miss its deadline. In the streaming mode,
+    the partial response is updated as tokens arrive. A sampled request
+    records a trace of its stages.
+    """
+    start = time.perf_counter()
+    STAGE_SECONDS.labels("queue").observe(start - submitted)
+    trace = tracer.start("bot", max_tokens=max_tokens, beams=beams, streaming=STREAMING)
+    stop_words = tuple(STOP_PRESETS[preset] for preset in stop_presets)
+    decoder = StreamDecoder(stop_words)
+    context = None
+    rejection = None
+    steps = 0
+    # Without the prompt tokens until the context is built.
+    generation.estimate(beams * max_tokens / scheduler.token_rate)
+    with INFLIGHT.track_inprogress():
+        try:
+            with timed("context"), trace.span("context"):
+                context = await context_builder.build(
+                    session, history[-1][0], max_tokens
+                )
+            PROMPT_TOKENS.observe(context.tokens)
+            request = GenerationRequest(
+                prompt=context.prompt,
+                max_tokens=max_tokens,
+                top_k=top_k,
+                top_p=top_p,
+                diversity=diversity,
+                temperature=temp,
+                len_penalty=len_penalty_,
+                repetition_penalty=rep_penalty,
+                seed=seed,
+                beams=beams,
+                stop_words=stop_words,
+            )
+            cost = estimate_cost(request, context.tokens)
+            generation.estimate(cost / scheduler.token_rate)
+            # A session is a flow of the fair queuing.
+            schedule = scheduler.schedule(
+                id(session), cost, submitted + SCHEDULER_DEADLINE
+            )
+            scheduled = time.time_ns()
+            async with schedule as grant:
+                trace.record("schedule", scheduled, **grant.options())
+                generation.start()
+                if STREAMING:
+                    with timed("prepare"), trace.span("prepare"):
+                        inputs = template.inputs([request])
+                        outputs = template.outputs([request])
+                    lane = router.route(request)
+                    with trace.span(
+                        "infer", lane=lane.name, model=STREAM_MODEL
+                    ) as span:
+                        stream = lane.stream_infer(
+                            STREAM_MODEL,
+                            inputs,
+                            outputs,
+                            **grant.options(),
+                            **trace.options(span),
+                        )
+                        decode_seconds = 0.0
+                        try:
+                            async for result in stream:
+                                if steps == 0:
+                                    STAGE_SECONDS.labels("first_token").observe(
+                                        time.perf_counter() - start
+                                    )
+                                    if span is not None:
+                                        span.attributes["first_token_ms"] = (
+                                            time.time_ns() - span.start
+                                        ) / 1e6
+                                steps += 1
+                                decode_start = time.perf_counter()
+                                completion = template.completion(
+                                    split_outputs(result, 1)[0]
+                                )
+                                decoder.feed(completion["OUTPUT_0"][0])
+                                history[-1][1] = format_code(
+                                    context.reply(decoder.text)
+                                )
+                                decode_seconds += time.perf_counter() - decode_start
+                                generation.update()
+                                if decoder.finished:
+                                    break
+                        finally:
+                            await stream.aclose()
+                        if span is not None:
+                            span.attributes["decode_ms"] = decode_seconds * 1e3
+                    STAGE_SECONDS.labels("decode").observe(decode_seconds)
+                else:
+                    completion = await generate(request, trace, **grant.options())
+                    with timed("decode"), trace.span("decode"):
+                        decoder.feed(completion["OUTPUT_0"][0])
+            failed = False
+            trace.annotate(status="ok")
+        except asyncio.CancelledError:
+            trace.annotate(status="cancelled", reason=generation.reason)
+            tracer.finish(trace)
+            raise
+        except Overloaded as exception:
+            rejection = str(exception)
+            failed = True
+            trace.annotate(status="rejected")
+        except Exception as exception:
+            ERRORS.labels(type(exception).__name__).inc()
+            print(f"{type(exception).__name__}: {exception} ({trace.trace_id})")
+            failed = True
+            trace.annotate(status=type(exception).__name__)
 
-def prepare_tensor(name: str, tensor: np.ndarray) -> grpcclient.InferInput:
-    """Create a triton input."""
-    infer_input = grpcclient.InferInput(
-        name, tensor.shape, np_to_triton_dtype(tensor.dtype)
-    )
-    infer_input.set_data_from_numpy(tensor)
-    return infer_input
-
-
-with gr.Blocks() as demo:
-    chatbot = gr.Chatbot([], elem_id="chatbot").style(height=750)
-
-    with gr.Row():
-        txt = gr.Textbox(
-            show_label=False,
-            placeholder="Enter text and press enter",
-        ).style(container=False)
-
-    with gr.Row():
-        n_tokens = gr.Slider(
-            minimum=8,
-            maximum=1024,
-            step=1,
-            value=256,
-            label="Number of tokens to generate",
-        )
-        top_k = gr.Slider(
-            minimum=1,
-            maximum=100,
-            step=1,
-            value=3,
-            label="Top K",
-        )
-        top_p = gr.Slider(
-            minimum=0,
-            maximum=1,
-            step=0.01,
-            value=0.92,
-            label="Top P",
-        )
-        beam_diversity = gr.Slider(
-            minimum=0,
-            maximum=1,
-            step=0.01,
-            value=0.5,
-            label="Beam Search Diversity",
-        )
-        temperature = gr.Slider(
-            minimum=0,
-            maximum=2.5,
-            step=0.1,
-            value=0.6,
-            label="Temperature",
-        )
-        len_penalty = gr.Slider(
-            minimum=-1,
-            maximum=1,
-            step=0.01,
-            value=0.0,
-            label="Length Penalty",
+        reply = decoder.flush()
+        if context is not None:
+            reply = context.reply(reply)
+        history[-1][1] = rejection or format_code(reply)
+        # Each response of a stream carries a token, and a unary response is
+        # padded with end-of-text tokens up to max_tokens.
+        tokens = steps if STREAMING else max_tokens - decoder.padding
+        stop_stats.requests += 1
+        if decoder.stopped_by is not None:
+            stop_stats.stopped += 1
+            stop_stats.tokens_saved += max_tokens - tokens
+        if not failed:
+            elapsed = time.perf_counter() - start
+            GENERATED_TOKENS.inc(tokens)
+            TOKENS_PER_SECOND.observe(tokens / elapsed)
+            STAGE_SECONDS.labels("total").observe(elapsed)
+            context_builder.add(session, context, reply, tokens)
+            trace.annotate(tokens=tokens)
+    tracer.finish(trace)
+
+
+async def generate(request: GenerationRequest, trace: Trace, **options: Any) -> Outputs:
+    """Generate the completion of a request, from the cache if possible."""
+    if cache is not None:
+        return await cache.get_or_generate(
+            request, partial(infer, trace=trace, **options)
         )
-        rep_penalty = gr.Slider(
-            minimum=0,
-            maximum=5,
-            step=0.01,
-            value=1.0,
-            label="Repetition Penalty",
+    return await infer(request, trace, **options)
+
+
+async def infer(request: GenerationRequest, trace: Trace, **options: Any) -> Outputs:
+    """Run the inference of a request on the backend of its lane.
+
+    The options are those of the inference, i.e. priority and client_timeout.
+    The request carries the ID and the trace context of the trace.
+    """
+    lane = router.route(request)
+    if lane.name in batchers:
+        # Including the batching window and the tensors of the whole batch.
+        with timed("infer"), trace.span("infer", lane=lane.name, batched=True):
+            return await batchers[lane.name].submit(
+                request, **options, **trace.options()
+            )
+    with timed("prepare"), trace.span("prepare"):
+        inputs = template.inputs([request])
+        outputs = template.outputs([request])
+    with timed("infer"), trace.span("infer", lane=lane.name, model=MODEL) as span:
+        result = await lane.infer(
+            MODEL, inputs, outputs, **options, **trace.options(span)
         )
-        seed = gr.Slider(
-            minimum=0,
-            maximum=1000,
-            step=1,
-            value=128,
-            label="Random seed to use for the generation",
+    with trace.span("decode"):
+        return template.completion(split_outputs(result, 1)[0])
+
+
+def format_code(text: str) -> str:
+    """Format the response as a code block."""
+    return "```\n" + text + "\n```"
+
+
+def read_warmup_prompts(path: str) -> List[str]:
+    """Read the warm-up prompts, one per line with their newlines escaped."""
+    if not path:
+        return [WARMUP_PROMPT]
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n").replace("\\n", "\n") for line in f if line.strip()]
+
+
+async def connect() -> None:
+    """Resolve the endpoints and open the channels of every balancer."""
+    await asyncio.gather(*(client.connect() for client in clients))
+
+
+async def close() -> None:
+    """Close the channels of every balancer and release their shared memory."""
+    await asyncio.gather(*(client.close() for client in clients))
+
+
+async def wait_for_model() -> None:
+    """Fail unless the models are ready behind every balancer."""
+    if not await is_model_ready():
+        raise RuntimeError("The models of the lanes are not ready.")
+
+
+async def is_model_ready() -> bool:
+    """Check whether the models of the lanes are ready behind every balancer."""
+    return all(await asyncio.gather(*(client.is_ready() for client in clients)))
+
+
+async def send_warmup_requests() -> None:
+    """Send the warm-up requests to every lane the way chat requests go.
+
+    They bypass the response cache, and the token counter is warmed up too.
+    """
+    prompts = read_warmup_prompts(WARMUP_PROMPTS_PATH)
+    if WARMUP_TOKENS and CONTEXT_TOKENS:
+        await context_builder.count_tokens(prompts)
+    await asyncio.gather(
+        *(
+            warm_up_lane(
+                lane, GenerationRequest(prompt, int(min(tokens, lane.max_tokens)))
+            )
+            for lane in router.lanes
+            for prompt in prompts
+            for tokens in WARMUP_TOKENS
         )
-        beams = gr.Slider(
-            minimum=1,
-            maximum=100,
-            step=1,
-            value=1,
-            label="Beams",
+    )
+
+
+async def warm_up_lane(lane: Lane, request: GenerationRequest) -> None:
+    """Run a request on the lane in the streaming, batching or unary mode."""
+    if STREAMING:
+        stream = lane.stream_infer(
+            STREAM_MODEL, template.inputs([request]), template.outputs([request])
         )
+        try:
+            async for _ in stream:
+                pass
+        finally:
+            await stream.aclose()
+    elif lane.name in batchers:
+        await batchers[lane.name].submit(request)
+    else:
+        await lane.infer(MODEL, template.inputs([request]), template.outputs([request]))
+
+
+def build_ui() -> Any:  # pylint: disable=too-many-locals
+    """Build the Gradio app of the chat."""
+    import gradio as gr  # pylint: disable=import-outside-toplevel
+
+    with gr.Blocks() as demo:
+        chatbot = gr.Chatbot([], elem_id="chatbot").style(height=750)
+        submitted = gr.State()
+        session = gr.State(ChatSession())
+
+        with gr.Row():
+            txt = gr.Textbox(
+                show_label=False,
+                placeholder="Enter text and press enter",
+            ).style(container=False)
 
-    txt.submit(add_text, [chatbot, txt], chatbot,).then(
-        bot,
-        [
+        with gr.Row():
+            n_tokens = gr.Slider(
+                minimum=8,
+                maximum=1024,
+                step=1,
+                value=256,
+                label="Number of tokens to generate",
+            )
+            top_k = gr.Slider(
+                minimum=1,
+                maximum=100,
+                step=1,
+                value=3,
+                label="Top K",
+            )
+            top_p = gr.Slider(
+                minimum=0,
+                maximum=1,
+                step=0.01,
+                value=0.92,
+                label="Top P",
+            )
+            beam_diversity = gr.Slider(
+                minimum=0,
+                maximum=1,
+                step=0.01,
+                value=0.5,
+                label="Beam Search Diversity",
+            )
+            temperature = gr.Slider(
+                minimum=0,
+                maximum=2.5,
+                step=0.1,
+                value=0.6,
+                label="Temperature",
+            )
+            len_penalty = gr.Slider(
+                minimum=-1,
+                maximum=1,
+                step=0.01,
+                value=0.0,
+                label="Length Penalty",
+            )
+            rep_penalty = gr.Slider(
+                minimum=0,
+                maximum=5,
+                step=0.01,
+                value=1.0,
+                label="Repetition Penalty",
+            )
+            seed = gr.Slider(
+                minimum=0,
+                maximum=1000,
+                step=1,
+                value=128,
+                label="Random seed to use for the generation",
+            )
+            beams = gr.Slider(
+                minimum=1,
+                maximum=100,
+                step=1,
+                value=1,
+                label="Beams",
+            )
+            stop_presets = gr.CheckboxGroup(
+                choices=list(STOP_PRESETS),
+                value=["def", "class", "if __name__"],
+                label="Stop at a new top-level statement",
+            )
+
+        response = txt.submit(add_text, [chatbot, txt], [chatbot, submitted]).then(
+            bot,
+            [
+                chatbot,
+                submitted,
+                session,
+                n_tokens,
+                top_k,
+                top_p,
+                beam_diversity,
+                temperature,
+                len_penalty,
+                rep_penalty,
+                seed,
+                beams,
+                stop_presets,
+            ],
             chatbot,
-            n_tokens,
-            top_k,
-            top_p,
-            beam_diversity,
-            temperature,
-            len_penalty,
-            rep_penalty,
-            seed,
-            beams,
-        ],
-        chatbot,
+        )
+        # Another prompt of the session cancels the response in flight.
+        txt.submit(None, None, None, cancels=[response])
+
+    return demo.queue(concurrency_count=CONCURRENCY)
+
+
+async def main() -> None:
+    """Serve the chat, and report ready once the client is warm.
+
+    The UI is built in a thread while the warm-up runs on the event loop. The
+    server takes requests from then on, but /ready answers 503 until the
+    warm-up requests went through and the model is ready on Triton.
+    """
+    if METRICS_PORT:
+        start_http_server(METRICS_PORT)
+    warm_up = asyncio.ensure_future(
+        startup.warm_up(
+            [
+                ("connect", connect),
+                ("model", wait_for_model),
+                ("warmup", send_warmup_requests),
+            ]
+        )
     )
+    with startup.phase("ui"):
+        demo = await asyncio.get_running_loop().run_in_executor(None, build_ui)
+    with startup.phase("app"):
+        # pylint: disable=import-outside-toplevel
+        import gradio as gr
+        import uvicorn
+        from fastapi import FastAPI
+        from fastapi.responses import PlainTextResponse
+
+        app = FastAPI()
+
+        @app.get("/ready", response_class=PlainTextResponse)
+        async def ready() -> PlainTextResponse:
+            """Report whether the client is warm and the model is ready."""
+            if startup.warm and await is_model_ready():
+                return PlainTextResponse("ready")
+            return PlainTextResponse("not ready", status_code=503)
+
+        app = gr.mount_gradio_app(app, demo, path="/")
+    server = uvicorn.Server(uvicorn.Config(app, host=SERVER_NAME, port=SERVER_PORT))
+    try:
+        await server.serve()
+    finally:
+        warm_up.cancel()
+        # Unregister the shared memory regions and remove them from /dev/shm.
+        await close()
+
 
-demo.queue().launch()
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,323 @@
+"""Balance requests over several Triton endpoints.
+
+A long-lived HTTP/2 channel sticks to the pod it connected to, so spreading
+connections alone leaves new replicas idle after a scale-out. The balancer
+picks an endpoint per request instead, by the least outstanding requests.
+"""
+import asyncio
+import random
+import socket
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import tritonclient.grpc as grpcclient
+from tritonclient.utils import InferenceServerException
+
+from triton_client import RETRYABLE_STATUS, TritonClientPool
+
+DNS_PREFIX = "dns:"
+
+
+class Endpoint:
+    """A Triton server and its health."""
+
+    def __init__(self, url: str, client: TritonClientPool) -> None:
+        """Initialize."""
+        self.url = url
+        self.client = client
+        self.outstanding = 0
+        self.requests = 0
+        self.ready = True
+        # Consecutive failures, and the time the endpoint is ejected until.
+        self.failures = 0
+        self.ejected_until = 0.0
+
+    def available(self, now: float) -> bool:
+        """Check whether the endpoint can take requests."""
+        return self.ready and self.ejected_until <= now
+
+
+class EndpointBalancer:
+    """Send each request to the available endpoint with the fewest in flight.
+
+    urls is a comma-separated list of host:port, where "dns:host:port" stands
+    for every address of host, e.g. a headless Kubernetes service. The
+    endpoints are polled for the readiness of the server and of every model
+    of model_names every health_interval seconds, and the
+    DNS names are resolved again every refresh_interval seconds. An endpoint
+    failing eject_after requests in a row is ejected for eject_time seconds.
+    A failed request is retried on another endpoint. With
+    shared_memory_regions, each endpoint on the same node is sent requests
+    through that many shared memory regions of shared_memory_size bytes.
+    Requests of at least compression_min_bytes are compressed with the
+    compression algorithm if it is given.
+    """
+
+    def __init__(
+        self,
+        urls: str,
+        model_names: Sequence[str] = ("ensemble",),
+        pool_size: int = 4,
+        timeout: Optional[float] = None,
+        max_retries: int = 2,
+        retry_backoff: float = 0.1,
+        health_interval: float = 5.0,
+        refresh_interval: float = 30.0,
+        eject_after: int = 3,
+        eject_time: float = 30.0,
+        shared_memory_regions: int = 0,
+        shared_memory_size: int = 2**20,
+        compression: Optional[str] = None,
+        compression_min_bytes: int = 0,
+    ) -> None:
+        """Initialize."""
+        self.model_names = list(model_names)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.health_interval = health_interval
+        self.refresh_interval = refresh_interval
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+        self.shared_memory_regions = shared_memory_regions
+        self.shared_memory_size = shared_memory_size
+        self.compression = compression
+        self.compression_min_bytes = compression_min_bytes
+        self.static_urls, self.dns_names = _parse_urls(urls)
+        self.endpoints: Dict[str, Endpoint] = {}
+        self._draining: List[Endpoint] = []
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def infer(
+        self,
+        model_name: str,
+        inputs: Sequence[grpcclient.InferInput],
+        outputs: Optional[Sequence[grpcclient.InferRequestedOutput]] = None,
+        **kwargs: Any,
+    ) -> grpcclient.InferResult:
+        """Run an inference, retrying on another endpoint if it is unavailable."""
+        tried: List[Endpoint] = []
+        while True:
+            endpoint = await self._pick(tried)
+            tried.append(endpoint)
+            endpoint.outstanding += 1
+            try:
+                result = await endpoint.client.infer(
+                    model_name, inputs, outputs=outputs, **kwargs
+                )
+            except InferenceServerException as exception:
+                retryable = exception.status() in RETRYABLE_STATUS
+                if retryable:
+                    self._record_failure(endpoint)
+                if not retryable or len(tried) > self.max_retries:
+                    raise
+            else:
+                endpoint.failures = 0
+                return result
+            finally:
+                endpoint.outstanding -= 1
+            await asyncio.sleep(self.retry_backoff * 2 ** (len(tried) - 1))
+
+    async def stream_infer(
+        self,
+        model_name: str,
+        inputs: Sequence[grpcclient.InferInput],
+        outputs: Optional[Sequence[grpcclient.InferRequestedOutput]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[grpcclient.InferResult]:
+        """Run a streaming inference on the least loaded endpoint.
+
+        A stream is not retried, since its tokens may have been shown already.
+        """
+        endpoint = await self._pick([])
+        endpoint.outstanding += 1
+        stream = endpoint.client.stream_infer(
+            model_name, inputs, outputs=outputs, **kwargs
+        )
+        try:
+            async for result in stream:
+                yield result
+        except InferenceServerException as exception:
+            if exception.status() in RETRYABLE_STATUS:
+                self._record_failure(endpoint)
+            raise
+        else:
+            endpoint.failures = 0
+        finally:
+            endpoint.outstanding -= 1
+            await stream.aclose()
+
+    async def refresh(self) -> None:
+        """Resolve the endpoints again, keeping the channels of known ones."""
+        urls = list(self.static_urls)
+        for host, port in self.dns_names:
+            urls.extend(await _resolve(host, port))
+        if not urls:  # Keep the current endpoints while the DNS is empty.
+            return
+
+        endpoints = {}
+        for url in dict.fromkeys(urls):
+            endpoints[url] = self.endpoints.pop(url, None) or self._create(url)
+        self._draining.extend(self.endpoints.values())
+        self.endpoints = endpoints
+        await self._close_drained()
+
+    async def connect(self) -> None:
+        """Resolve the endpoints, open their channels and start the health checks."""
+        if not self.endpoints:
+            await self.refresh()
+        await asyncio.gather(
+            *(endpoint.client.connect() for endpoint in self.endpoints.values())
+        )
+        if self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch())
+
+    async def is_ready(self) -> bool:
+        """Check whether the models are ready on any endpoint."""
+        if not self.endpoints:
+            await self.refresh()
+        await self.check_health()
+        return any(endpoint.ready for endpoint in self.endpoints.values())
+
+    async def check_health(self) -> None:
+        """Poll the readiness of the server and the models on every endpoint."""
+        endpoints = list(self.endpoints.values())
+        readiness = await asyncio.gather(
+            *(self._is_ready(endpoint) for endpoint in endpoints)
+        )
+        now = time.monotonic()
+        for endpoint, ready in zip(endpoints, readiness):
+            endpoint.ready = ready
+            if ready and endpoint.ejected_until and endpoint.ejected_until <= now:
+                # Half-open: the next failure ejects it again.
+                endpoint.ejected_until = 0.0
+                endpoint.failures = self.eject_after - 1
+
+    async def close(self) -> None:
+        """Stop polling and close all channels."""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        endpoints = list(self.endpoints.values()) + self._draining
+        self.endpoints, self._draining = {}, []
+        await asyncio.gather(*(endpoint.client.close() for endpoint in endpoints))
+
+    def _create(self, url: str) -> Endpoint:
+        """Create an endpoint, retried by the balancer rather than its pool."""
+        shared_memory = None
+        if self.shared_memory_regions:
+            # pylint: disable=import-outside-toplevel
+            from shared_memory import SharedMemoryTransport
+
+            shared_memory = SharedMemoryTransport(
+                self.shared_memory_regions, self.shared_memory_size
+            )
+        return Endpoint(
+            url,
+            TritonClientPool(
+                url,
+                self.pool_size,
+                self.timeout,
+                0,
+                shared_memory=shared_memory,
+                compression=self.compression,
+                compression_min_bytes=self.compression_min_bytes,
+            ),
+        )
+
+    async def _pick(self, tried: Sequence[Endpoint]) -> Endpoint:
+        """Get the available endpoint with the fewest outstanding requests.
+
+        Endpoints already tried by the request are avoided if possible. If no
+        endpoint is available, all of them are candidates rather than none.
+        """
+        if self._watcher is None:
+            self._watcher = asyncio.ensure_future(self._watch())
+        if not self.endpoints:
+            await self.refresh()
+            if not self.endpoints:
+                raise InferenceServerException(
+                    "No Triton endpoint resolved.", status="StatusCode.UNAVAILABLE"
+                )
+
+        now = time.monotonic()
+        endpoints = list(self.endpoints.values())
+        candidates = [e for e in endpoints if e.available(now)] or endpoints
+        candidates = [e for e in candidates if e not in tried] or candidates
+        random.shuffle(candidates)  # Break ties without favouring the first.
+        endpoint = min(candidates, key=lambda e: e.outstanding)
+        endpoint.requests += 1
+        return endpoint
+
+    def _record_failure(self, endpoint: Endpoint) -> None:
+        """Count a failure of the endpoint and eject it after too many."""
+        endpoint.failures += 1
+        if endpoint.failures >= self.eject_after:
+            endpoint.ejected_until = time.monotonic() + self.eject_time
+
+    async def _is_ready(self, endpoint: Endpoint) -> bool:
+        """Check whether the server and all the models are ready."""
+        client = endpoint.client.get_client()
+        try:
+            if not await client.is_server_ready(client_timeout=self.health_interval):
+                return False
+            ready = await asyncio.gather(
+                *(
+                    client.is_model_ready(
+                        model_name, client_timeout=self.health_interval
+                    )
+                    for model_name in self.model_names
+                )
+            )
+            return all(ready)
+        except Exception:  # pylint: disable=broad-except
+            return False
+
+    async def _watch(self) -> None:
+        """Check the health and refresh the endpoints in the background."""
+        loop = asyncio.get_running_loop()
+        next_refresh = loop.time() + self.refresh_interval
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                if self.dns_names and loop.time() >= next_refresh:
+                    next_refresh = loop.time() + self.refresh_interval
+                    await self.refresh()
+                await self.check_health()
+                await self._close_drained()
+            except Exception as exception:  # pylint: disable=broad-except
+                print(exception)
+
+    async def _close_drained(self) -> None:
+        """Close the channels of removed endpoints once they are idle."""
+        idle = [e for e in self._draining if e.outstanding == 0]
+        self._draining = [e for e in self._draining if e.outstanding > 0]
+        await asyncio.gather(*(endpoint.client.close() for endpoint in idle))
+
+
+def _parse_urls(urls: str) -> Tuple[List[str], List[Tuple[str, int]]]:
+    """Split the endpoints into static URLs and DNS names to resolve."""
+    static_urls, dns_names = [], []
+    for url in filter(None, (url.strip() for url in urls.split(","))):
+        if url.startswith(DNS_PREFIX):
+            host, _, port = url[len(DNS_PREFIX) :].lstrip("/").rpartition(":")
+            dns_names.append((host, int(port)))
+        else:
+            static_urls.append(url)
+    return static_urls, dns_names
+
+
+async def _resolve(host: str, port: int) -> List[str]:
+    """Get the host:port of every address of the host."""
+    loop = asyncio.get_running_loop()
+    try:
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except socket.gaierror as exception:
+        print(exception)
+        return []
+    urls = []
+    for family, *_, address in infos:
+        ip = address[0]
+        urls.append(f"[{ip}]:{port}" if family == socket.AF_INET6 else f"{ip}:{port}")
+    return sorted(set(urls))
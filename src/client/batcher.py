@@ -0,0 +1,142 @@
+"""Coalesce concurrent generations into batched ensemble requests."""
+import asyncio
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import tritonclient.grpc as grpcclient
+
+from request_builder import GenerationRequest, RequestTemplate
+from router import Lane
+
+Outputs = Dict[str, np.ndarray]
+Pending = Tuple[GenerationRequest, asyncio.Future, Dict[str, Any]]
+
+
+class MicroBatcher:
+    """Collect requests for a short window and send them as one batch.
+
+    A batch is sent once it has max_batch_size requests or its first request
+    has waited max_wait seconds. Only requests with the same batch key share a
+    batch. The template builds the requests of the model, the ensemble by
+    default. A batch gets the highest priority and the longest client timeout
+    of its requests, and their request IDs. A cancelled request gives up its
+    row, but a batch in flight runs on as long as one of its requests waits.
+    """
+
+    def __init__(
+        self,
+        client: Lane,
+        model_name: str = "ensemble",
+        max_batch_size: int = 8,
+        max_wait: float = 0.005,
+        template: Optional[RequestTemplate] = None,
+    ) -> None:
+        """Initialize."""
+        self.client = client
+        self.model_name = model_name
+        self.template = template or RequestTemplate()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending: Dict[Tuple, List[Pending]] = {}
+        self._timers: Dict[Tuple, asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, request: GenerationRequest, **options: Any) -> Outputs:
+        """Generate the completion of the request within a batch.
+
+        The options are those of the inference, i.e. priority, client_timeout
+        and request_id. Headers are not sent, since a batch has many parents.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = request.batch_key
+        batch = self._pending.setdefault(key, [])
+        batch.append((request, future, options))
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key: Tuple) -> None:
+        """Send the pending batch of the key."""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: List[Pending]) -> None:
+        """Send a batch and hand each caller its own rows.
+
+        The requests cancelled while they waited are left out, and the batch
+        is cancelled in flight once all of its requests are.
+        """
+        batch = [pending for pending in batch if not pending[1].cancelled()]
+        if not batch:
+            return
+        task = asyncio.current_task()
+
+        def abandon(_: asyncio.Future) -> None:
+            """Cancel the batch if nobody waits for it any more."""
+            if task is not None and all(future.cancelled() for _, future, _ in batch):
+                task.cancel()
+
+        for _, future, _ in batch:
+            future.add_done_callback(abandon)
+        requests = [request for request, _, _ in batch]
+        try:
+            result = await self.client.infer(
+                self.model_name,
+                self.template.inputs(requests),
+                self.template.outputs(requests),
+                **batch_options([options for _, _, options in batch]),
+            )
+            outputs = [
+                self.template.completion(output)
+                for output in split_outputs(result, len(batch))
+            ]
+        except Exception as exception:  # pylint: disable=broad-except
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exception)
+            return
+        for (_, future, _), output in zip(batch, outputs):
+            if not future.done():
+                future.set_result(output)
+
+
+def split_outputs(result: grpcclient.InferResult, batch_size: int) -> List[Outputs]:
+    """Split the batched outputs into the outputs of each request.
+
+    Outputs are either [N, ...] or flattened to [N * beams, ...].
+    """
+    splits: List[Outputs] = [{} for _ in range(batch_size)]
+    for output in result.get_response().outputs:
+        array = result.as_numpy(output.name)
+        rows = array.shape[0] // batch_size
+        for i, split in enumerate(splits):
+            split[output.name] = array[i * rows : (i + 1) * rows]
+    return splits
+
+
+def batch_options(options: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Get the highest priority and the longest client timeout of the requests.
+
+    Priority 0 is the default level of the model, which is not the highest.
+    The request ID is those of the requests joined by commas.
+    """
+    merged: Dict[str, Any] = {}
+    priorities = [o["priority"] for o in options if o.get("priority")]
+    if priorities:
+        merged["priority"] = min(priorities)
+    timeouts = [o["client_timeout"] for o in options if "client_timeout" in o]
+    if timeouts:
+        merged["client_timeout"] = max(timeouts)
+    request_ids = [o["request_id"] for o in options if o.get("request_id")]
+    if request_ids:
+        merged["request_id"] = ",".join(request_ids)
+    return merged
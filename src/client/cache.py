@@ -0,0 +1,244 @@
+"""A response cache for deterministic (seeded) generations.
+
+Every request carries its random seed, so the same prompt with the same
+sampling parameters always produces the same completion. Responses are kept
+in an in-process LRU and, optionally, in a SQLite file that the client
+replicas on the same node share.
+"""
+import asyncio
+import dataclasses
+import hashlib
+import json
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import numpy as np
+from tritonclient.utils import (
+    deserialize_bytes_tensor,
+    np_to_triton_dtype,
+    serialize_byte_tensor,
+    triton_to_np_dtype,
+)
+
+from batcher import Outputs
+from request_builder import GenerationRequest
+
+
+@dataclasses.dataclass
+class CacheStats:
+    """Cache counters."""
+
+    hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    coalesced: int = 0
+    bytes_saved: int = 0
+
+
+class LRUCache:
+    """An LRU cache of bytes with TTL and byte-size eviction."""
+
+    def __init__(self, max_bytes: int, ttl: float) -> None:
+        """Initialize."""
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get the value of a key if it has not expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: bytes) -> None:
+        """Put a value and evict the least recently used ones over the budget."""
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        """Remove a key."""
+        _, value = self._entries.pop(key)
+        self.size -= len(value)
+
+
+class DiskCache:
+    """A SQLite cache of bytes shared by the processes on a node."""
+
+    def __init__(self, path: str, max_bytes: int, ttl: float) -> None:
+        """Initialize."""
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires_at REAL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_expires_at ON responses(expires_at)"
+        )
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Get the value of a key if it has not expired."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM responses WHERE key = ? AND expires_at >= ?",
+                (key, time.time()),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key: str, value: bytes) -> None:
+        """Put a value and evict the expired and the oldest ones over the budget."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, value, len(value), now + self.ttl),
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at < ?", (now,))
+            (size,) = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            if size > self.max_bytes:
+                # Drop the quarter of the entries that expire first.
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY expires_at "
+                    "LIMIT (SELECT COUNT(*) / 4 + 1 FROM responses))"
+                )
+
+
+class ResponseCache:
+    """Serve repeated requests from the cache and coalesce the ones in flight."""
+
+    def __init__(
+        self,
+        max_bytes: int = 64 * 2**20,
+        ttl: float = 3600.0,
+        path: Optional[str] = None,
+        disk_max_bytes: int = 1024 * 2**20,
+    ) -> None:
+        """Initialize."""
+        self.stats = CacheStats()
+        self._memory = LRUCache(max_bytes, ttl)
+        self._disk = DiskCache(path, disk_max_bytes, ttl) if path else None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+
+    async def get_or_generate(
+        self,
+        request: GenerationRequest,
+        generate: Callable[[GenerationRequest], Awaitable[Outputs]],
+    ) -> Outputs:
+        """Get the cached outputs of the request or generate them once."""
+        key = request_key(request)
+        value = self._memory.get(key)
+        if value is not None:
+            self.stats.hits += 1
+            self.stats.bytes_saved += len(value)
+            return decode_outputs(value)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._load(key, request, generate))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await self._wait(task)
+
+    async def _wait(self, task: asyncio.Future) -> Outputs:
+        """Wait for a shared generation, which is cancelled with its last waiter.
+
+        A cancelled waiter leaves the generation to the others, if any.
+        """
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                task.cancel()
+
+    async def _load(
+        self,
+        key: str,
+        request: GenerationRequest,
+        generate: Callable[[GenerationRequest], Awaitable[Outputs]],
+    ) -> Outputs:
+        """Load the outputs from the disk or generate them."""
+        if self._disk is not None:
+            value = await asyncio.get_running_loop().run_in_executor(
+                None, self._disk.get, key
+            )
+            if value is not None:
+                self.stats.disk_hits += 1
+                self.stats.bytes_saved += len(value)
+                self._memory.put(key, value)
+                return decode_outputs(value)
+
+        self.stats.misses += 1
+        outputs = await generate(request)
+        value = encode_outputs(outputs)
+        self._memory.put(key, value)
+        if self._disk is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self._disk.put, key, value
+            )
+        return outputs
+
+
+def request_key(request: GenerationRequest) -> str:
+    """Get the cache key of the prompt and all the sampling parameters."""
+    fields = json.dumps(dataclasses.asdict(request), sort_keys=True)
+    return hashlib.sha256(fields.encode("utf-8")).hexdigest()
+
+
+def encode_outputs(outputs: Outputs) -> bytes:
+    """Serialize the outputs as a JSON header followed by the raw tensors."""
+    header, chunks = [], []
+    for name, array in outputs.items():
+        if array.dtype == np.object_:
+            raw = serialize_byte_tensor(array).item() if array.size else b""
+        else:
+            raw = np.ascontiguousarray(array).tobytes()
+        header.append([name, np_to_triton_dtype(array.dtype), array.shape, len(raw)])
+        chunks.append(raw)
+    encoded_header = json.dumps(header).encode("utf-8")
+    return struct.pack("<I", len(encoded_header)) + encoded_header + b"".join(chunks)
+
+
+def decode_outputs(value: bytes) -> Outputs:
+    """Deserialize the outputs."""
+    (header_size,) = struct.unpack_from("<I", value)
+    offset = 4 + header_size
+    outputs = {}
+    for name, datatype, shape, size in json.loads(value[4:offset]):
+        raw = value[offset : offset + size]
+        offset += size
+        if datatype == "BYTES":
+            array = deserialize_bytes_tensor(raw) if size else np.array([], object)
+        else:
+            array = np.frombuffer(raw, dtype=triton_to_np_dtype(datatype))
+        outputs[name] = array.reshape(shape)
+    return outputs
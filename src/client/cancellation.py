@@ -0,0 +1,99 @@
+"""Cancellation of the chat requests that nobody waits for any more.
+
+A request is abandoned when its session submits another prompt, which
+supersedes it, or when the browser disconnects. Each request is generated in
+a task, so that cancelling it frees its place in the scheduler queue, its
+slots, and its RPC to Triton, which is cancelled or whose stream is closed.
+Gradio only notices a disconnect when the generator of the event yields, so
+the caller yields the response at least every heartbeat while it waits.
+
+Each cancellation is counted as client_cancelled_requests{reason}, and the
+estimated generation time that the request had left as
+client_cancelled_generation_seconds{reason}.
+"""
+import asyncio
+import time
+from typing import Coroutine, Dict, Hashable, Optional
+
+from metrics import CANCELLED, CANCELLED_SECONDS
+
+
+class Generation:
+    """A chat request in flight, with the estimate of its generation time."""
+
+    def __init__(self) -> None:
+        """Initialize."""
+        self.task: Optional[asyncio.Task] = None
+        self.reason: Optional[str] = None
+        self.seconds = 0.0
+        self.started: Optional[float] = None
+        self._updated = asyncio.Event()
+
+    def run(self, coroutine: Coroutine) -> asyncio.Task:
+        """Run the generation in a task."""
+        self.task = asyncio.ensure_future(coroutine)
+        return self.task
+
+    def estimate(self, seconds: float) -> None:
+        """Set the estimated generation time, before the request is queued."""
+        self.seconds = seconds
+
+    def start(self) -> None:
+        """Mark the start of the generation."""
+        self.started = time.perf_counter()
+
+    def remaining(self) -> float:
+        """Estimate the generation seconds left, all of them until it starts."""
+        if self.started is None:
+            return self.seconds
+        return max(self.seconds - (time.perf_counter() - self.started), 0.0)
+
+    def update(self) -> None:
+        """Signal a new partial response."""
+        self._updated.set()
+
+    async def wait(self, timeout: Optional[float]) -> bool:
+        """Wait for a partial response, the end or the timeout, and tell if done."""
+        assert self.task is not None
+        updated = asyncio.ensure_future(self._updated.wait())
+        try:
+            await asyncio.wait(
+                {self.task, updated},
+                timeout=timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            updated.cancel()
+        self._updated.clear()
+        return self.task.done()
+
+    def cancel(self, reason: str) -> None:
+        """Cancel the task unless it is done, and record why."""
+        if self.task is None or self.task.done() or self.reason is not None:
+            return
+        self.reason = reason
+        self.task.cancel()
+        CANCELLED.labels(reason).inc()
+        CANCELLED_SECONDS.labels(reason).inc(self.remaining())
+
+
+class Generations:
+    """The chat request in flight of each session, superseded by the next one."""
+
+    def __init__(self) -> None:
+        """Initialize."""
+        self._active: Dict[Hashable, Generation] = {}
+
+    def start(self, flow: Hashable) -> Generation:
+        """Cancel the generation of the flow, e.g. a session, and begin a new one."""
+        previous = self._active.get(flow)
+        if previous is not None:
+            previous.cancel("superseded")
+        generation = Generation()
+        self._active[flow] = generation
+        return generation
+
+    def finish(self, flow: Hashable, generation: Generation) -> None:
+        """Forget the generation unless a newer one of the flow replaced it."""
+        if self._active.get(flow) is generation:
+            del self._active[flow]
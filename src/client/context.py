@@ -0,0 +1,200 @@
+"""Multi-turn context of the chat under a token budget.
+
+The prompt of a turn is the code of the earlier turns of the session followed
+by the new text. The newest turns that fit in the budget are kept. Older turns
+are dropped, or with the "summarize" policy, reduced to their imports and
+top-level definitions while those fit.
+
+Each session caches the token counts of its turns, so a turn only tokenizes
+its new text: the count of a completion is that of its prompt plus the
+generated tokens. The counts of the turns are summed, which may differ from
+the count of the joined text by a token at each boundary. With a budget of 0,
+the text is not counted at all, and its tokens are estimated from its length.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+
+import numpy as np
+
+from request_builder import RequestTemplate
+
+# The maximum sequence length of CodeGen: the prompt and the generated tokens.
+MAX_SEQUENCE_LENGTH = 2048
+SEPARATOR = "\n\n"
+SEPARATOR_TOKENS = 1
+# Characters of a token of code on average, to estimate the tokens uncounted.
+CHARS_PER_TOKEN = 3
+POLICIES = ("truncate", "summarize")
+# Lines of a turn kept by the summarize policy.
+SUMMARY_PREFIXES = ("import ", "from ", "def ", "async def ", "class ", "@")
+
+# Count the tokens of each text.
+TokenCounter = Callable[[Sequence[str]], Awaitable[List[int]]]
+
+
+@dataclass
+class Turn:
+    """The code of a turn and its token count."""
+
+    text: str
+    tokens: int
+    # The summary and its token count, once the turn is summarized.
+    summary: Optional[str] = None
+    summary_tokens: int = 0
+
+
+@dataclass
+class ChatSession:
+    """The turns of a chat session."""
+
+    turns: List[Turn] = field(default_factory=list)
+
+
+@dataclass
+class Context:
+    """The prompt of a turn."""
+
+    prompt: str
+    # The earlier turns in front of the text of the turn.
+    prefix: str
+    tokens: int
+    text_tokens: int
+
+    def reply(self, output: str) -> str:
+        """Cut the earlier turns off the completion, which repeats the prompt."""
+        if output.startswith(self.prefix):
+            return output[len(self.prefix) :]
+        return output
+
+
+@dataclass
+class ContextStats:
+    """Counters of the built prompts."""
+
+    requests: int = 0
+    turns_kept: int = 0
+    turns_summarized: int = 0
+    turns_dropped: int = 0
+    counted_texts: int = 0
+
+
+class ContextBuilder:
+    """Build the prompts of the turns of chat sessions."""
+
+    def __init__(
+        self, count_tokens: TokenCounter, budget: int, policy: str = "truncate"
+    ) -> None:
+        """Initialize.
+
+        The budget is the maximum number of prompt tokens, and 0 sends the text
+        of the turn alone.
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown context policy '{policy}': {POLICIES}")
+        self.count_tokens = count_tokens
+        self.budget = budget
+        self.policy = policy
+        self.stats = ContextStats()
+
+    async def build(self, session: ChatSession, text: str, max_tokens: int) -> Context:
+        """Get the prompt of a turn that leaves room for max_tokens."""
+        self.stats.requests += 1
+        if not self.budget:
+            tokens = -(-len(text) // CHARS_PER_TOKEN)
+            return Context(text, "", tokens, tokens)
+        budget = min(self.budget, MAX_SEQUENCE_LENGTH - max_tokens)
+        [text_tokens] = await self._count([text])
+        used = text_tokens
+        kept: List[str] = []
+        turns = session.turns
+        index = len(turns)
+        while index > 0 and used + turns[index - 1].tokens + SEPARATOR_TOKENS <= budget:
+            index -= 1
+            kept.append(turns[index].text)
+            used += turns[index].tokens + SEPARATOR_TOKENS
+        self.stats.turns_kept += len(kept)
+
+        if self.policy == "summarize" and index > 0:
+            await self._summarize(turns[:index])
+            while index > 0:
+                turn = turns[index - 1]
+                cost = turn.summary_tokens + SEPARATOR_TOKENS
+                if not turn.summary or used + cost > budget:
+                    break
+                index -= 1
+                kept.append(turn.summary)
+                used += cost
+                self.stats.turns_summarized += 1
+        self.stats.turns_dropped += index
+
+        prefix = "".join(part + SEPARATOR for part in reversed(kept))
+        return Context(prefix + text, prefix, used, text_tokens)
+
+    def add(
+        self, session: ChatSession, context: Context, reply: str, generated: int
+    ) -> None:
+        """Add a completed turn to the session."""
+        session.turns.append(Turn(reply, context.text_tokens + generated))
+
+    async def _summarize(self, turns: Sequence[Turn]) -> None:
+        """Summarize the turns that are not yet and count their tokens."""
+        turns = [turn for turn in turns if turn.summary is None]
+        summaries = [summarize(turn.text) for turn in turns]
+        counts = iter(await self._count([summary for summary in summaries if summary]))
+        for turn, summary in zip(turns, summaries):
+            turn.summary = summary
+            turn.summary_tokens = next(counts) if summary else 0
+
+    async def _count(self, texts: List[str]) -> List[int]:
+        """Count the tokens of the texts."""
+        if not texts:
+            return []
+        self.stats.counted_texts += len(texts)
+        return await self.count_tokens(texts)
+
+
+class TritonTokenCounter:
+    """Count tokens with the preprocessing model, which tokenizes the prompts."""
+
+    def __init__(self, client: Any, model_name: str = "preprocessing") -> None:
+        """Initialize.
+
+        The client is a TritonClientPool or an EndpointBalancer.
+        """
+        self.client = client
+        self.model_name = model_name
+        self.template = RequestTemplate()
+
+    async def __call__(self, texts: Sequence[str]) -> List[int]:
+        """Count the tokens of each text."""
+        rows = len(texts)
+        arrays = {
+            "QUERY": np.array([[text] for text in texts], dtype=object),
+            "REQUEST_OUTPUT_LEN": np.ones((rows, 1), np.uint32),
+            "BAD_WORDS_DICT": np.full((rows, 1), "", dtype=object),
+            "STOP_WORDS_DICT": np.full((rows, 1), "", dtype=object),
+        }
+        inputs = [
+            self.template.prepare_tensor(name, array) for name, array in arrays.items()
+        ]
+        result = await self.client.infer(self.model_name, inputs)
+        return result.as_numpy("REQUEST_INPUT_LEN").reshape(-1).tolist()
+
+
+class LocalTokenCounter:
+    """Count tokens with the tokenizer of the client."""
+
+    def __init__(self, tokenizer: Any) -> None:
+        """Initialize."""
+        self.tokenizer = tokenizer
+
+    async def __call__(self, texts: Sequence[str]) -> List[int]:
+        """Count the tokens of each text."""
+        return [len(self.tokenizer.encode(text)) for text in texts]
+
+
+def summarize(text: str) -> str:
+    """Keep the imports and the top-level definitions of the code."""
+    return "\n".join(
+        line for line in text.splitlines() if line.startswith(SUMMARY_PREFIXES)
+    )
@@ -0,0 +1,90 @@
+"""Requests to the FasterTransformer model with client-side tokenization.
+
+The ensemble runs the preprocessing and postprocessing Python models on the
+CPUs of the Triton pod around every generation. In the direct mode, the client
+tokenizes the prompts and the stop words and detokenizes the generated ids
+itself, so that work scales with the client pods instead.
+"""
+from functools import lru_cache
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+import tritonclient.grpc as grpcclient
+
+from request_builder import (
+    CONSTANT_TENSORS,
+    REQUEST_TENSORS,
+    GenerationRequest,
+    RequestTemplate,
+    output_names,
+)
+from tokenizer import BPETokenizer
+
+MODEL_NAME = "codegen-350M-mono-gptj"
+# The inputs of the ensemble that it passes to the model as they are.
+SAMPLING_TENSORS = tuple(t for t in REQUEST_TENSORS if not t[0].startswith("INPUT_"))
+MODEL_CONSTANT_TENSORS = tuple(
+    t for t in CONSTANT_TENSORS if not t[0].startswith("INPUT_")
+)
+# The ensemble outputs of the model outputs.
+ENSEMBLE_OUTPUTS = {"output_ids": "OUTPUT_0"}
+MODEL_OUTPUTS = {name: output for output, name in ENSEMBLE_OUTPUTS.items()}
+
+
+class DirectTemplate(RequestTemplate):
+    """A precompiled request of the FasterTransformer model.
+
+    The prompts are tokenized with the cache of the tokenizer, and the stop
+    words are packed once per combination. The bad words are left out, since
+    the client never sets them.
+    """
+
+    def __init__(self, tokenizer: BPETokenizer, cache_size: int = 4096) -> None:
+        """Initialize."""
+        super().__init__(grpcclient.InferInput, cache_size)
+        self.tokenizer = tokenizer
+        self._stop_words = lru_cache(maxsize=cache_size)(self._build_stop_words)
+
+    def inputs(self, requests: Sequence[GenerationRequest]) -> List[Any]:
+        """Get the inputs of the model for the requests."""
+        input_ids, input_lengths = self.tokenizer.encode_batch(
+            [r.prompt for r in requests]
+        )
+        inputs = [
+            self.prepare_tensor("input_ids", input_ids),
+            self.prepare_tensor("input_lengths", input_lengths),
+            self._tensor(
+                "request_output_len", tuple(r.max_tokens for r in requests), np.uint32
+            ),
+        ]
+        stop_words = tuple(r.stop_words for r in requests)
+        if any(stop_words):
+            inputs.append(self._stop_words(stop_words))
+        for name, field, dtype in SAMPLING_TENSORS:
+            values = tuple(getattr(r, field) for r in requests)
+            inputs.append(self._tensor(name, values, dtype))
+        for name, value, dtype in MODEL_CONSTANT_TENSORS:
+            inputs.append(self._tensor(name, (value,) * len(requests), dtype))
+        return inputs
+
+    def outputs(
+        self, requests: Sequence[GenerationRequest]
+    ) -> List[grpcclient.InferRequestedOutput]:
+        """Get the outputs of the model the requests need."""
+        names = tuple(MODEL_OUTPUTS.get(n, n) for n in output_names(requests))
+        return self._outputs(names)
+
+    def completion(self, outputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Decode the generated ids into the text of the ensemble."""
+        completion = {}
+        for name, array in outputs.items():
+            if name in ENSEMBLE_OUTPUTS:
+                name, array = ENSEMBLE_OUTPUTS[name], self.tokenizer.decode_batch(array)
+            completion[name] = array
+        return completion
+
+    def _build_stop_words(self, stop_words: Tuple[Tuple[str, ...], ...]) -> Any:
+        """Create the stop_words_list input of the stop words of each request."""
+        return self.prepare_tensor(
+            "stop_words_list", self.tokenizer.word_list(stop_words)
+        )
@@ -0,0 +1,124 @@
+"""Prometheus metrics of the client.
+
+They are served on their own port, since Gradio owns the app server.
+"""
+import dataclasses
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+# From a millisecond to the longest generations of 1024 tokens and beams.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+SIZE_BUCKETS = tuple(2**i for i in range(6, 25, 2))
+TOKENS_PER_SECOND_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+TOKEN_BUCKETS = tuple(2**i for i in range(3, 12))
+
+STAGE_SECONDS = Histogram(
+    "client_stage_seconds",
+    "Time spent in each stage of a chat request: queue (Gradio queue), "
+    "context (prompt of the turn), prepare (tensors), infer (Triton round "
+    "trip), decode (text) and total.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+INFLIGHT = Gauge("client_inflight_requests", "Chat requests being processed.")
+GENERATED_TOKENS = Counter("client_generated_tokens", "Generated tokens.")
+PROMPT_TOKENS = Histogram(
+    "client_prompt_tokens",
+    "Prompt tokens of a chat request, including the earlier turns.",
+    buckets=TOKEN_BUCKETS,
+)
+TOKENS_PER_SECOND = Histogram(
+    "client_tokens_per_second",
+    "Generated tokens per second of a chat request.",
+    buckets=TOKENS_PER_SECOND_BUCKETS,
+)
+PAYLOAD_BYTES = Histogram(
+    "client_payload_bytes",
+    "Tensor bytes of the requests to and the responses from Triton.",
+    ["direction"],
+    buckets=SIZE_BUCKETS,
+)
+ERRORS = Counter("client_errors", "Failed chat requests.", ["type"])
+CANCELLED = Counter("client_cancelled_requests", "Cancelled chat requests.", ["reason"])
+CANCELLED_SECONDS = Counter(
+    "client_cancelled_generation_seconds",
+    "Estimated generation seconds that the cancelled chat requests had left.",
+    ["reason"],
+)
+STARTUP_SECONDS = Gauge(
+    "client_startup_seconds",
+    "Duration of each startup phase, and the time from the start of the process "
+    "to ready.",
+    ["phase"],
+)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Observe the time spent in the block as a stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+class StatsCollector(Collector):
+    """Export the fields of stats dataclasses, e.g. CacheStats, as metrics.
+
+    Fields are counters unless they are listed as gauges.
+    """
+
+    def __init__(self) -> None:
+        """Initialize."""
+        self._stats: List[Tuple[str, Any, Dict[str, str], Sequence[str]]] = []
+
+    def add(
+        self,
+        prefix: str,
+        stats: Any,
+        labels: Dict[str, str] = None,
+        gauges: Sequence[str] = (),
+    ) -> None:
+        """Export the stats with the prefix, e.g. client_cache."""
+        self._stats.append((prefix, stats, labels or {}, gauges))
+
+    def collect(self) -> Iterator[Any]:
+        """Read the stats."""
+        families: Dict[str, Any] = {}
+        for prefix, stats, labels, gauges in self._stats:
+            for field in dataclasses.fields(stats):
+                name = f"{prefix}_{field.name}"
+                if name not in families:
+                    gauge = field.name in gauges
+                    family = GaugeMetricFamily if gauge else CounterMetricFamily
+                    families[name] = family(name, name, labels=list(labels))
+                families[name].add_metric(
+                    list(labels.values()), getattr(stats, field.name)
+                )
+        return iter(families.values())
+
+
+STATS = StatsCollector()
+REGISTRY.register(STATS)
@@ -0,0 +1,249 @@
+"""Build the requests of the ensemble model.
+
+The app, the load test and the end-to-end script share RequestTemplate, which
+builds the parts of a request that do not change only once.
+"""
+import csv
+import io
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import tritonclient.grpc as grpcclient
+from tritonclient.grpc import service_pb2
+from tritonclient.utils import np_to_triton_dtype, serialize_byte_tensor
+
+START_ID = 220
+END_ID = 50256
+
+# Stop sequences for code completion: a new top-level statement means that the
+# model has finished the function and moved on.
+STOP_PRESETS = {
+    "def": "\ndef",
+    "class": "\nclass",
+    "if __name__": "\nif __name__",
+    "print": "\nprint(",
+}
+
+# Inputs that are taken from the request fields: (input name, field, dtype).
+REQUEST_TENSORS = (
+    ("INPUT_1", "max_tokens", np.uint32),
+    ("INPUT_3", "stop_words_dict", object),
+    ("runtime_top_k", "top_k", np.uint32),
+    ("runtime_top_p", "top_p", np.float32),
+    ("temperature", "temperature", np.float32),
+    ("len_penalty", "len_penalty", np.float32),
+    ("repetition_penalty", "repetition_penalty", np.float32),
+    ("random_seed", "seed", np.uint64),
+    ("is_return_log_probs", "return_log_probs", bool),
+    ("beam_width", "beams", np.uint32),
+    ("beam_search_diversity_rate", "diversity", np.float32),
+)
+# Inputs that are the same for every request: (input name, value, dtype).
+CONSTANT_TENSORS = (
+    ("INPUT_2", "", object),
+    ("start_id", START_ID, np.uint32),
+    ("end_id", END_ID, np.uint32),
+)
+# Outputs of the ensemble. The log probs are computed only if asked for, and
+# the sequence lengths are not needed, since the text is padded.
+TEXT_OUTPUTS = ("OUTPUT_0",)
+LOG_PROB_OUTPUTS = ("cum_log_probs", "output_log_probs")
+
+
+@dataclass(frozen=True)
+class GenerationRequest:
+    """A prompt and its sampling parameters."""
+
+    prompt: str
+    max_tokens: int = 256
+    top_k: int = 3
+    top_p: float = 0.92
+    diversity: float = 0.5
+    temperature: float = 0.6
+    len_penalty: float = 0.0
+    repetition_penalty: float = 1.0
+    seed: int = 128
+    beams: int = 1
+    return_log_probs: bool = False
+    stop_words: Tuple[str, ...] = ()
+
+    @property
+    def stop_words_dict(self) -> str:
+        """Get the stop words in the STOP_WORDS_DICT format of the preprocessing.
+
+        It is a CSV row of the words, which are tokenized one by one.
+        """
+        if not self.stop_words:
+            return ""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="", quoting=csv.QUOTE_ALL)
+        writer.writerow(self.stop_words)
+        return buffer.getvalue()
+
+    @property
+    def batch_key(self) -> Tuple[int, int, bool]:
+        """Get the key of the requests that can share a batch.
+
+        FasterTransformer needs a single beam width and log probs flag per
+        batch, and rows with different output lengths would wait for the
+        longest one.
+        """
+        return self.beams, self.max_tokens, self.return_log_probs
+
+
+def output_names(requests: Sequence[GenerationRequest]) -> Tuple[str, ...]:
+    """Get the names of the outputs the requests need."""
+    if any(r.return_log_probs for r in requests):
+        return TEXT_OUTPUTS + LOG_PROB_OUTPUTS
+    return TEXT_OUTPUTS
+
+
+class RequestTemplate:
+    """A precompiled ensemble request.
+
+    The constant tensors are built once per batch size, and the sampling
+    tensors are cached by value. A request built from the template usually
+    creates nothing but its prompt tensor. The same InferInput and
+    InferRequestedOutput objects are shared by concurrent requests, so they
+    must not be modified.
+    """
+
+    def __init__(
+        self,
+        infer_input: Callable[..., Any] = grpcclient.InferInput,
+        cache_size: int = 4096,
+    ) -> None:
+        """Initialize.
+
+        infer_input is the InferInput class of the protocol, gRPC by default.
+        """
+        self.infer_input = infer_input
+        self._outputs = lru_cache(maxsize=None)(self._build_outputs)
+        self._tensor = lru_cache(maxsize=cache_size)(self._build_tensor)
+        self._http_tensor = lru_cache(maxsize=cache_size)(self._build_http_tensor)
+
+    def inputs(self, requests: Sequence[GenerationRequest]) -> List[Any]:
+        """Get the [N, 1] inputs of the requests."""
+        prompts = np.array([[r.prompt] for r in requests], dtype=object)
+        inputs = [self.prepare_tensor("INPUT_0", prompts)]
+        for name, field, dtype in REQUEST_TENSORS:
+            values = tuple(getattr(r, field) for r in requests)
+            inputs.append(self._tensor(name, values, dtype))
+        for name, value, dtype in CONSTANT_TENSORS:
+            inputs.append(self._tensor(name, (value,) * len(requests), dtype))
+        return inputs
+
+    def outputs(
+        self, requests: Sequence[GenerationRequest]
+    ) -> List[grpcclient.InferRequestedOutput]:
+        """Get the gRPC outputs the requests need."""
+        return self._outputs(output_names(requests))
+
+    def completion(self, outputs: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Get the ensemble outputs of the outputs of a request."""
+        return outputs
+
+    def http_body(
+        self,
+        requests: Sequence[GenerationRequest],
+        outputs: Optional[Sequence[str]] = None,
+    ) -> Tuple[bytes, int]:
+        """Get the binary HTTP/REST body of the requests.
+
+        The outputs are those the requests need unless they are given. It
+        returns the body and the size of its JSON header, which is sent as the
+        Inference-Header-Content-Length header.
+        """
+        prompts = np.array([[r.prompt] for r in requests], dtype=object)
+        tensors = [self._build_http_tensor("INPUT_0", prompts, object)]
+        for name, field, dtype in REQUEST_TENSORS:
+            values = tuple(getattr(r, field) for r in requests)
+            tensors.append(self._http_tensor(name, values, dtype))
+        for name, value, dtype in CONSTANT_TENSORS:
+            tensors.append(self._http_tensor(name, (value,) * len(requests), dtype))
+
+        parameters = b'"outputs":' + json.dumps(
+            [
+                {"name": name, "parameters": {"binary_data": True}}
+                for name in outputs or output_names(requests)
+            ]
+        ).encode("utf-8")
+        header = (
+            b'{"inputs":['
+            + b",".join(metadata for metadata, _ in tensors)
+            + b"],"
+            + parameters
+            + b"}"
+        )
+        return header + b"".join(raw for _, raw in tensors), len(header)
+
+    def grpc_body(
+        self, requests: Sequence[GenerationRequest], model_name: str = "ensemble"
+    ) -> bytes:
+        """Get the serialized gRPC ModelInferRequest of the requests.
+
+        The template must be created with the gRPC InferInput.
+        """
+        body = service_pb2.ModelInferRequest(model_name=model_name)
+        # pylint: disable=protected-access
+        for infer_input in self.inputs(requests):
+            body.inputs.append(infer_input._get_tensor())
+            if infer_input._get_content() is not None:
+                body.raw_input_contents.append(infer_input._get_content())
+        for output in self.outputs(requests):
+            body.outputs.append(output._get_tensor())
+        return body.SerializeToString()
+
+    def prepare_tensor(self, name: str, tensor: np.ndarray) -> Any:
+        """Create a triton input."""
+        infer_input = self.infer_input(
+            name, tensor.shape, np_to_triton_dtype(tensor.dtype)
+        )
+        infer_input.set_data_from_numpy(tensor)
+        return infer_input
+
+    def _build_tensor(self, name: str, values: Tuple, dtype: Any) -> Any:
+        """Create a [N, 1] triton input of the values."""
+        return self.prepare_tensor(name, np.array(values, dtype=dtype).reshape(-1, 1))
+
+    @staticmethod
+    def _build_outputs(names: Tuple[str, ...]) -> List[grpcclient.InferRequestedOutput]:
+        """Create the gRPC outputs of the names."""
+        return [grpcclient.InferRequestedOutput(name) for name in names]
+
+    def _build_http_tensor(
+        self, name: str, values: Any, dtype: Any
+    ) -> Tuple[bytes, bytes]:
+        """Serialize the JSON metadata and the binary data of a [N, 1] tensor."""
+        tensor = np.array(values, dtype=dtype).reshape(-1, 1)
+        if tensor.dtype == np.object_:
+            raw = serialize_byte_tensor(tensor).item()
+        else:
+            raw = tensor.tobytes()
+        metadata = {
+            "name": name,
+            "shape": list(tensor.shape),
+            "datatype": np_to_triton_dtype(tensor.dtype),
+            "parameters": {"binary_data_size": len(raw)},
+        }
+        return json.dumps(metadata).encode("utf-8"), raw
+
+
+_TEMPLATE = RequestTemplate()
+
+
+def build_ensemble_inputs(
+    requests: Sequence[GenerationRequest],
+) -> List[grpcclient.InferInput]:
+    """Stack the requests into the [N, 1] gRPC inputs of the ensemble model."""
+    return _TEMPLATE.inputs(requests)
+
+
+def build_ensemble_outputs(
+    requests: Sequence[GenerationRequest],
+) -> List[grpcclient.InferRequestedOutput]:
+    """Get the gRPC outputs of the ensemble model that the requests need."""
+    return _TEMPLATE.outputs(requests)
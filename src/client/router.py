@@ -0,0 +1,165 @@
+"""Route requests to separate backends by their output length.
+
+Short completions would otherwise wait in the same dynamic batcher as 512 and
+1024-token requests. Each lane has its own endpoint (or model) and its own
+concurrency limit, so the short and the long lanes can be sized and scaled
+separately.
+"""
+import asyncio
+import json
+import math
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import tritonclient.grpc as grpcclient
+
+from balancer import EndpointBalancer
+from request_builder import GenerationRequest
+
+
+@dataclass
+class LaneStats:
+    """Counters of a lane."""
+
+    requests: int = 0
+    waiting: int = 0
+    queue_seconds: float = 0.0
+
+
+class Lane:
+    """A backend for a class of requests with its own concurrency limit."""
+
+    def __init__(
+        self,
+        name: str,
+        client: EndpointBalancer,
+        max_tokens: float = math.inf,
+        max_beams: float = math.inf,
+        concurrency: int = 256,
+        model: Optional[str] = None,
+    ) -> None:
+        """Initialize.
+
+        A request belongs to the lane if its max_tokens and beams are within
+        the bounds. model overrides the model requested by the caller.
+        """
+        self.name = name
+        self.client = client
+        self.max_tokens = max_tokens
+        self.max_beams = max_beams
+        self.concurrency = concurrency
+        self.model = model
+        self.stats = LaneStats()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def accepts(self, request: GenerationRequest) -> bool:
+        """Check whether the request belongs to the lane."""
+        return request.max_tokens <= self.max_tokens and request.beams <= self.max_beams
+
+    async def infer(
+        self,
+        model_name: str,
+        inputs: Sequence[grpcclient.InferInput],
+        outputs: Optional[Sequence[grpcclient.InferRequestedOutput]] = None,
+        **kwargs: Any,
+    ) -> grpcclient.InferResult:
+        """Run an inference once a slot of the lane is free."""
+        async with self._slot():
+            return await self.client.infer(
+                self.model or model_name, inputs, outputs=outputs, **kwargs
+            )
+
+    async def stream_infer(
+        self,
+        model_name: str,
+        inputs: Sequence[grpcclient.InferInput],
+        outputs: Optional[Sequence[grpcclient.InferRequestedOutput]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[grpcclient.InferResult]:
+        """Run a streaming inference once a slot of the lane is free."""
+        async with self._slot():
+            stream = self.client.stream_infer(
+                self.model or model_name, inputs, outputs=outputs, **kwargs
+            )
+            try:
+                async for result in stream:
+                    yield result
+            finally:
+                await stream.aclose()
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncIterator[None]:
+        """Hold one of the concurrency slots and record the time waited for it."""
+        if self._semaphore is None:  # Bind it to the running loop.
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+        self.stats.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.stats.waiting -= 1
+        try:
+            self.stats.requests += 1
+            self.stats.queue_seconds += time.perf_counter() - start
+            yield
+        finally:
+            self._semaphore.release()
+
+
+class Router:
+    """Pick the first lane that accepts a request, or the last lane."""
+
+    def __init__(self, lanes: Sequence[Lane]) -> None:
+        """Initialize."""
+        if not lanes:
+            raise ValueError("At least one lane is required.")
+        self.lanes = list(lanes)
+
+    def route(self, request: GenerationRequest) -> Lane:
+        """Get the lane of the request."""
+        for lane in self.lanes:
+            if lane.accepts(request):
+                return lane
+        return self.lanes[-1]
+
+    @classmethod
+    def from_config(
+        cls, config: str, default_url: str, concurrency: int, **client_kwargs: Any
+    ) -> "Router":
+        """Create the lanes from a JSON list, or a single lane if it is empty.
+
+        Each lane is an object with "name" and optionally "url", "max_tokens",
+        "max_beams", "concurrency" and "model". The URL is a list of endpoints
+        for EndpointBalancer, and lanes on the same URL share a balancer, which
+        checks the readiness of the models of those lanes. model_name is the
+        model of the lanes without one.
+        """
+        specs: List[Dict[str, Any]] = json.loads(config) if config else []
+        if not specs:
+            specs = [{"name": "default"}]
+        model_name = client_kwargs.pop("model_name", "ensemble")
+        models: Dict[str, List[str]] = {}
+        for spec in specs:
+            url_models = models.setdefault(spec.get("url", default_url), [])
+            if spec.get("model", model_name) not in url_models:
+                url_models.append(spec.get("model", model_name))
+        clients = {
+            url: EndpointBalancer(url, model_names, **client_kwargs)
+            for url, model_names in models.items()
+        }
+        lanes = []
+        for spec in specs:
+            url = spec.get("url", default_url)
+            lanes.append(
+                Lane(
+                    spec["name"],
+                    clients[url],
+                    max_tokens=spec.get("max_tokens", math.inf),
+                    max_beams=spec.get("max_beams", math.inf),
+                    concurrency=spec.get("concurrency", concurrency),
+                    model=spec.get("model"),
+                )
+            )
+        return cls(lanes)
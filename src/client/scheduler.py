@@ -0,0 +1,217 @@
+"""Cost-aware fair queuing of the chat requests in front of Triton.
+
+A 1024-token request with 100 beams is orders of magnitude more GPU work than
+an 8-token greedy one, so a FIFO lets a single heavy user starve the others.
+The scheduler limits the requests that run at once and queues the others by
+weighted fair queuing across sessions: each request gets the virtual finish
+tag of its session plus its cost, and the smallest tag runs first.
+
+Each request has a deadline. A request whose projected wait and run time
+exceed it is rejected at once, and a queued request whose deadline can no
+longer be met is shed, so that an overload turns into fast rejections instead
+of timeouts for everyone. The running requests get the Triton priority and the
+client timeout of their deadlines.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Hashable, List, Optional
+
+from request_builder import GenerationRequest
+
+# A prompt token costs a fraction of a generated token, since the prompt is
+# processed in a single forward pass.
+PROMPT_TOKEN_COST = 0.05
+# Triton priority levels, for a dynamic batcher with priority_levels: 2.
+HIGH_PRIORITY = 1
+LOW_PRIORITY = 2
+# Flows are forgotten once there are this many, if they are idle.
+MAX_IDLE_FLOWS = 1024
+
+
+def estimate_cost(request: GenerationRequest, prompt_tokens: int) -> float:
+    """Estimate the GPU work of a request in generated tokens."""
+    return request.beams * (request.max_tokens + PROMPT_TOKEN_COST * prompt_tokens)
+
+
+class Overloaded(Exception):
+    """A request that would not finish before its deadline."""
+
+    def __init__(self, finish_in: float, remaining: float) -> None:
+        """Initialize."""
+        super().__init__(
+            f"The server is busy: the request would finish in about {finish_in:.0f}"
+            f" s, after its deadline in {max(remaining, 0):.0f} s. Please try "
+            "again later, or with fewer tokens or beams."
+        )
+
+
+@dataclass
+class SchedulerStats:
+    """Counters of the scheduler."""
+
+    admitted: int = 0
+    rejected: int = 0
+    shed: int = 0
+    waiting: int = 0
+    queued_cost: float = 0.0
+    wait_seconds: float = 0.0
+
+
+@dataclass
+class Grant:
+    """The Triton options of a scheduled request."""
+
+    priority: int = 0
+    deadline: Optional[float] = None
+
+    def options(self) -> Dict[str, Any]:
+        """Get the priority and the client timeout of the remaining time."""
+        if self.deadline is None:
+            return {}
+        remaining = max(self.deadline - time.perf_counter(), 0.001)
+        return {"priority": self.priority, "client_timeout": remaining}
+
+
+@dataclass(order=True)
+class _Entry:
+    """A queued request, ordered by its finish tag and arrival."""
+
+    finish: float
+    sequence: int
+    start: float = field(compare=False)
+    cost: float = field(compare=False)
+    deadline: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+class FairScheduler:
+    """Run at most concurrency requests at once in weighted fair order.
+
+    The run time of a request is its cost over token_rate, the cost that a
+    request completes per second, which is learned from the completed
+    requests. A concurrency of 0 runs every request at once without options.
+    """
+
+    def __init__(
+        self, concurrency: int, token_rate: float = 200.0, smoothing: float = 0.2
+    ) -> None:
+        """Initialize."""
+        self.concurrency = concurrency
+        self.token_rate = token_rate
+        self.smoothing = smoothing
+        self.stats = SchedulerStats()
+        self._queue: List[_Entry] = []
+        self._finish: Dict[Hashable, float] = {}
+        self._virtual_time = 0.0
+        self._running = 0
+        self._running_cost = 0.0
+        self._sequence = itertools.count()
+
+    @asynccontextmanager
+    async def schedule(
+        self, flow: Hashable, cost: float, deadline: float, weight: float = 1.0
+    ) -> AsyncIterator[Grant]:
+        """Hold a slot for a request of the flow, e.g. a session.
+
+        It raises Overloaded if the request cannot finish before the deadline,
+        a time.perf_counter() value.
+        """
+        if not self.concurrency:
+            yield Grant()
+            return
+        now = time.perf_counter()
+        start = max(self._virtual_time, self._finish.get(flow, 0.0))
+        finish = start + cost / weight
+        wait = self.projected_wait(finish)
+        service = cost / self.token_rate
+        if now + wait + service > deadline:
+            self.stats.rejected += 1
+            raise Overloaded(wait + service, deadline - now)
+        self._finish[flow] = finish
+        future = asyncio.get_running_loop().create_future()
+        await self._wait(
+            _Entry(finish, next(self._sequence), start, cost, deadline, future)
+        )
+        started = time.perf_counter()
+        self.stats.admitted += 1
+        self.stats.wait_seconds += started - now
+        # Triton serves the requests close to their deadlines first.
+        priority = HIGH_PRIORITY if deadline - started < 2 * service else LOW_PRIORITY
+        try:
+            yield Grant(priority, deadline)
+            elapsed = time.perf_counter() - started
+            if elapsed > 0:
+                self.token_rate += self.smoothing * (cost / elapsed - self.token_rate)
+        finally:
+            self._release(cost)
+
+    def projected_wait(self, finish: float) -> float:
+        """Estimate the wait of a request with the finish tag.
+
+        The slots work in parallel through the requests queued ahead of it and
+        the rest of the running ones, which are half done on average.
+        """
+        ahead = sum(
+            entry.cost
+            for entry in self._queue
+            if entry.finish <= finish and not entry.future.cancelled()
+        )
+        if not ahead and self._running < self.concurrency:
+            return 0.0
+        return (ahead + self._running_cost / 2) / (self.token_rate * self.concurrency)
+
+    async def _wait(self, entry: _Entry) -> None:
+        """Queue the request until a slot is handed to it."""
+        heapq.heappush(self._queue, entry)
+        self.stats.waiting += 1
+        self.stats.queued_cost += entry.cost
+        self._dispatch()
+        try:
+            await entry.future
+        except asyncio.CancelledError:
+            # The cancellation of the caller cancels the future if it is queued.
+            if entry.future.cancelled():
+                self._dequeued(entry)
+            elif entry.future.exception() is None:
+                # The slot was handed over as the caller went away.
+                self._release(entry.cost)
+            raise
+
+    def _release(self, cost: float) -> None:
+        """Free a slot and hand it over."""
+        self._running -= 1
+        self._running_cost -= cost
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand the free slots to the queued requests in order of finish tag."""
+        while self._queue and self._running < self.concurrency:
+            entry = heapq.heappop(self._queue)
+            if entry.future.cancelled():  # Already dequeued.
+                continue
+            self._dequeued(entry)
+            now = time.perf_counter()
+            service = entry.cost / self.token_rate
+            if now + service > entry.deadline:
+                self.stats.shed += 1
+                entry.future.set_exception(Overloaded(service, entry.deadline - now))
+                continue
+            self._virtual_time = entry.start
+            self._running += 1
+            self._running_cost += entry.cost
+            entry.future.set_result(None)
+        if len(self._finish) > MAX_IDLE_FLOWS:
+            self._finish = {
+                flow: finish
+                for flow, finish in self._finish.items()
+                if finish > self._virtual_time
+            }
+
+    def _dequeued(self, entry: _Entry) -> None:
+        """Remove a request from the queue counters."""
+        self.stats.waiting -= 1
+        self.stats.queued_cost -= entry.cost
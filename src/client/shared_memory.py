@@ -0,0 +1,278 @@
+"""System shared memory transport for a client on the node of Triton.
+
+The inputs and the requested fixed-size outputs of an ensemble request are placed in a
+shared memory region registered with the server instead of the gRPC messages,
+which saves their protobuf (de)serialization on both sides. The text of the
+completion stays on the wire, since its size is not known in advance.
+"""
+import asyncio
+import os
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import tritonclient.grpc as grpcclient
+import tritonclient.grpc.aio as aiogrpcclient
+import tritonclient.utils.shared_memory as shm
+from tritonclient.utils import InferenceServerException, triton_to_np_dtype
+
+# Outputs of the ensemble in shared memory: (name, elements per beam).
+# output_log_probs has an element per requested token, the others one.
+SHM_OUTPUTS = {
+    "sequence_length": False,
+    "cum_log_probs": False,
+    "output_log_probs": True,
+}
+WIRE_OUTPUTS = ("OUTPUT_0",)
+# Outputs produced only if is_return_log_probs is set.
+LOG_PROB_OUTPUTS = ("cum_log_probs", "output_log_probs")
+# Every element of the shared memory outputs has 4 bytes.
+ELEMENT_SIZE = 4
+ALIGNMENT = 64
+# Errors after which the server may still be running the request, and so read
+# the inputs of its region and write the outputs into it.
+ABANDONED_STATUS = (
+    "StatusCode.CANCELLED",
+    "StatusCode.DEADLINE_EXCEEDED",
+    "StatusCode.UNAVAILABLE",
+)
+
+
+@dataclass
+class Region:
+    """A shared memory region registered with the server."""
+
+    name: str
+    key: str
+    byte_size: int
+    handle: Any
+
+
+class SharedMemoryResult:
+    """An inference result whose outputs are partly in shared memory.
+
+    The outputs are copied out of the region before it is reused.
+    """
+
+    def __init__(
+        self, result: grpcclient.InferResult, region: Region, offsets: Dict[str, int]
+    ) -> None:
+        """Initialize."""
+        self._result = result
+        self._arrays: Dict[str, np.ndarray] = {}
+        for output in result.get_response().outputs:
+            if output.name not in offsets:
+                continue
+            array = shm.get_contents_as_numpy(
+                region.handle,
+                triton_to_np_dtype(output.datatype),
+                list(output.shape),
+                offsets[output.name],
+            )
+            self._arrays[output.name] = np.array(array)
+
+    def as_numpy(self, name: str) -> Optional[np.ndarray]:
+        """Get an output tensor."""
+        if name in self._arrays:
+            return self._arrays[name]
+        return self._result.as_numpy(name)
+
+    def get_output(self, name: str) -> Any:
+        """Get the metadata of an output."""
+        return self._result.get_output(name)
+
+    def get_response(self) -> Any:
+        """Get the response message."""
+        return self._result.get_response()
+
+
+class SharedMemoryTransport:
+    """A pool of shared memory regions registered with a server.
+
+    The regions are registered on the first request. If the registration
+    fails, e.g. because the server is on another node, or a request does not
+    fit in a region or finds none free, infer returns None and the caller
+    sends the request over the wire.
+
+    The region of a request that is cancelled or times out is quarantined for
+    quarantine seconds before it is reused, since Triton does not tell when
+    it is done with an abandoned request, which it runs to the end.
+    """
+
+    def __init__(
+        self, regions: int = 16, byte_size: int = 2**20, quarantine: float = 120.0
+    ) -> None:
+        """Initialize."""
+        self.byte_size = byte_size
+        self.quarantine = quarantine
+        prefix = f"codegen_{os.getpid()}_{uuid.uuid4().hex[:8]}"
+        self.regions = [
+            Region(f"{prefix}_{i}", f"/{prefix}_{i}", byte_size, None)
+            for i in range(regions)
+        ]
+        self._free: Deque[Region] = deque(self.regions)
+        self._registered: Optional[bool] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def infer(
+        self,
+        client: aiogrpcclient.InferenceServerClient,
+        model_name: str,
+        inputs: Sequence[grpcclient.InferInput],
+        outputs: Optional[Sequence[grpcclient.InferRequestedOutput]] = None,
+        **kwargs: Any,
+    ) -> Optional[SharedMemoryResult]:
+        """Run an inference through shared memory if possible.
+
+        Without outputs, every output that the ensemble produces is requested.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._registered is None:
+                await self._register(client)
+        if not self._registered or not self._free:
+            return None
+        names = [output.name() for output in outputs] if outputs else None
+        layout = _layout(inputs, names)
+        if layout is None or layout[2] > self.byte_size:
+            return None
+        region = self._free.popleft()
+        # Whether the server is done with the region once this returns.
+        done = True
+        try:
+            shm_inputs, requested, offsets = self._place(region, inputs, *layout[:2])
+            done = False
+            result = await client.infer(
+                model_name, shm_inputs, outputs=requested, **kwargs
+            )
+            done = True
+            return SharedMemoryResult(result, region, offsets)
+        except InferenceServerException as exception:
+            done = exception.status() not in ABANDONED_STATUS
+            if "shared memory" not in str(exception.message()).lower():
+                raise
+            # The server may have restarted and lost the registrations.
+            self._registered = None
+            return None
+        finally:
+            if done:
+                self._free.append(region)
+            else:
+                asyncio.get_running_loop().call_later(
+                    self.quarantine, self._free.append, region
+                )
+
+    async def close(self, client: aiogrpcclient.InferenceServerClient) -> None:
+        """Unregister and destroy the regions."""
+        if self._registered:
+            for region in self.regions:
+                try:
+                    await client.unregister_system_shared_memory(region.name)
+                except InferenceServerException:
+                    pass
+        self._registered = False
+        for region in self.regions:
+            if region.handle is not None:
+                shm.destroy_shared_memory_region(region.handle)
+                region.handle = None
+
+    async def _register(self, client: aiogrpcclient.InferenceServerClient) -> None:
+        """Create the regions and register them with the server."""
+        try:
+            for region in self.regions:
+                if region.handle is None:
+                    region.handle = shm.create_shared_memory_region(
+                        region.name, region.key, region.byte_size
+                    )
+                await client.register_system_shared_memory(
+                    region.name, region.key, region.byte_size
+                )
+        except (InferenceServerException, shm.SharedMemoryException) as exception:
+            print(f"Shared memory is not available, using the wire: {exception}")
+            await self.close(client)
+            return
+        self._registered = True
+
+    def _place(
+        self,
+        region: Region,
+        inputs: Sequence[grpcclient.InferInput],
+        names: Sequence[str],
+        outputs: List[Tuple[str, int]],
+    ) -> Tuple[
+        List[grpcclient.InferInput],
+        List[grpcclient.InferRequestedOutput],
+        Dict[str, int],
+    ]:
+        """Copy the inputs to the region and lay out the outputs after them.
+
+        The requested outputs of the names are returned with the offsets of
+        those in the region.
+        """
+        shm_inputs = []
+        contents = bytearray()
+        # pylint: disable=protected-access
+        for infer_input in inputs:
+            content = infer_input._get_content() or b""
+            shm_input = grpcclient.InferInput(
+                infer_input.name(), infer_input.shape(), infer_input.datatype()
+            )
+            shm_input.set_shared_memory(region.name, len(content), len(contents))
+            shm_inputs.append(shm_input)
+            contents += content
+            contents += bytes(_align(len(contents)) - len(contents))
+        # The inputs are copied at once.
+        shm.set_shared_memory_region(region.handle, [np.frombuffer(contents, np.uint8)])
+        offset = len(contents)
+        requested = [
+            grpcclient.InferRequestedOutput(name)
+            for name in names
+            if name not in SHM_OUTPUTS
+        ]
+        offsets = {}
+        for name, byte_size in outputs:
+            output = grpcclient.InferRequestedOutput(name)
+            output.set_shared_memory(region.name, byte_size, offset)
+            requested.append(output)
+            offsets[name] = offset
+            offset = _align(offset + byte_size)
+        return shm_inputs, requested, offsets
+
+
+def _layout(
+    inputs: Sequence[grpcclient.InferInput], names: Optional[Sequence[str]]
+) -> Optional[Tuple[Sequence[str], List[Tuple[str, int]], int]]:
+    """Get the sizes of the named outputs in shared memory and of the region.
+
+    Without names, they are the outputs the ensemble produces for the inputs.
+    It returns None if the inputs are not those of the ensemble.
+    """
+    # pylint: disable=protected-access
+    by_name = {infer_input.name(): infer_input for infer_input in inputs}
+    if "INPUT_1" not in by_name or "beam_width" not in by_name:
+        return None
+    if names is None:
+        names = list(WIRE_OUTPUTS) + list(SHM_OUTPUTS)
+        log_probs = by_name.get("is_return_log_probs")
+        if log_probs is None or not any(log_probs._get_content()):
+            names = [name for name in names if name not in LOG_PROB_OUTPUTS]
+    max_tokens = np.frombuffer(by_name["INPUT_1"]._get_content(), np.uint32)
+    beams = np.frombuffer(by_name["beam_width"]._get_content(), np.uint32)
+    rows = len(max_tokens) * int(beams.max())
+    tokens = int(max_tokens.max())
+    outputs = [
+        (name, rows * (tokens if SHM_OUTPUTS[name] else 1) * ELEMENT_SIZE)
+        for name in names
+        if name in SHM_OUTPUTS
+    ]
+    size = sum(_align(len(i._get_content() or b"")) for i in inputs)
+    size += sum(_align(byte_size) for _, byte_size in outputs)
+    return names, outputs, size
+
+
+def _align(offset: int) -> int:
+    """Round the offset up to the alignment."""
+    return -(-offset // ALIGNMENT) * ALIGNMENT
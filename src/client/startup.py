@@ -0,0 +1,85 @@
+"""Startup phases and the warm-up that gates the readiness of the client.
+
+A new replica is only ready once its channels are open, the model is ready
+on Triton and warm-up requests went through, so that no user request pays
+for the first connection or the first allocations of a batch size. Each
+phase is timed and exported as client_startup_seconds{phase}, along with
+"ready", the time from the start of the process. The phases may overlap,
+e.g. the UI is built while the warm-up runs.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+from metrics import STARTUP_SECONDS
+
+# A named step of the warm-up.
+WarmUpStep = Tuple[str, Callable[[], Awaitable[None]]]
+
+
+def process_seconds() -> Optional[float]:
+    """Get the seconds since the start of the process, if the OS tells them."""
+    try:
+        with open("/proc/self/stat", encoding="utf-8") as f:
+            # The start time is the 22nd field, counted after the command name.
+            start_ticks = int(f.read().rpartition(")")[2].split()[19])
+        with open("/proc/uptime", encoding="utf-8") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+class Startup:
+    """Record the startup phases and run the warm-up."""
+
+    def __init__(self) -> None:
+        """Initialize."""
+        self.phases: Dict[str, float] = {}
+        self.warm = False
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Time a phase of the startup."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: Optional[float]) -> None:
+        """Record the duration of a phase, if it is known."""
+        if seconds is None:
+            return
+        self.phases[name] = seconds
+        STARTUP_SECONDS.labels(name).set(seconds)
+
+    async def warm_up(
+        self, steps: Sequence[WarmUpStep], retry_interval: float = 1.0
+    ) -> None:
+        """Run the steps in order, retrying each until it succeeds.
+
+        Triton may start after the client, so a failed step is retried rather
+        than failing the pod. The client is warm once all the steps are done.
+        """
+        for name, step in steps:
+            with self.phase(name):
+                while True:
+                    try:
+                        await step()
+                        break
+                    except Exception as exception:  # pylint: disable=broad-except
+                        print(
+                            f"Warm-up {name}: {type(exception).__name__}: {exception}"
+                        )
+                        await asyncio.sleep(retry_interval)
+        self.warm = True
+        self.record("ready", process_seconds())
+        print(self.summary())
+
+    def summary(self) -> str:
+        """Describe the durations of the phases."""
+        phases = ", ".join(f"{name} {s:.2f} s" for name, s in self.phases.items())
+        return f"Startup: {phases}"
@@ -0,0 +1,87 @@
+"""Incremental decoding of streamed generations."""
+import codecs
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+END_OF_TEXT = "<|endoftext|>"
+
+
+@dataclass
+class StopStats:
+    """Counters of the generations ended by a stop sequence."""
+
+    requests: int = 0
+    stopped: int = 0
+    tokens_saved: int = 0
+
+
+class StreamDecoder:
+    """Decode the cumulative outputs of a stream and cut them at the end of text.
+
+    A decoupled FasterTransformer model returns every token generated so far on
+    each response, so only the new bytes are decoded. Text that could be the
+    beginning of the end-of-text marker is held back until it is disambiguated.
+
+    The server ends a generation right after one of the stop sequences, so a
+    stop sequence is trimmed only from the end of the completion.
+    """
+
+    def __init__(self, stops: Sequence[str] = ()) -> None:
+        """Initialize."""
+        self.stops = stops
+        self.text = ""
+        self.finished = False
+        # The stop sequence that ended the generation.
+        self.stopped_by: Optional[str] = None
+        # The end-of-text tokens padded after the completion.
+        self.padding = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._received = b""
+        self._pending = ""
+
+    def feed(self, output: bytes) -> str:
+        """Consume the cumulative output and return the visible text so far."""
+        if self.finished:
+            return self.text
+        if output.startswith(self._received):
+            new = output[len(self._received) :]
+        else:  # Earlier bytes were rewritten by the detokenizer.
+            self._decoder.reset()
+            self.text, self._pending, new = "", "", output
+        self._received = output
+
+        pending = self._pending + self._decoder.decode(new)
+        idx = pending.find(END_OF_TEXT)
+        if idx >= 0:
+            self.text += pending[:idx]
+            self.padding = pending.count(END_OF_TEXT, idx)
+            self._pending = ""
+            self.finished = True
+            return self.text
+
+        held = _overlap(pending, END_OF_TEXT)
+        self.text += pending[: len(pending) - held]
+        self._pending = pending[len(pending) - held :]
+        return self.text
+
+    def flush(self) -> str:
+        """Release the held back text and trim the stop sequence at the end."""
+        if not self.finished:
+            self.text += self._pending + self._decoder.decode(b"", final=True)
+            self._pending = ""
+            self.finished = True
+        if self.stopped_by is None:
+            for stop in self.stops:
+                if stop and self.text.endswith(stop):
+                    self.text = self.text[: -len(stop)]
+                    self.stopped_by = stop
+                    break
+        return self.text
+
+
+def _overlap(text: str, stop: str) -> int:
+    """Get the length of the longest suffix of text that is a prefix of stop."""
+    for size in range(min(len(text), len(stop) - 1), 0, -1):
+        if stop.startswith(text[-size:]):
+            return size
+    return 0
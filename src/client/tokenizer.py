@@ -0,0 +1,219 @@
+"""The byte-level BPE tokenizer of CodeGen on the client.
+
+It reads the vocabulary of the preprocessing model, either vocab.json and
+merges.txt (or gpt2-vocab.json and gpt2-merges.txt) with an optional
+added_tokens.json, or the tokenizer.json of Hugging Face, from anywhere in a
+directory such as the model repository. The encodings of whole texts are
+cached, so a frequent prompt is tokenized once.
+"""
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+END_ID = 50256
+# The BPE merges of the words seen, which are mostly recurring identifiers.
+MERGE_CACHE_SIZE = 65536
+VOCAB_FILES = (
+    ("vocab.json", "merges.txt"),
+    ("gpt2-vocab.json", "gpt2-merges.txt"),
+)
+# The pre-tokenization of GPT-2, with the Unicode letter and number classes of
+# the regex package written for re.
+PATTERN = re.compile(
+    r"""'s|'t|'re|'ve|'m|'ll|'d| ?[^\W\d_]+| ?\d+| ?(?:[^\s\w]|_)+|\s+(?!\S)|\s+"""
+)
+
+
+def bytes_to_unicode() -> Dict[int, str]:
+    """Map the bytes to the printable characters of the vocabulary of GPT-2."""
+    printable = (
+        list(range(ord("!"), ord("~") + 1))
+        + list(range(ord("¡"), ord("¬") + 1))
+        + list(range(ord("®"), ord("ÿ") + 1))
+    )
+    chars = list(printable)
+    extra = 0
+    for byte in range(256):
+        if byte not in printable:
+            printable.append(byte)
+            chars.append(256 + extra)
+            extra += 1
+    return dict(zip(printable, map(chr, chars)))
+
+
+class BPETokenizer:
+    """Encode and decode texts, one by one or as padded batches."""
+
+    def __init__(
+        self,
+        vocab: Dict[str, int],
+        merges: Sequence[Tuple[str, str]],
+        added_tokens: Optional[Dict[str, int]] = None,
+        cache_size: int = 4096,
+    ) -> None:
+        """Initialize."""
+        self.vocab = vocab
+        self.ranks = {pair: rank for rank, pair in enumerate(merges)}
+        self.added_tokens = added_tokens or {}
+        self.byte_encoder = bytes_to_unicode()
+        byte_decoder = {char: byte for byte, char in self.byte_encoder.items()}
+        # The bytes of every id, for decoding with a single lookup.
+        self.table = np.full(
+            max([*vocab.values(), *self.added_tokens.values()]) + 1, b"", dtype=object
+        )
+        for token, token_id in vocab.items():
+            self.table[token_id] = bytes(byte_decoder.get(c, 0) for c in token)
+        for token, token_id in self.added_tokens.items():
+            self.table[token_id] = token.encode("utf-8")
+        self._added = (
+            re.compile(
+                "("
+                + "|".join(map(re.escape, sorted(self.added_tokens, key=len)[::-1]))
+                + ")"
+            )
+            if self.added_tokens
+            else None
+        )
+        self._bpe = lru_cache(maxsize=MERGE_CACHE_SIZE)(self._merge)
+        self._encode = lru_cache(maxsize=cache_size)(self._build_encoding)
+
+    @classmethod
+    def from_directory(cls, path: str, cache_size: int = 4096) -> "BPETokenizer":
+        """Load the first vocabulary found in the directory or below it."""
+        for root, _, files in sorted(os.walk(path)):
+            if "tokenizer.json" in files:
+                return cls.from_tokenizer_json(
+                    os.path.join(root, "tokenizer.json"), cache_size
+                )
+            for vocab_file, merges_file in VOCAB_FILES:
+                if vocab_file in files and merges_file in files:
+                    with open(os.path.join(root, vocab_file), encoding="utf-8") as f:
+                        vocab = json.load(f)
+                    with open(os.path.join(root, merges_file), encoding="utf-8") as f:
+                        merges = parse_merges(f)
+                    added_tokens = None
+                    if "added_tokens.json" in files:
+                        added_path = os.path.join(root, "added_tokens.json")
+                        with open(added_path, encoding="utf-8") as f:
+                            added_tokens = json.load(f)
+                    return cls(vocab, merges, added_tokens, cache_size)
+        raise FileNotFoundError(f"No BPE vocabulary in {path}")
+
+    @classmethod
+    def from_tokenizer_json(cls, path: str, cache_size: int = 4096) -> "BPETokenizer":
+        """Load the tokenizer.json of a Hugging Face fast tokenizer."""
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        merges = [
+            tuple(merge.split(" ", 1)) if isinstance(merge, str) else tuple(merge)
+            for merge in config["model"]["merges"]
+        ]
+        added_tokens = {
+            token["content"]: token["id"]
+            for token in config.get("added_tokens", [])
+            if token["content"] not in config["model"]["vocab"]
+        }
+        return cls(config["model"]["vocab"], merges, added_tokens, cache_size)
+
+    def encode(self, text: str) -> List[int]:
+        """Get the token ids of a text."""
+        return list(self._encode(text))
+
+    def decode(self, ids: Iterable[int]) -> str:
+        """Get the text of token ids."""
+        return b"".join(self._lookup(np.asarray(ids, np.int64))).decode(
+            "utf-8", "replace"
+        )
+
+    def encode_batch(
+        self, texts: Sequence[str], pad_id: int = END_ID
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the [N, L] ids padded with pad_id and the [N, 1] lengths."""
+        encodings = [self._encode(text) for text in texts]
+        lengths = np.array([[len(ids)] for ids in encodings], np.uint32)
+        ids = np.full((len(texts), max(1, int(lengths.max(initial=0)))), pad_id)
+        for i, encoding in enumerate(encodings):
+            ids[i, : len(encoding)] = encoding
+        return ids.astype(np.uint32), lengths
+
+    def decode_batch(self, ids: np.ndarray) -> np.ndarray:
+        """Get the UTF-8 bytes of each row of [..., L] ids, flattened."""
+        pieces = self._lookup(ids.reshape(-1, ids.shape[-1]).astype(np.int64))
+        return np.array([b"".join(row) for row in pieces], dtype=object)
+
+    def _lookup(self, ids: np.ndarray) -> np.ndarray:
+        """Get the bytes of the ids, empty for ids outside the vocabulary.
+
+        The embedding of the model is padded beyond the vocabulary, so the
+        model may sample such ids, which are skipped like Hugging Face does.
+        """
+        valid = (ids >= 0) & (ids < len(self.table))
+        return np.where(valid, self.table[np.where(valid, ids, 0)], b"")
+
+    def word_list(self, words: Sequence[Sequence[str]]) -> np.ndarray:
+        """Pack the ids of the words of each row as FasterTransformer does."""
+        return to_word_list([[self._encode(word) for word in row] for row in words])
+
+    def _build_encoding(self, text: str) -> Tuple[int, ...]:
+        """Encode a text, with its added tokens taken as they are."""
+        ids: List[int] = []
+        parts = self._added.split(text) if self._added else [text]
+        for part in parts:
+            if part in self.added_tokens:
+                ids.append(self.added_tokens[part])
+                continue
+            for word in PATTERN.findall(part):
+                chars = "".join(self.byte_encoder[b] for b in word.encode("utf-8"))
+                ids.extend(self.vocab[token] for token in self._bpe(chars))
+        return tuple(ids)
+
+    def _merge(self, word: str) -> Tuple[str, ...]:
+        """Merge the characters of a word by the ranks of the merges."""
+        symbols = list(word)
+        while len(symbols) > 1:
+            pairs = zip(symbols, symbols[1:])
+            best = min(pairs, key=lambda pair: self.ranks.get(pair, float("inf")))
+            if best not in self.ranks:
+                break
+            merged: List[str] = []
+            i = 0
+            while i < len(symbols):
+                if i < len(symbols) - 1 and (symbols[i], symbols[i + 1]) == best:
+                    merged.append(symbols[i] + symbols[i + 1])
+                    i += 2
+                else:
+                    merged.append(symbols[i])
+                    i += 1
+            symbols = merged
+        return tuple(symbols)
+
+
+def parse_merges(lines: Iterable[str]) -> List[Tuple[str, str]]:
+    """Parse the lines of merges.txt, skipping the version header."""
+    merges = []
+    for line in lines:
+        if line.startswith("#version") or not line.strip():
+            continue
+        first, second = line.rstrip("\n").split(" ")
+        merges.append((first, second))
+    return merges
+
+
+def to_word_list(words: Sequence[Sequence[Sequence[int]]]) -> np.ndarray:
+    """Pack the token ids of the words of each row as FasterTransformer does.
+
+    Each [2, L] item has the concatenated ids and the end offsets of the words,
+    padded with 0 and -1.
+    """
+    width = max([1] + [sum(map(len, row)) for row in words])
+    word_list = np.zeros((len(words), 2, width), np.int32)
+    word_list[:, 1, :] = -1
+    for i, row in enumerate(words):
+        ids = [token_id for word in row for token_id in word]
+        word_list[i, 0, : len(ids)] = ids
+        word_list[i, 1, : len(row)] = np.cumsum([len(word) for word in row])
+    return word_list
@@ -0,0 +1,127 @@
+"""Sampled tracing of the chat requests, to join with the traces of Triton.
+
+Every chat request gets a trace ID, which is the request ID of its requests to
+Triton. A batched request carries the IDs of all its chat requests, joined by
+commas. A sampled chat request records a span for the bot() call and child
+spans for its stages, and its requests send the W3C traceparent header, which
+Triton reads in its OpenTelemetry mode. The sampled traces are appended to a
+JSONL file, a trace per line, which scripts/join_traces.py joins with the
+trace file of Triton into a timeline per request.
+
+The timestamps are nanoseconds of the wall clock. An unsampled trace records
+nothing, so the overhead at the usual rates is a random ID per request.
+"""
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+
+@dataclass
+class Span:
+    """A timed operation of a trace."""
+
+    name: str
+    span_id: str
+    parent_id: str
+    start: int
+    end: int = 0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+class Trace:
+    """The spans of a chat request, which are only recorded if it is sampled."""
+
+    def __init__(self, name: str, sampled: bool, **attributes: Any) -> None:
+        """Initialize with the root span of the request."""
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.spans: List[Span] = []
+        self._stack: List[Span] = []
+        if sampled:
+            self._stack.append(self._open(name, attributes))
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+        """Record a child span of the current one around the block."""
+        if not self.sampled:
+            yield None
+            return
+        span = self._open(name, attributes)
+        self._stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end = time.time_ns()
+            self._stack.remove(span)
+
+    def record(self, name: str, start: int, **attributes: Any) -> None:
+        """Record a child span of the current one from start until now."""
+        if self.sampled:
+            self._open(name, attributes, start).end = time.time_ns()
+
+    def annotate(self, **attributes: Any) -> None:
+        """Set attributes of the root span."""
+        if self.sampled:
+            self.spans[0].attributes.update(attributes)
+
+    def options(self, span: Optional[Span] = None) -> Dict[str, Any]:
+        """Get the request ID and the trace context of a request to Triton."""
+        options: Dict[str, Any] = {"request_id": self.trace_id}
+        if span is not None:
+            options["headers"] = {
+                "traceparent": f"00-{self.trace_id}-{span.span_id}-01"
+            }
+        return options
+
+    def close(self) -> Dict[str, Any]:
+        """End the root span and get the record of the trace."""
+        self.spans[0].end = time.time_ns()
+        return {
+            "trace_id": self.trace_id,
+            "spans": [asdict(span) for span in self.spans],
+        }
+
+    def _open(
+        self, name: str, attributes: Dict[str, Any], start: Optional[int] = None
+    ) -> Span:
+        """Start a span under the current one."""
+        span = Span(
+            name,
+            os.urandom(8).hex(),
+            self._stack[-1].span_id if self._stack else "",
+            time.time_ns() if start is None else start,
+            attributes=attributes,
+        )
+        self.spans.append(span)
+        return span
+
+
+class Tracer:
+    """Sample the traces of the chat requests and write the sampled ones."""
+
+    def __init__(self, path: str, rate: float = 0.0) -> None:
+        """Initialize.
+
+        rate is the share of the requests that are sampled, and the traces are
+        appended to the JSONL file at path, which is opened on the first one.
+        """
+        self.path = path
+        self.rate = rate
+        self._file: Optional[IO[str]] = None
+
+    def start(self, name: str, **attributes: Any) -> Trace:
+        """Start the trace of a request, sampled at the rate."""
+        return Trace(name, self.rate > 0 and random.random() < self.rate, **attributes)
+
+    def finish(self, trace: Trace) -> None:
+        """Write the trace if it is sampled."""
+        if not trace.sampled:
+            return
+        if self._file is None:
+            # pylint: disable=consider-using-with
+            self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+        self._file.write(json.dumps(trace.close()) + "\n")
@@ -0,0 +1,179 @@
+"""An asyncio gRPC client pool for Triton Inference Server."""
+import asyncio
+import itertools
+from typing import TYPE_CHECKING, Any, AsyncIterator, List, Optional, Sequence, Union
+
+import tritonclient.grpc as grpcclient
+import tritonclient.grpc.aio as aiogrpcclient
+from tritonclient.utils import InferenceServerException
+
+from metrics import PAYLOAD_BYTES
+
+if TYPE_CHECKING:  # Loading the shared memory library takes a while.
+    from shared_memory import SharedMemoryResult, SharedMemoryTransport
+
+# Errors worth retrying: the server is restarting or shedding load.
+# Deadline errors are not retried, since the generation may still be running.
+RETRYABLE_STATUS = ("StatusCode.UNAVAILABLE", "StatusCode.RESOURCE_EXHAUSTED")
+
+KEEPALIVE = grpcclient.KeepAliveOptions()
+CHANNEL_ARGS = [
+    ("grpc.max_send_message_length", grpcclient.MAX_GRPC_MESSAGE_SIZE),
+    ("grpc.max_receive_message_length", grpcclient.MAX_GRPC_MESSAGE_SIZE),
+    ("grpc.keepalive_time_ms", KEEPALIVE.keepalive_time_ms),
+    ("grpc.keepalive_timeout_ms", KEEPALIVE.keepalive_timeout_ms),
+    ("grpc.keepalive_permit_without_calls", KEEPALIVE.keepalive_permit_without_calls),
+    ("grpc.http2.max_pings_without_data", KEEPALIVE.http2_max_pings_without_data),
+    # Give every channel its own TCP connection instead of a shared subchannel.
+    ("grpc.use_local_subchannel_pool", 1),
+]
+
+
+class TritonClientPool:
+    """A round-robin pool of asyncio gRPC clients.
+
+    The channels are opened lazily on the first request, so they are bound to
+    the event loop serving the requests rather than the one at import time.
+    With a shared memory transport, requests go through shared memory when
+    the server is on the same node. With a compression algorithm, "gzip" or
+    "deflate", requests of at least compression_min_bytes are compressed.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        pool_size: int = 4,
+        timeout: Optional[float] = None,
+        max_retries: int = 2,
+        retry_backoff: float = 0.1,
+        shared_memory: Optional["SharedMemoryTransport"] = None,
+        compression: Optional[str] = None,
+        compression_min_bytes: int = 0,
+    ) -> None:
+        """Initialize."""
+        self.url = url
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.shared_memory = shared_memory
+        self.compression = compression
+        self.compression_min_bytes = compression_min_bytes
+        self._clients: List[aiogrpcclient.InferenceServerClient] = []
+        self._index = itertools.cycle(range(pool_size))
+
+    def get_client(self) -> aiogrpcclient.InferenceServerClient:
+        """Get the next client in the pool."""
+        if not self._clients:
+            self._clients = [
+                aiogrpcclient.InferenceServerClient(self.url, channel_args=CHANNEL_ARGS)
+                for _ in range(self.pool_size)
+            ]
+        return self._clients[next(self._index)]
+
+    async def infer(
+        self,
+        model_name: str,
+        inputs: Sequence[grpcclient.InferInput],
+        outputs: Optional[Sequence[grpcclient.InferRequestedOutput]] = None,
+        **kwargs: Any,
+    ) -> Union[grpcclient.InferResult, "SharedMemoryResult"]:
+        """Run an inference with the per-request timeout and retries."""
+        kwargs.setdefault("client_timeout", self.timeout)
+        request_bytes = _request_bytes(inputs)
+        PAYLOAD_BYTES.labels("request").observe(request_bytes)
+        kwargs.setdefault("compression_algorithm", self._compression(request_bytes))
+        attempt = 0
+        while True:
+            try:
+                client = self.get_client()
+                result = None
+                if self.shared_memory is not None:
+                    result = await self.shared_memory.infer(
+                        client, model_name, inputs, outputs, **kwargs
+                    )
+                if result is None:
+                    result = await client.infer(
+                        model_name, inputs, outputs=outputs, **kwargs
+                    )
+                PAYLOAD_BYTES.labels("response").observe(
+                    result.get_response().ByteSize()
+                )
+                return result
+            except InferenceServerException as exception:
+                retryable = exception.status() in RETRYABLE_STATUS
+                if not retryable or attempt >= self.max_retries:
+                    raise
+            await asyncio.sleep(self.retry_backoff * 2**attempt)
+            attempt += 1
+
+    async def stream_infer(
+        self,
+        model_name: str,
+        inputs: Sequence[grpcclient.InferInput],
+        outputs: Optional[Sequence[grpcclient.InferRequestedOutput]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[grpcclient.InferResult]:
+        """Run an inference on a decoupled model over the bidirectional stream.
+
+        A client_timeout is the timeout of the stream, and the headers are
+        those of the stream. Closing the iterator early closes the stream and
+        cancels the call.
+        """
+        timeout = kwargs.pop("client_timeout", self.timeout)
+        headers = kwargs.pop("headers", None)
+        request = dict(model_name=model_name, inputs=inputs, outputs=outputs, **kwargs)
+
+        async def requests() -> AsyncIterator[dict]:
+            yield request
+
+        request_bytes = _request_bytes(inputs)
+        PAYLOAD_BYTES.labels("request").observe(request_bytes)
+        responses = self.get_client().stream_infer(
+            requests(),
+            stream_timeout=timeout,
+            headers=headers,
+            compression_algorithm=self._compression(request_bytes),
+        )
+        try:
+            async for result, error in responses:
+                if error is not None:
+                    raise error
+                PAYLOAD_BYTES.labels("response").observe(
+                    result.get_response().ByteSize()
+                )
+                yield result
+        finally:
+            if hasattr(responses, "cancel"):  # tritonclient>=2.33
+                responses.cancel()
+            else:
+                await responses.aclose()
+
+    async def connect(self) -> None:
+        """Open every channel of the pool with a liveness call."""
+        self.get_client()
+        await asyncio.gather(
+            *(
+                client.is_server_live(client_timeout=self.timeout)
+                for client in self._clients
+            )
+        )
+
+    async def close(self) -> None:
+        """Close all channels."""
+        if self.shared_memory is not None and self._clients:
+            await self.shared_memory.close(self._clients[0])
+        clients, self._clients = self._clients, []
+        await asyncio.gather(*(client.close() for client in clients))
+
+    def _compression(self, request_bytes: int) -> Optional[str]:
+        """Get the compression algorithm of a request of the size."""
+        if self.compression and request_bytes >= self.compression_min_bytes:
+            return self.compression
+        return None
+
+
+def _request_bytes(inputs: Sequence[grpcclient.InferInput]) -> int:
+    """Get the size of the tensor contents of the inputs."""
+    # pylint: disable=protected-access
+    return sum(len(infer_input._get_content() or b"") for infer_input in inputs)
@@ -0,0 +1,241 @@
+"""Derived metrics of Triton Inference Server for autoscaling.
+
+Triton exports cumulative counters per model. The exporter scrapes them every
+interval and re-exports what they mean over the last window, per model:
+
+- triton_requests_per_second
+- triton_batch_size: inferences per execution, and triton_batch_fill_ratio
+  of the max batch size where it is given.
+- triton_compute_share: the share of the compute time of the models that
+  are not ensembles, e.g. the overhead of pre- and postprocessing.
+- triton_queue_seconds_per_request, and triton_queue_load: the queueing
+  seconds per second, i.e. the average number of requests waiting.
+- triton_queue_seconds_p95 and triton_request_seconds_p95: the 95th
+  percentile of the scrape interval averages, weighted by their requests.
+  Triton has no latency histograms, so this is an estimate that follows the
+  tail better than the average over the window, but stays below the p95 of
+  single requests.
+- triton_generated_tokens_per_second: from client_generated_tokens_total of
+  the client, if one of the URLs is a client.
+
+    python src/exporter/triton_exporter.py --url localhost:8002 \
+        --max-batch-size codegen-350M-mono-gptj=32
+"""
+import argparse
+import time
+import urllib.request
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from prometheus_client import REGISTRY, Counter, start_http_server
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.parser import text_string_to_metric_families
+from prometheus_client.registry import Collector
+
+# (metric, model): the value summed over the versions.
+Values = Dict[Tuple[str, str], float]
+
+COMPUTE_METRICS = (
+    "nv_inference_compute_input_duration_us",
+    "nv_inference_compute_infer_duration_us",
+    "nv_inference_compute_output_duration_us",
+)
+REQUESTS_METRIC = "nv_inference_request_success"
+TOKENS_METRIC = "client_generated_tokens"
+PERCENTILE = 0.95
+
+SCRAPE_ERRORS = Counter("triton_exporter_scrape_errors", "Failed scrapes.")
+
+
+@dataclass
+class Snapshot:
+    """The counters at a time."""
+
+    time: float
+    values: Values
+
+
+def parse_metrics(text: str) -> Values:
+    """Parse the metrics in the Prometheus text format by metric and model."""
+    values: Values = {}
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name not in (family.name, family.name + "_total"):
+                continue  # e.g. _created
+            key = (family.name, sample.labels.get("model", ""))
+            values[key] = values.get(key, 0.0) + sample.value
+    return values
+
+
+def scrape(urls: Sequence[str], timeout: float) -> Values:
+    """Scrape and merge the metrics of the URLs."""
+    values: Values = {}
+    for url in urls:
+        if "://" not in url:
+            url = f"http://{url}/metrics"
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            values.update(parse_metrics(response.read().decode("utf-8")))
+    return values
+
+
+class DerivedMetrics:
+    """Keep the snapshots of the window and derive the metrics from them."""
+
+    def __init__(
+        self,
+        window: float = 30.0,
+        max_batch_sizes: Optional[Dict[str, int]] = None,
+        ensembles: Sequence[str] = ("ensemble",),
+    ) -> None:
+        """Initialize."""
+        self.window = window
+        self.max_batch_sizes = max_batch_sizes or {}
+        self.ensembles = ensembles
+        self._snapshots: Deque[Snapshot] = deque()
+
+    def update(self, values: Values, now: float) -> None:
+        """Add the counters scraped at the time."""
+        if self._snapshots and any(
+            value < self._snapshots[-1].values.get(key, 0.0)
+            for key, value in values.items()
+            if key[0] in (REQUESTS_METRIC, TOKENS_METRIC)
+        ):
+            self._snapshots.clear()  # The counters were reset by a restart.
+        self._snapshots.append(Snapshot(now, values))
+        # Keep the last snapshot at or before the start of the window.
+        while len(self._snapshots) > 2 and self._snapshots[1].time <= now - self.window:
+            self._snapshots.popleft()
+
+    def compute(self) -> Dict[str, Dict[str, float]]:
+        """Get the derived metrics by name and model."""
+        metrics: Dict[str, Dict[str, float]] = {}
+        if len(self._snapshots) < 2:
+            return metrics
+        first, last = self._snapshots[0], self._snapshots[-1]
+        seconds = last.time - first.time
+
+        def delta(name: str, model: str) -> float:
+            key = (name, model)
+            return last.values.get(key, 0.0) - first.values.get(key, 0.0)
+
+        def put(name: str, model: str, value: float) -> None:
+            metrics.setdefault(name, {})[model] = value
+
+        models = [model for name, model in last.values if name == REQUESTS_METRIC]
+        compute = {
+            model: sum(delta(name, model) for name in COMPUTE_METRICS) / 1e6
+            for model in models
+        }
+        total_compute = sum(
+            seconds for model, seconds in compute.items() if model not in self.ensembles
+        )
+        for model in models:
+            requests = delta(REQUESTS_METRIC, model)
+            executions = delta("nv_inference_exec_count", model)
+            queue = delta("nv_inference_queue_duration_us", model) / 1e6
+            put("requests_per_second", model, requests / seconds)
+            put("queue_load", model, queue / seconds)
+            if requests:
+                put("queue_seconds_per_request", model, queue / requests)
+            if executions:
+                batch = delta("nv_inference_count", model) / executions
+                put("batch_size", model, batch)
+                if model in self.max_batch_sizes:
+                    put("batch_fill_ratio", model, batch / self.max_batch_sizes[model])
+            if total_compute and model not in self.ensembles:
+                put("compute_share", model, compute[model] / total_compute)
+            for name, metric in (
+                ("queue_seconds_p95", "nv_inference_queue_duration_us"),
+                ("request_seconds_p95", "nv_inference_request_duration_us"),
+            ):
+                p95 = self._percentile(metric, model)
+                if p95 is not None:
+                    put(name, model, p95 / 1e6)
+        if (TOKENS_METRIC, "") in last.values:
+            put("generated_tokens_per_second", "", delta(TOKENS_METRIC, "") / seconds)
+        return metrics
+
+    def _percentile(self, metric: str, model: str) -> Optional[float]:
+        """Get the percentile of the interval averages of a duration metric."""
+        averages: List[Tuple[float, float]] = []
+        snapshots = list(self._snapshots)
+        for before, after in zip(snapshots, snapshots[1:]):
+            requests = after.values.get((REQUESTS_METRIC, model), 0.0) - (
+                before.values.get((REQUESTS_METRIC, model), 0.0)
+            )
+            if requests > 0:
+                duration = after.values.get((metric, model), 0.0) - (
+                    before.values.get((metric, model), 0.0)
+                )
+                averages.append((duration / requests, requests))
+        if not averages:
+            return None
+        averages.sort()
+        rank = PERCENTILE * sum(requests for _, requests in averages)
+        for average, requests in averages:
+            rank -= requests
+            if rank <= 0:
+                return average
+        return averages[-1][0]
+
+
+class DerivedCollector(Collector):
+    """Export the derived metrics."""
+
+    def __init__(self, derived: DerivedMetrics) -> None:
+        """Initialize."""
+        self.derived = derived
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        """Compute the metrics."""
+        for name, values in self.derived.compute().items():
+            family = GaugeMetricFamily(
+                f"triton_{name}", f"{name} over the window.", labels=["model"]
+            )
+            for model, value in values.items():
+                family.add_metric([model], value)
+            yield family
+
+
+def parse_max_batch_sizes(text: str) -> Dict[str, int]:
+    """Parse model=size,model=size."""
+    sizes = {}
+    for item in filter(None, text.split(",")):
+        model, size = item.rsplit("=", 1)
+        sizes[model.strip()] = int(size)
+    return sizes
+
+
+def main(args: argparse.Namespace) -> None:
+    """Scrape the URLs every interval and serve the derived metrics."""
+    derived = DerivedMetrics(
+        args.window, parse_max_batch_sizes(args.max_batch_size), args.ensembles
+    )
+    REGISTRY.register(DerivedCollector(derived))
+    start_http_server(args.port)
+    while True:
+        start = time.monotonic()
+        try:
+            derived.update(scrape(args.url, args.interval), start)
+        except Exception as exception:  # pylint: disable=broad-except
+            SCRAPE_ERRORS.inc()
+            print(f"{type(exception).__name__}: {exception}")
+        time.sleep(max(0.0, start + args.interval - time.monotonic()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--url",
+        action="append",
+        help="host:port or the URL of the metrics, repeated for several targets.",
+    )
+    parser.add_argument("--port", type=int, default=8003)
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds.")
+    parser.add_argument("--window", type=float, default=30.0, help="Seconds.")
+    parser.add_argument("--max-batch-size", default="", help="model=size,...")
+    parser.add_argument("--ensembles", nargs="*", default=["ensemble"])
+    args = parser.parse_args()
+    args.url = args.url or ["localhost:8002"]
+    main(args)
@@ -0,0 +1,124 @@
+"""Micro-benchmark of the client CPU time to build an ensemble request.
+
+It compares building every tensor per request, as the app and the load test
+used to do, with RequestTemplate:
+
+    PYTHONPATH=src python test/benchmark/request_builder_benchmark.py
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable, List
+
+import numpy as np
+import tritonclient.grpc as grpcclient
+import tritonclient.http as httpclient
+from tritonclient.grpc import service_pb2
+from tritonclient.utils import np_to_triton_dtype
+
+from client.request_builder import GenerationRequest, RequestTemplate
+
+
+def legacy_inputs(request: GenerationRequest, client_util: Any) -> List[Any]:
+    """Build every tensor of the request from scratch."""
+
+    def prepare_tensor(name: str, tensor: np.ndarray) -> Any:
+        infer_input = client_util.InferInput(
+            name, tensor.shape, np_to_triton_dtype(tensor.dtype)
+        )
+        infer_input.set_data_from_numpy(tensor)
+        return infer_input
+
+    input0 = [[request.prompt]]
+    return [
+        prepare_tensor("INPUT_0", np.array(input0).astype(object)),
+        prepare_tensor(
+            "INPUT_1", np.ones_like(input0).astype(np.uint32) * request.max_tokens
+        ),
+        prepare_tensor("INPUT_2", np.array([[""]], dtype=object)),
+        prepare_tensor("INPUT_3", np.array([[""]], dtype=object)),
+        prepare_tensor(
+            "runtime_top_k", request.top_k * np.ones([1, 1]).astype(np.uint32)
+        ),
+        prepare_tensor(
+            "runtime_top_p", request.top_p * np.ones([1, 1]).astype(np.float32)
+        ),
+        prepare_tensor(
+            "temperature", request.temperature * np.ones([1, 1]).astype(np.float32)
+        ),
+        prepare_tensor(
+            "len_penalty", request.len_penalty * np.ones([1, 1]).astype(np.float32)
+        ),
+        prepare_tensor(
+            "repetition_penalty",
+            request.repetition_penalty * np.ones([1, 1]).astype(np.float32),
+        ),
+        prepare_tensor("random_seed", request.seed * np.ones([1, 1]).astype(np.uint64)),
+        prepare_tensor("is_return_log_probs", np.ones([1, 1]).astype(bool)),
+        prepare_tensor("beam_width", request.beams * np.ones([1, 1]).astype(np.uint32)),
+        prepare_tensor(
+            "beam_search_diversity_rate",
+            request.diversity * np.ones([1, 1]).astype(np.float32),
+        ),
+        prepare_tensor("start_id", 220 * np.ones([1, 1]).astype(np.uint32)),
+        prepare_tensor("end_id", 50256 * np.ones([1, 1]).astype(np.uint32)),
+    ]
+
+
+# pylint: disable=protected-access
+def grpc_body(inputs: List[Any]) -> bytes:
+    """Serialize the gRPC request as the client does before sending it."""
+    request = service_pb2.ModelInferRequest(model_name="ensemble")
+    for infer_input in inputs:
+        request.inputs.extend([infer_input._get_tensor()])
+        if infer_input._get_content() is not None:
+            request.raw_input_contents.extend([infer_input._get_content()])
+    return request.SerializeToString()
+
+
+def http_body(inputs: List[Any]) -> bytes:
+    """Serialize the HTTP request as the client does before sending it."""
+    header = json.dumps(
+        {
+            "inputs": [infer_input._get_tensor() for infer_input in inputs],
+            "parameters": {"binary_data_output": True},
+        }
+    ).encode("utf-8")
+    return header + b"".join(infer_input._get_binary_data() for infer_input in inputs)
+
+
+def measure(build: Callable[[GenerationRequest], Any], iterations: int) -> float:
+    """Get the mean time to build a request in microseconds."""
+    requests = [
+        GenerationRequest(prompt=f"def helloworld_{i}():") for i in range(iterations)
+    ]
+    build(requests[0])  # warm up
+    start = time.perf_counter()
+    for request in requests:
+        build(request)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    grpc_template = RequestTemplate(grpcclient.InferInput)
+    http_template = RequestTemplate(httpclient.InferInput)
+    cases = {
+        "grpc": (
+            lambda r: grpc_body(legacy_inputs(r, grpcclient)),
+            lambda r: grpc_body(grpc_template.inputs([r])),
+        ),
+        "http": (
+            lambda r: http_body(legacy_inputs(r, httpclient)),
+            lambda r: http_template.http_body([r]),
+        ),
+    }
+    print(f"{'protocol':<10}{'legacy (us)':>14}{'template (us)':>16}{'saved':>10}")
+    for protocol, (legacy, template) in cases.items():
+        before = measure(legacy, args.iterations)
+        after = measure(template, args.iterations)
+        saved = 1 - after / before
+        print(f"{protocol:<10}{before:>14.1f}{after:>16.1f}{saved:>10.1%}")
@@ -0,0 +1,97 @@
+"""Benchmark the shared memory transport against the wire.
+
+Ensemble requests are sent one at a time over gRPC and through system shared
+memory. For each batch size, beam width and output length, it reports the
+client CPU time and the latency per request, and the bytes of the response
+messages. The server must be on the same node, e.g. the stand-in:
+
+    PYTHONPATH=src python test/stand_in/server.py &
+    PYTHONPATH=src python test/benchmark/shared_memory_benchmark.py
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, List, Tuple
+
+import numpy as np
+import tritonclient.grpc.aio as aiogrpcclient
+
+from client.request_builder import GenerationRequest, RequestTemplate
+from client.shared_memory import SharedMemoryResult, SharedMemoryTransport
+
+
+async def measure(
+    infer: Callable[[], Awaitable[Any]], iterations: int
+) -> Tuple[float, float, float, int]:
+    """Get the mean CPU time, p50 and p99 latencies in ms and response bytes."""
+    await infer()  # warm up
+    latencies: List[float] = []
+    cpu = time.process_time()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = await infer()
+        # Read every output, as the client does.
+        for output in result.get_response().outputs:
+            result.as_numpy(output.name)
+        latencies.append(time.perf_counter() - start)
+    cpu = (time.process_time() - cpu) / iterations
+    p50, p99 = np.percentile(latencies, (50, 99))
+    return cpu * 1e3, p50 * 1e3, p99 * 1e3, result.get_response().ByteSize()
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Compare the transports for each configuration."""
+    client = aiogrpcclient.InferenceServerClient(args.url)
+    transport = SharedMemoryTransport(1, int(args.region_mb * 2**20))
+    template = RequestTemplate()
+    print(
+        f"{'batch x beams x tokens':<24}{'transport':<10}{'cpu (ms)':>10}"
+        f"{'p50 (ms)':>10}{'p99 (ms)':>10}{'response (B)':>14}"
+    )
+    try:
+        for config in args.configs.split(","):
+            batch_size, beams, tokens = (int(value) for value in config.split("x"))
+            inputs = template.inputs(
+                [
+                    GenerationRequest(
+                        prompt=f"def helloworld_{i}():",
+                        max_tokens=tokens,
+                        beams=beams,
+                        return_log_probs=True,
+                    )
+                    for i in range(batch_size)
+                ]
+            )
+
+            async def shared_memory() -> SharedMemoryResult:
+                result = await transport.infer(client, "ensemble", inputs)
+                if result is None:
+                    raise RuntimeError("The request does not fit in shared memory")
+                return result
+
+            cases = {
+                "wire": lambda: client.infer("ensemble", inputs),
+                "shm": shared_memory,
+            }
+            for name, infer in cases.items():
+                cpu, p50, p99, size = await measure(infer, args.iterations)
+                print(
+                    f"{config:<24}{name:<10}{cpu:>10.3f}{p50:>10.2f}{p99:>10.2f}"
+                    f"{size:>14,}"
+                )
+    finally:
+        await transport.close(client)
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="localhost:8001")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    parser.add_argument(
+        "--configs",
+        default="1x1x128,8x1x128,8x4x512",
+        help="Comma-separated batch size x beams x output tokens.",
+    )
+    parser.add_argument("--region-mb", type=float, default=16)
+    asyncio.run(main(parser.parse_args()))
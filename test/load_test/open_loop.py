@@ -0,0 +1,309 @@
+"""Open-loop load generator for the ensemble model.
+
+Unlike the Locust users, which wait for a response before sending the next
+request, requests are sent at a fixed or Poisson arrival rate regardless of
+the responses. The latency is measured from the time a request was due, so
+the queueing delay past saturation is not hidden (coordinated omission). The
+percentiles are over the requests sent: a request that times out or fails is
+recorded at the time it took to fail, at least the timeout for a timeout, so
+that the tail is not cut off where the server falls behind.
+
+The request bodies are serialized before the test from the workload of the
+Locust test (see workload.py), and sent over HTTP or gRPC, compressed with
+--compression. The report has the mean bytes of the requests and responses
+as sent, except for gRPC, whose messages are counted before compression:
+
+    PYTHONPATH=src python test/load_test/open_loop.py --protocol grpc \
+        --url localhost:8001 --sweep 100:2000:100 --output results.json
+
+A sweep runs every rate in turn and reports the saturation knee, the highest
+rate the server sustained.
+"""
+import argparse
+import asyncio
+import gzip
+import itertools
+import json
+import random
+import sys
+import zlib
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import grpc
+import tritonclient.grpc as grpcclient
+import tritonclient.http as httpclient
+from hdrh.histogram import HdrHistogram
+
+from client.request_builder import RequestTemplate
+from workload import load_workload
+
+# Latencies are recorded in microseconds up to 10 minutes, with 3 digits.
+MAX_LATENCY_US = 600_000_000
+PERCENTILES = (50, 90, 99, 99.9)
+GRPC_METHOD = "/inference.GRPCInferenceService/ModelInfer"
+COMPRESSORS = {"gzip": gzip.compress, "deflate": zlib.compress}
+GRPC_COMPRESSION = {"gzip": grpc.Compression.Gzip, "deflate": grpc.Compression.Deflate}
+
+# A sender returns the bytes of the request and of the response.
+Sender = Callable[[Any], Awaitable[Tuple[int, int]]]
+
+
+class HttpSender:
+    """Post pre-serialized binary requests to the HTTP endpoint."""
+
+    def __init__(self, url: str, model_name: str, compression: str = "") -> None:
+        """Initialize."""
+        self.url = f"http://{url}/v2/models/{model_name}/infer"
+        self.compression = compression
+        self.template = RequestTemplate(httpclient.InferInput)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def serialize(self, request: Any) -> Any:
+        """Serialize the body and the headers of a request."""
+        body, json_size = self.template.http_body([request])
+        headers = {"Inference-Header-Content-Length": str(json_size)}
+        if self.compression:
+            body = COMPRESSORS[self.compression](body)
+            headers["Content-Encoding"] = self.compression
+            headers["Accept-Encoding"] = self.compression
+        return body, headers
+
+    async def __call__(self, payload: Any) -> Tuple[int, int]:
+        """Send a request and read its response."""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0), auto_decompress=False
+            )
+        body, headers = payload
+        async with self._session.post(self.url, data=body, headers=headers) as resp:
+            response = await resp.read()
+            if resp.status != 200:
+                raise RuntimeError(f"HTTP {resp.status}")
+        return len(body), len(response)
+
+    async def close(self) -> None:
+        """Close the connections."""
+        if self._session is not None:
+            await self._session.close()
+
+
+class GrpcSender:
+    """Send pre-serialized ModelInferRequests over a few gRPC channels."""
+
+    def __init__(
+        self, url: str, model_name: str, channels: int = 4, compression: str = ""
+    ) -> None:
+        """Initialize."""
+        self.url = url
+        self.model_name = model_name
+        self.compression = GRPC_COMPRESSION.get(compression)
+        self.template = RequestTemplate(grpcclient.InferInput)
+        self.n_channels = channels
+        self._channels: List[grpc.aio.Channel] = []
+        self._calls: Optional[Iterator[Any]] = None
+
+    def serialize(self, request: Any) -> Any:
+        """Serialize the body of a request."""
+        return self.template.grpc_body([request], self.model_name)
+
+    async def __call__(self, payload: Any) -> Tuple[int, int]:
+        """Send a request and receive its raw response."""
+        if self._calls is None:
+            options = [
+                ("grpc.max_send_message_length", grpcclient.MAX_GRPC_MESSAGE_SIZE),
+                ("grpc.max_receive_message_length", grpcclient.MAX_GRPC_MESSAGE_SIZE),
+                ("grpc.use_local_subchannel_pool", 1),
+            ]
+            self._channels = [
+                grpc.aio.insecure_channel(self.url, options=options)
+                for _ in range(self.n_channels)
+            ]
+            # Without serializers, the bodies are sent as they are.
+            self._calls = itertools.cycle(
+                [channel.unary_unary(GRPC_METHOD) for channel in self._channels]
+            )
+        response = await next(self._calls)(payload, compression=self.compression)
+        return len(payload), len(response)
+
+    async def close(self) -> None:
+        """Close the channels."""
+        await asyncio.gather(*(channel.close() for channel in self._channels))
+
+
+async def run_rate(
+    send: Sender,
+    payloads: Iterator[Any],
+    rate: float,
+    duration: float,
+    poisson: bool,
+    timeout: float,
+    rng: random.Random,
+) -> Dict[str, Any]:
+    """Send requests at the rate for the duration and measure the latencies."""
+    loop = asyncio.get_running_loop()
+    latency = HdrHistogram(1, MAX_LATENCY_US, 3)
+    # How late requests were sent. It grows if the generator is the bottleneck.
+    send_lag = HdrHistogram(1, MAX_LATENCY_US, 3)
+    errors: Counter = Counter()
+    tasks = []
+    done: List[float] = []
+    timeouts = 0
+    payload_bytes = {"request": 0, "response": 0}
+
+    async def request(payload: Any, due: float) -> None:
+        nonlocal timeouts
+        try:
+            sizes = await asyncio.wait_for(send(payload), timeout)
+        except asyncio.TimeoutError:
+            timeouts += 1
+            latency.record_value(max(1, int((loop.time() - due) * 1e6)))
+            return
+        except Exception as exception:  # pylint: disable=broad-except
+            errors[type(exception).__name__] += 1
+            latency.record_value(max(1, int((loop.time() - due) * 1e6)))
+            return
+        done.append(loop.time())
+        payload_bytes["request"] += sizes[0]
+        payload_bytes["response"] += sizes[1]
+        latency.record_value(max(1, int((done[-1] - due) * 1e6)))
+
+    start = loop.time()
+    due = start
+    while due < start + duration:
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        send_lag.record_value(max(1, int((loop.time() - due) * 1e6)))
+        tasks.append(asyncio.ensure_future(request(next(payloads), due)))
+        due += rng.expovariate(rate) if poisson else 1 / rate
+    await asyncio.gather(*tasks)
+
+    completed = len(done)
+    # The rate of the responses from the first to the last one.
+    window = done[-1] - done[0] if completed > 1 else 0.0
+    return {
+        "rate": rate,
+        "sent": len(tasks),
+        "completed": completed,
+        "timeouts": timeouts,
+        "errors": dict(errors),
+        "throughput": (completed - 1) / window if window > 0 else 0.0,
+        "latency_ms": {
+            **{
+                f"p{p:g}": latency.get_value_at_percentile(p) / 1e3 for p in PERCENTILES
+            },
+            "mean": latency.get_mean_value() / 1e3,
+            "max": latency.get_max_value() / 1e3,
+        },
+        "mean_bytes": {
+            direction: size / completed if completed else 0.0
+            for direction, size in payload_bytes.items()
+        },
+        "send_lag_ms": {
+            "p99": send_lag.get_value_at_percentile(99) / 1e3,
+            "max": send_lag.get_max_value() / 1e3,
+        },
+        # The compressed histogram, e.g. for HdrHistogram.decode or plotters.
+        "histogram": latency.encode().decode("ascii"),
+    }
+
+
+def saturated(result: Dict[str, Any], slo_ms: Optional[float]) -> bool:
+    """Check whether the server failed to keep up with the rate."""
+    failed = result["timeouts"] + sum(result["errors"].values())
+    if result["sent"] and failed > 0.01 * result["sent"]:
+        return True
+    if result["throughput"] < 0.9 * result["rate"]:
+        return True
+    return slo_ms is not None and result["latency_ms"]["p99"] > slo_ms
+
+
+def parse_rates(args: argparse.Namespace) -> List[float]:
+    """Get the rates to run from --rates or --sweep start:stop:step."""
+    if args.sweep:
+        start, stop, step = (float(value) for value in args.sweep.split(":"))
+        count = int(round((stop - start) / step)) + 1
+        return [start + step * i for i in range(count)]
+    return [float(rate) for rate in args.rates.split(",")]
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run the rates and find the knee."""
+    if args.protocol == "http":
+        sender: Any = HttpSender(args.url, args.model, args.compression)
+    else:
+        sender = GrpcSender(args.url, args.model, args.channels, args.compression)
+    workload = itertools.islice(load_workload(), args.bodies)
+    payloads = itertools.cycle([sender.serialize(request) for request, _ in workload])
+    rng = random.Random(args.seed)
+
+    results, knee = [], None
+    try:
+        for rate in parse_rates(args):
+            result = await run_rate(
+                sender,
+                payloads,
+                rate,
+                args.duration,
+                args.arrival == "poisson",
+                args.timeout,
+                rng,
+            )
+            results.append(result)
+            latency = result["latency_ms"]
+            print(
+                f"rate {rate:>8.1f}  throughput {result['throughput']:>8.1f}  "
+                f"p50 {latency['p50']:>9.1f} ms  p99 {latency['p99']:>9.1f} ms  "
+                f"timeouts {result['timeouts']}  "
+                f"errors {sum(result['errors'].values())}",
+                file=sys.stderr,
+            )
+            if saturated(result, args.slo_ms):
+                break
+            knee = rate
+            await asyncio.sleep(args.cooldown)
+    finally:
+        await sender.close()
+    return {
+        "protocol": args.protocol,
+        "url": args.url,
+        "model": args.model,
+        "arrival": args.arrival,
+        "compression": args.compression,
+        "duration": args.duration,
+        "knee": knee,
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--protocol", choices=("http", "grpc"), default="http")
+    parser.add_argument("--url", default="localhost:8000")
+    parser.add_argument("--model", default="ensemble")
+    parser.add_argument("--arrival", choices=("fixed", "poisson"), default="poisson")
+    parser.add_argument("--rates", default="100", help="Comma-separated RPS.")
+    parser.add_argument("--sweep", default="", help="RPS as start:stop:step.")
+    parser.add_argument("--duration", type=float, default=30.0, help="Per rate.")
+    parser.add_argument("--cooldown", type=float, default=5.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--slo-ms", type=float, default=None, help="p99 bound.")
+    parser.add_argument("--bodies", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=4, help="gRPC only.")
+    parser.add_argument(
+        "--compression",
+        choices=("", *COMPRESSORS),
+        default="",
+        help="Compress the requests, and accept compressed HTTP responses.",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default="", help="JSON file, stdout if empty.")
+    args = parser.parse_args()
+    report = json.dumps(asyncio.run(main(args)), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(report)
+    else:
+        print(report)
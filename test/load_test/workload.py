@@ -0,0 +1,144 @@
+"""Workloads of the load tests: a replayed trace or a synthetic mix.
+
+A trace is a JSONL file with a request per line. Each line has the fields of
+GenerationRequest, of which only "prompt" is required, and optionally
+"interval", the seconds since the previous request:
+
+    {"prompt": "def fib(n):", "max_tokens": 64, "beams": 1, "interval": 0.05}
+
+It is read lazily, so a trace may be larger than the memory.
+"""
+import json
+import os
+import random
+from dataclasses import fields, replace
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from client.request_builder import GenerationRequest
+
+# The request of the experiments in the README.
+BASE_REQUEST = GenerationRequest(
+    prompt="def helloworld():",
+    max_tokens=128,
+    top_k=3,
+    top_p=0.92,
+    diversity=0.5,
+    temperature=0.5,
+    len_penalty=-1,
+    repetition_penalty=1.1,
+    seed=42,
+    beams=1,
+)
+REQUEST_FIELDS = {field.name for field in fields(GenerationRequest)}
+
+Record = Tuple[GenerationRequest, float]
+
+
+class Workload:
+    """An endless sequence of requests and the offsets they are due at.
+
+    The offset is the time since the start of the test at which a request is
+    sent. It is 0 unless the trace has intervals.
+    """
+
+    def __init__(self, records: Iterator[Record]) -> None:
+        """Initialize."""
+        self._records = records
+        self._offset = 0.0
+
+    def __iter__(self) -> "Workload":
+        """Get the iterator."""
+        return self
+
+    def __next__(self) -> Record:
+        """Get the next request and its offset."""
+        request, interval = next(self._records)
+        self._offset += interval
+        return request, self._offset
+
+
+def parse_request(record: dict) -> GenerationRequest:
+    """Create a request from a record of a trace, ignoring unknown fields."""
+    kwargs = {key: value for key, value in record.items() if key in REQUEST_FIELDS}
+    if "stop_words" in kwargs:
+        kwargs["stop_words"] = tuple(kwargs["stop_words"])
+    return replace(BASE_REQUEST, **kwargs)
+
+
+def read_trace(path: str, loop: bool = True) -> Iterator[Record]:
+    """Read the requests of a JSONL trace and their intervals one by one."""
+    while True:
+        with open(path, encoding="utf-8") as trace:
+            for line in trace:
+                if line.strip():
+                    record = json.loads(line)
+                    yield parse_request(record), float(record.get("interval", 0))
+        if not loop:
+            return
+
+
+def parse_distribution(spec: str) -> Tuple[List[int], List[float]]:
+    """Parse "value:weight,..." such as "8:0.3,128:0.5,512:0.2".
+
+    A value without a weight has the weight 1.
+    """
+    values, weights = [], []
+    for item in filter(None, (item.strip() for item in spec.split(","))):
+        value, _, weight = item.partition(":")
+        values.append(int(value))
+        weights.append(float(weight or 1))
+    return values, weights
+
+
+def synthetic_mix(
+    output_lengths: str = "128",
+    beams: str = "1",
+    prompts: Sequence[str] = (BASE_REQUEST.prompt,),
+    seed: Optional[int] = None,
+) -> Iterator[Record]:
+    """Draw requests from the distributions of output lengths and beams."""
+    rng = random.Random(seed)
+    lengths, length_weights = parse_distribution(output_lengths)
+    widths, width_weights = parse_distribution(beams)
+    while True:
+        yield replace(
+            BASE_REQUEST,
+            prompt=rng.choice(prompts),
+            max_tokens=rng.choices(lengths, length_weights)[0],
+            beams=rng.choices(widths, width_weights)[0],
+        ), 0.0
+
+
+def request_class(request: GenerationRequest) -> str:
+    """Get the class of a request that latencies are reported by."""
+    return f"{request.max_tokens} tokens, {request.beams} beams"
+
+
+def load_workload() -> Workload:
+    """Create the workload configured by the environment variables.
+
+    LOAD_TEST_TRACE replays a trace, looped unless LOAD_TEST_LOOP is 0.
+    Otherwise, requests are drawn from LOAD_TEST_OUTPUT_LENGTHS and
+    LOAD_TEST_BEAMS with the prompts of the LOAD_TEST_PROMPTS file, one per
+    line with an escaped newline, and LOAD_TEST_SEED.
+    """
+    trace = os.getenv("LOAD_TEST_TRACE", "")
+    if trace:
+        return Workload(read_trace(trace, os.getenv("LOAD_TEST_LOOP", "1") == "1"))
+
+    prompts: Sequence[str] = (BASE_REQUEST.prompt,)
+    prompts_path = os.getenv("LOAD_TEST_PROMPTS", "")
+    if prompts_path:
+        with open(prompts_path, encoding="utf-8") as lines:
+            prompts = [
+                line.rstrip("\n").replace("\\n", "\n") for line in lines if line.strip()
+            ]
+    seed = os.getenv("LOAD_TEST_SEED", "")
+    return Workload(
+        synthetic_mix(
+            os.getenv("LOAD_TEST_OUTPUT_LENGTHS", str(BASE_REQUEST.max_tokens)),
+            os.getenv("LOAD_TEST_BEAMS", str(BASE_REQUEST.beams)),
+            prompts,
+            int(seed) if seed else None,
+        )
+    )
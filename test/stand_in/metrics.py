@@ -0,0 +1,97 @@
+"""The Prometheus metrics of the stand-in models, named as Triton names them."""
+from dataclasses import dataclass, fields
+from typing import Dict
+
+# Field of ModelStats: (metric name, type, help).
+METRICS = {
+    "request_success": (
+        "nv_inference_request_success",
+        "counter",
+        "Number of successful inference requests, all batch sizes",
+    ),
+    "request_failure": (
+        "nv_inference_request_failure",
+        "counter",
+        "Number of failed inference requests, all batch sizes",
+    ),
+    "inference_count": (
+        "nv_inference_count",
+        "counter",
+        "Number of inferences performed (does not include cached requests)",
+    ),
+    "exec_count": (
+        "nv_inference_exec_count",
+        "counter",
+        "Number of model executions performed (does not include cached requests)",
+    ),
+    "request_duration_us": (
+        "nv_inference_request_duration_us",
+        "counter",
+        "Cumulative inference request duration in microseconds",
+    ),
+    "queue_duration_us": (
+        "nv_inference_queue_duration_us",
+        "counter",
+        "Cumulative inference queuing duration in microseconds",
+    ),
+    "compute_input_duration_us": (
+        "nv_inference_compute_input_duration_us",
+        "counter",
+        "Cumulative compute input duration in microseconds",
+    ),
+    "compute_infer_duration_us": (
+        "nv_inference_compute_infer_duration_us",
+        "counter",
+        "Cumulative compute inference duration in microseconds",
+    ),
+    "compute_output_duration_us": (
+        "nv_inference_compute_output_duration_us",
+        "counter",
+        "Cumulative inference compute output duration in microseconds",
+    ),
+    # Triton 22.12 does not count the requests that the client cancels.
+    "request_cancelled": (
+        "stand_in_request_cancelled",
+        "counter",
+        "Number of inference requests cancelled by the client",
+    ),
+    "pending_request_count": (
+        "nv_inference_pending_request_count",
+        "gauge",
+        "Instantaneous number of pending requests awaiting execution per-model.",
+    ),
+}
+
+
+@dataclass
+class ModelStats:
+    """Counters of a model.
+
+    Like Triton, each request of a batch is charged the compute duration of
+    the whole batch.
+    """
+
+    request_success: int = 0
+    request_failure: int = 0
+    inference_count: int = 0
+    exec_count: int = 0
+    request_duration_us: int = 0
+    queue_duration_us: int = 0
+    compute_input_duration_us: int = 0
+    compute_infer_duration_us: int = 0
+    compute_output_duration_us: int = 0
+    request_cancelled: int = 0
+    pending_request_count: int = 0
+
+
+def render(stats: Dict[str, ModelStats]) -> str:
+    """Render the stats of the models in the Prometheus text format."""
+    lines = []
+    for field in fields(ModelStats):
+        name, kind, description = METRICS[field.name]
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for model, model_stats in stats.items():
+            value = getattr(model_stats, field.name)
+            lines.append(f'{name}{{model="{model}",version="1"}} {value}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,686 @@
+"""The simulated models of the stand-in server.
+
+The preprocessing, codegen-350M-mono-gptj, postprocessing and ensemble models
+take and return the tensors of scripts/end_to_end_test.py with the types of
+the FasterTransformer backend. The tokenizer is a toy one, or the BPE
+tokenizer of the client with a vocabulary such as test/stand_in/tokenizer, and
+the generation repeats a canned completion, but the shapes, the stop words, the
+end-of-text padding and the timing follow the real pipeline.
+"""
+import abc
+import asyncio
+import csv
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+from client.tokenizer import to_word_list
+from metrics import ModelStats
+from tracing import TIMESTAMPS, TraceFile
+
+END_ID = 50256
+END_OF_TEXT = "<|endoftext|>"
+COMPLETION = [
+    "\n",
+    "    ",
+    "print",
+    '("',
+    "Hello",
+    " World",
+    '")',
+    "\n",
+    "\n",
+    "\n",
+    "def",
+    " main",
+    "():",
+    "\n",
+    "    ",
+    "hello",
+    "world",
+    "()",
+    "\n",
+]
+# The inputs of the ensemble passed to the FasterTransformer model as they are.
+SAMPLING_INPUTS = (
+    "runtime_top_k",
+    "runtime_top_p",
+    "beam_search_diversity_rate",
+    "temperature",
+    "len_penalty",
+    "repetition_penalty",
+    "random_seed",
+    "is_return_log_probs",
+    "beam_width",
+    "start_id",
+    "end_id",
+)
+
+Tensors = Dict[str, np.ndarray]
+# Outputs, queue time and compute time of a request in seconds.
+Timed = Tuple[Tensors, float, float]
+
+
+@dataclass
+class LatencyModel:
+    """Execution times in seconds, calibrated from the load tests in the README.
+
+    The compute durations per request of codegen-350M-mono-gptj, 15.7, 59.7,
+    315 and 802 ms for 8, 32, 128 and 512 output tokens in batches of 13 to 20
+    requests, fit 1.4 ms plus 1.8 ms per token. The pre and postprocessing take
+    about 0.45 ms and 0.12 ms plus 0.7 us per token per request.
+    """
+
+    base: float = 1.4e-3
+    per_token: float = 1.8e-3
+    # Extra time per token for each row of a batch after the first.
+    per_row: float = 0.0
+    preprocessing: float = 0.45e-3
+    postprocessing: float = 0.12e-3
+    postprocessing_per_token: float = 0.7e-6
+    # Multiplies every duration, e.g. 0.1 to run the tests 10 times faster.
+    scale: float = 1.0
+
+    def generation(self, steps: int, rows: int) -> float:
+        """Get the time to generate the steps for the rows of a batch."""
+        return self.base * self.scale + steps * self.step(rows)
+
+    def step(self, rows: int) -> float:
+        """Get the time to generate a token for the rows of a batch."""
+        return self.per_token * (1 + self.per_row * (rows - 1)) * self.scale
+
+
+class Tokenizer:
+    """A toy tokenizer of the tokens of the completion and single characters."""
+
+    CHAR_OFFSET = 100_000
+    WORD_OFFSET = 2_000_000
+
+    def __init__(self) -> None:
+        """Initialize."""
+        words = dict.fromkeys(COMPLETION)
+        self.ids = {word: self.WORD_OFFSET + i for i, word in enumerate(words)}
+        self.ids[END_OF_TEXT] = END_ID
+        self.words = {token_id: word for word, token_id in self.ids.items()}
+        self.longest = max(map(len, self.ids))
+
+    def encode(self, text: str) -> List[int]:
+        """Split the text into the longest known words or characters."""
+        ids, pos = [], 0
+        while pos < len(text):
+            for size in range(min(self.longest, len(text) - pos), 0, -1):
+                token_id = self.ids.get(text[pos : pos + size])
+                if token_id is not None:
+                    break
+            else:
+                size, token_id = 1, self.CHAR_OFFSET + ord(text[pos])
+            ids.append(token_id)
+            pos += size
+        return ids
+
+    def decode(self, ids: np.ndarray) -> str:
+        """Join the words of the ids."""
+        return "".join(
+            self.words.get(int(i)) or chr(int(i) - self.CHAR_OFFSET) for i in ids
+        )
+
+
+class Model(abc.ABC):
+    """A model with the statistics of Triton."""
+
+    name = ""
+
+    def __init__(self, latency: LatencyModel) -> None:
+        """Initialize."""
+        self.latency = latency
+        self.stats = ModelStats()
+        self.trace_file: Optional[TraceFile] = None
+
+    async def infer(self, inputs: Tensors, request_id: str = "") -> Tensors:
+        """Run an inference."""
+        outputs, _, _ = await self.timed_infer(inputs, request_id)
+        return outputs
+
+    async def timed_infer(
+        self, inputs: Tensors, request_id: str = "", parent_id: int = 0
+    ) -> Timed:
+        """Run an inference and record its statistics and its trace."""
+        start = time.monotonic()
+        trace_id = self.start_trace(request_id, parent_id)
+        try:
+            outputs, queue, compute = await self._run(inputs, trace_id)
+        except asyncio.CancelledError:
+            self.record_cancellation()
+            raise
+        except Exception:
+            self.stats.request_failure += 1
+            raise
+        end = time.monotonic()
+        self.record(inputs, end - start, queue, compute)
+        self.finish_trace(trace_id, start, queue, compute, end)
+        return outputs, queue, compute
+
+    def start_trace(self, request_id: str = "", parent_id: int = 0) -> int:
+        """Start the trace of a request, or get 0 if requests are not traced."""
+        if self.trace_file is None:
+            return 0
+        return self.trace_file.start(self.name, parent_id, request_id)
+
+    def finish_trace(
+        self, trace_id: int, start: float, queue: float, compute: float, end: float
+    ) -> None:
+        """Write the timestamps of a traced request."""
+        if not trace_id or self.trace_file is None:
+            return
+        compute_start = start + queue
+        compute_end = min(compute_start + compute, end)
+        times = (
+            start,
+            start,
+            compute_start,
+            compute_start,
+            compute_end,
+            compute_end,
+            end,
+        )
+        self.trace_file.finish(trace_id, list(zip(TIMESTAMPS, times)))
+
+    def record(
+        self, inputs: Tensors, duration: float, queue: float, compute: float
+    ) -> None:
+        """Record a successful request."""
+        self.stats.request_success += 1
+        self.stats.inference_count += batch_size(inputs)
+        self.stats.request_duration_us += int(duration * 1e6)
+        self.stats.queue_duration_us += int(queue * 1e6)
+        self.stats.compute_infer_duration_us += int(compute * 1e6)
+
+    def record_cancellation(self) -> None:
+        """Record a request that the client cancelled."""
+        self.stats.request_cancelled += 1
+
+    @abc.abstractmethod
+    async def _run(self, inputs: Tensors, trace_id: int) -> Timed:
+        """Execute the model, with the trace ID of the request or 0."""
+
+
+class DynamicBatcher:
+    """Triton's dynamic batcher.
+
+    A request waits up to max_queue_delay seconds for others to fill a batch
+    of max_batch_size, and each model instance executes a batch at a time.
+    Cancelled requests are dropped from the queue.
+    """
+
+    def __init__(
+        self,
+        execute: Callable[[List[Tensors]], Awaitable[Tuple[List[Tensors], float]]],
+        stats: ModelStats,
+        max_batch_size: int = 32,
+        max_queue_delay: float = 0.001,
+        instances: int = 1,
+    ) -> None:
+        """Initialize.
+
+        execute returns the outputs of the requests in a batch and the time
+        it took.
+        """
+        self.execute = execute
+        self.stats = stats
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay = max_queue_delay
+        self.instances = instances
+        self._queue: Deque[Tuple[Tensors, int, float, asyncio.Future]] = deque()
+        self._arrived: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+
+    async def submit(self, inputs: Tensors) -> Timed:
+        """Queue a request and wait for its outputs."""
+        loop = asyncio.get_running_loop()
+        if self._arrived is None:  # Bind them to the running loop.
+            self._arrived = asyncio.Event()
+            self._workers = [
+                asyncio.ensure_future(self._work()) for _ in range(self.instances)
+            ]
+        future = loop.create_future()
+        self._queue.append((inputs, batch_size(inputs), loop.time(), future))
+        self.stats.pending_request_count += 1
+        self._arrived.set()
+        return await future
+
+    async def _work(self) -> None:
+        """Execute the batches on a model instance."""
+        assert self._arrived is not None
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self._queue:
+                self._arrived.clear()
+                await self._arrived.wait()
+            deadline = self._queue[0][2] + self.max_queue_delay
+            while self._rows() < self.max_batch_size and loop.time() < deadline:
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    break
+            batch = self._take()
+            if not batch:
+                continue
+            start = loop.time()
+            try:
+                outputs, compute = await self.execute([item[0] for item in batch])
+            except Exception as exception:  # pylint: disable=broad-except
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(exception)
+                continue
+            for (_, _, enqueued, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result((output, start - enqueued, compute))
+
+    def _rows(self) -> int:
+        """Get the number of queued rows."""
+        return sum(rows for _, rows, _, _ in self._queue)
+
+    def _take(self) -> List[Tuple[Tensors, int, float, asyncio.Future]]:
+        """Take the next batch out of the queue."""
+        batch, rows = [], 0
+        while self._queue:
+            item = self._queue[0]
+            if not item[3].done() and batch and rows + item[1] > self.max_batch_size:
+                break
+            self._queue.popleft()
+            self.stats.pending_request_count -= 1
+            if not item[3].done():
+                batch.append(item)
+                rows += item[1]
+        return batch
+
+
+class Preprocessing(Model):
+    """Tokenize the queries and the bad and stop words."""
+
+    name = "preprocessing"
+
+    def __init__(self, latency: LatencyModel, tokenizer: Tokenizer) -> None:
+        """Initialize."""
+        super().__init__(latency)
+        self.tokenizer = tokenizer
+
+    async def _run(self, inputs: Tensors, trace_id: int) -> Timed:
+        """Execute the model."""
+        queries = [query.decode("utf-8") for query in inputs["QUERY"].reshape(-1)]
+        ids = [self.tokenizer.encode(query) for query in queries]
+        input_id = np.full((len(ids), max(map(len, ids), default=0)), END_ID)
+        for i, row in enumerate(ids):
+            input_id[i, : len(row)] = row
+
+        compute = self.latency.preprocessing * self.latency.scale
+        await asyncio.sleep(compute)
+        self.stats.exec_count += 1
+        outputs = {
+            "INPUT_ID": input_id.astype(np.uint32),
+            "REQUEST_INPUT_LEN": np.array([[len(row)] for row in ids], np.uint32),
+            "BAD_WORDS_IDS": self._word_list(inputs["BAD_WORDS_DICT"]),
+            "STOP_WORDS_IDS": self._word_list(inputs["STOP_WORDS_DICT"]),
+            "REQUEST_OUTPUT_LEN": inputs["REQUEST_OUTPUT_LEN"].astype(np.uint32),
+        }
+        return outputs, 0.0, compute
+
+    def _word_list(self, word_dict: np.ndarray) -> np.ndarray:
+        """Tokenize the words of each request into the [N, 2, L] word list."""
+        return to_word_list(
+            [
+                [self.tokenizer.encode(w) for w in words]
+                for words in parse_words(word_dict)
+            ]
+        )
+
+
+class GptJ(Model):
+    """Generate the completions with dynamic batching.
+
+    The canned completion is repeated until a stop word or the output length,
+    or ends after completion_tokens if it is set. Bad words are ignored.
+    """
+
+    name = "codegen-350M-mono-gptj"
+
+    def __init__(
+        self,
+        latency: LatencyModel,
+        tokenizer: Tokenizer,
+        max_batch_size: int = 32,
+        max_queue_delay: float = 0.001,
+        instances: int = 1,
+        completion_tokens: int = 0,
+    ) -> None:
+        """Initialize."""
+        super().__init__(latency)
+        self.completion = tokenizer.encode("".join(COMPLETION))
+        self.completion_tokens = completion_tokens
+        self.batcher = DynamicBatcher(
+            self._execute, self.stats, max_batch_size, max_queue_delay, instances
+        )
+
+    async def stream(
+        self, inputs: Tensors, request_id: str = "", parent_id: int = 0
+    ) -> AsyncIterator[Tensors]:
+        """Yield the outputs generated so far token by token.
+
+        A streamed request is executed on its own, outside the dynamic batcher.
+        """
+        start = time.monotonic()
+        trace_id = self.start_trace(request_id, parent_id)
+        generated = self._generate_rows(inputs)
+        rows = batch_size(inputs) * int(inputs["beam_width"].max())
+        compute = self.latency.base * self.latency.scale
+        try:
+            await asyncio.sleep(compute)
+            for step in range(1, max(map(len, generated), default=0) + 1):
+                await asyncio.sleep(self.latency.step(rows))
+                compute += self.latency.step(rows)
+                yield self._outputs(inputs, [tokens[:step] for tokens in generated], 0)
+        except (asyncio.CancelledError, GeneratorExit):
+            self.record_cancellation()
+            raise
+        self.stats.exec_count += 1
+        end = time.monotonic()
+        self.record(inputs, end - start, 0.0, compute)
+        self.finish_trace(trace_id, start, 0.0, compute, end)
+
+    async def _run(self, inputs: Tensors, trace_id: int) -> Timed:
+        """Execute the model within a batch."""
+        return await self.batcher.submit(inputs)
+
+    async def _execute(self, batch: List[Tensors]) -> Tuple[List[Tensors], float]:
+        """Generate the completions of a batch at once."""
+        generated = [self._generate_rows(inputs) for inputs in batch]
+        output_lens = [int(inputs["request_output_len"].max()) for inputs in batch]
+        # A sequence that ends early generates an end-of-text token, and the
+        # batch runs until every sequence ends.
+        steps = max(
+            min(len(tokens) + 1, output_len)
+            for rows, output_len in zip(generated, output_lens)
+            for tokens in rows
+        )
+        rows = sum(
+            batch_size(inputs) * int(inputs["beam_width"].max()) for inputs in batch
+        )
+        compute = self.latency.generation(steps, rows)
+        await asyncio.sleep(compute)
+        self.stats.exec_count += 1
+        outputs = [
+            self._outputs(inputs, rows, output_len)
+            for inputs, rows, output_len in zip(batch, generated, output_lens)
+        ]
+        return outputs, compute
+
+    def _generate_rows(self, inputs: Tensors) -> List[List[int]]:
+        """Get the generated ids of each row of a request."""
+        if "stop_words_list" in inputs:
+            stop_words = from_word_list(inputs["stop_words_list"])
+        else:
+            stop_words = [[] for _ in range(batch_size(inputs))]
+        return [
+            self._generate(int(output_len), words)
+            for output_len, words in zip(
+                inputs["request_output_len"].reshape(-1), stop_words
+            )
+        ]
+
+    def _generate(self, output_len: int, stop_words: List[List[int]]) -> List[int]:
+        """Get the generated ids until a stop word, the end or the output length."""
+        generated: List[int] = []
+        for step in range(output_len):
+            if self.completion_tokens and step >= self.completion_tokens:
+                break
+            generated.append(self.completion[step % len(self.completion)])
+            if any(word and generated[-len(word) :] == word for word in stop_words):
+                break
+        return generated
+
+    def _outputs(
+        self, inputs: Tensors, generated: List[List[int]], output_len: int
+    ) -> Tensors:
+        """Get the outputs of the generated ids of a request.
+
+        Like FasterTransformer, the sequences are padded with end_id up to the
+        input length plus output_len, and the log probs are only output if
+        is_return_log_probs is set.
+        """
+        input_ids = inputs["input_ids"]
+        input_lengths = inputs["input_lengths"].reshape(-1)
+        beams = int(inputs["beam_width"].max())
+        sequences = [
+            input_ids[i, : input_lengths[i]].tolist() + tokens
+            for i, tokens in enumerate(generated)
+        ]
+        width = max(input_ids.shape[1] + output_len, max(map(len, sequences)))
+        output_ids = np.full((len(sequences), beams, width), END_ID, np.uint32)
+        for i, sequence in enumerate(sequences):
+            output_ids[i, :, : len(sequence)] = sequence
+        outputs = {
+            "output_ids": output_ids,
+            "sequence_length": np.array(
+                [[len(sequence)] * beams for sequence in sequences], np.uint32
+            ),
+        }
+        if "is_return_log_probs" in inputs and inputs["is_return_log_probs"].any():
+            log_probs = [[-0.5 * len(tokens)] * beams for tokens in generated]
+            steps = max(output_len, max(map(len, generated)))
+            outputs["cum_log_probs"] = np.array(log_probs, np.float32)
+            outputs["output_log_probs"] = np.full(
+                (len(sequences), beams, steps), -0.5, np.float32
+            )
+        return outputs
+
+
+class Postprocessing(Model):
+    """Detokenize every beam of the generated sequences."""
+
+    name = "postprocessing"
+
+    def __init__(self, latency: LatencyModel, tokenizer: Tokenizer) -> None:
+        """Initialize."""
+        super().__init__(latency)
+        self.tokenizer = tokenizer
+
+    async def _run(self, inputs: Tensors, trace_id: int) -> Timed:
+        """Execute the model."""
+        tokens = inputs["TOKENS_BATCH"]
+        texts = [
+            self.tokenizer.decode(beam).encode("utf-8")
+            for row in tokens
+            for beam in row
+        ]
+        compute = (
+            self.latency.postprocessing
+            + self.latency.postprocessing_per_token * tokens.shape[-1]
+        ) * self.latency.scale
+        await asyncio.sleep(compute)
+        self.stats.exec_count += 1
+        return {"OUTPUT": np.array(texts, dtype=object)}, 0.0, compute
+
+
+class Ensemble(Model):
+    """Run the preprocessing, the generation and the postprocessing in turn."""
+
+    name = "ensemble"
+
+    def __init__(
+        self, preprocessing: Preprocessing, gptj: GptJ, postprocessing: Postprocessing
+    ) -> None:
+        """Initialize."""
+        super().__init__(gptj.latency)
+        self.preprocessing = preprocessing
+        self.gptj = gptj
+        self.postprocessing = postprocessing
+
+    async def stream(
+        self, inputs: Tensors, request_id: str = ""
+    ) -> AsyncIterator[Tensors]:
+        """Yield the outputs generated so far token by token."""
+        start = time.monotonic()
+        trace_id = self.start_trace(request_id)
+        try:
+            tokens, queue, compute = await self.preprocessing.timed_infer(
+                self._preprocessing_inputs(inputs), parent_id=trace_id
+            )
+            stream = self.gptj.stream(
+                self._gptj_inputs(inputs, tokens), parent_id=trace_id
+            )
+            try:
+                async for generated in stream:
+                    text, _, post = await self.postprocessing.timed_infer(
+                        {"TOKENS_BATCH": generated["output_ids"]}, parent_id=trace_id
+                    )
+                    compute += post
+                    yield self._outputs(text, generated)
+            finally:
+                await stream.aclose()
+        except (asyncio.CancelledError, GeneratorExit):
+            self.record_cancellation()
+            raise
+        self.stats.exec_count += 1
+        end = time.monotonic()
+        self.record(inputs, end - start, queue, compute)
+        self.finish_trace(trace_id, start, queue, compute, end)
+
+    def finish_trace(
+        self, trace_id: int, start: float, queue: float, compute: float, end: float
+    ) -> None:
+        """Write the timestamps of a traced request, which has no execution."""
+        if trace_id and self.trace_file is not None:
+            self.trace_file.finish(
+                trace_id,
+                [
+                    ("REQUEST_START", start),
+                    ("QUEUE_START", start),
+                    ("REQUEST_END", end),
+                ],
+            )
+
+    async def _run(self, inputs: Tensors, trace_id: int) -> Timed:
+        """Execute the composing models."""
+        tokens, pre_queue, pre = await self.preprocessing.timed_infer(
+            self._preprocessing_inputs(inputs), parent_id=trace_id
+        )
+        generated, gptj_queue, gptj = await self.gptj.timed_infer(
+            self._gptj_inputs(inputs, tokens), parent_id=trace_id
+        )
+        text, post_queue, post = await self.postprocessing.timed_infer(
+            {"TOKENS_BATCH": generated["output_ids"]}, parent_id=trace_id
+        )
+        self.stats.exec_count += 1
+        return (
+            self._outputs(text, generated),
+            pre_queue + gptj_queue + post_queue,
+            pre + gptj + post,
+        )
+
+    @staticmethod
+    def _preprocessing_inputs(inputs: Tensors) -> Tensors:
+        """Map the ensemble inputs to the preprocessing inputs."""
+        return {
+            "QUERY": inputs["INPUT_0"],
+            "REQUEST_OUTPUT_LEN": inputs["INPUT_1"],
+            "BAD_WORDS_DICT": inputs["INPUT_2"],
+            "STOP_WORDS_DICT": inputs["INPUT_3"],
+        }
+
+    @staticmethod
+    def _gptj_inputs(inputs: Tensors, tokens: Tensors) -> Tensors:
+        """Map the ensemble inputs and the tokens to the generation inputs."""
+        gptj_inputs = {
+            "input_ids": tokens["INPUT_ID"],
+            "input_lengths": tokens["REQUEST_INPUT_LEN"],
+            "request_output_len": tokens["REQUEST_OUTPUT_LEN"],
+            "bad_words_list": tokens["BAD_WORDS_IDS"],
+            "stop_words_list": tokens["STOP_WORDS_IDS"],
+        }
+        gptj_inputs.update({name: inputs[name] for name in SAMPLING_INPUTS})
+        return gptj_inputs
+
+    @staticmethod
+    def _outputs(text: Tensors, generated: Tensors) -> Tensors:
+        """Map the outputs of the composing models to the ensemble outputs."""
+        outputs = {"OUTPUT_0": text["OUTPUT"]}
+        for name in ("sequence_length", "cum_log_probs", "output_log_probs"):
+            if name in generated:
+                outputs[name] = generated[name]
+        return outputs
+
+
+class Repository:
+    """The models of the pipeline by name."""
+
+    def __init__(
+        self,
+        latency: LatencyModel,
+        max_batch_size: int = 32,
+        max_queue_delay: float = 0.001,
+        instances: int = 1,
+        completion_tokens: int = 0,
+        tokenizer: Optional[Tokenizer] = None,
+        trace_file: Optional[TraceFile] = None,
+    ) -> None:
+        """Initialize."""
+        tokenizer = tokenizer or Tokenizer()
+        preprocessing = Preprocessing(latency, tokenizer)
+        gptj = GptJ(
+            latency,
+            tokenizer,
+            max_batch_size,
+            max_queue_delay,
+            instances,
+            completion_tokens,
+        )
+        postprocessing = Postprocessing(latency, tokenizer)
+        ensemble = Ensemble(preprocessing, gptj, postprocessing)
+        self.models: Dict[str, Model] = {
+            model.name: model
+            for model in (preprocessing, gptj, postprocessing, ensemble)
+        }
+        for model in self.models.values():
+            model.trace_file = trace_file
+
+    def stats(self) -> Dict[str, ModelStats]:
+        """Get the statistics of every model."""
+        return {name: model.stats for name, model in self.models.items()}
+
+
+def batch_size(inputs: Tensors) -> int:
+    """Get the batch size of a request."""
+    return next(iter(inputs.values())).shape[0]
+
+
+def parse_words(word_dict: np.ndarray) -> List[List[str]]:
+    """Parse the *_WORDS_DICT input: a CSV row of words for each request."""
+    return [
+        next(csv.reader([item.decode("utf-8")])) if item else []
+        for item in word_dict.reshape(-1)
+    ]
+
+
+def from_word_list(word_list: np.ndarray) -> List[List[List[int]]]:
+    """Unpack the token ids of the words of each request."""
+    words = []
+    for ids, offsets in word_list:
+        ends = [int(offset) for offset in offsets if offset >= 0]
+        words.append(
+            [ids[start:end].tolist() for start, end in zip([0] + ends[:-1], ends)]
+        )
+    return words
@@ -0,0 +1,567 @@
+"""A GPU-free stand-in for the Triton server.
+
+It serves the preprocessing, codegen-350M-mono-gptj, postprocessing and
+ensemble models over the KServe v2 HTTP and gRPC protocols, including the
+bidirectional stream of a decoupled ensemble, and the Prometheus metrics of
+Triton. The generation is simulated with dynamic batching and a latency
+model calibrated from the load tests in the README (see models.py):
+
+    PYTHONPATH=src python test/stand_in/server.py --http-port 8000 --grpc-port 8001
+    TRITON_STREAMING=1 python src/client/app.py
+"""
+import argparse
+import asyncio
+import json
+import mmap
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import grpc
+import numpy as np
+from aiohttp import web
+from tritonclient.grpc import service_pb2, service_pb2_grpc
+from tritonclient.utils import (
+    deserialize_bytes_tensor,
+    np_to_triton_dtype,
+    serialize_byte_tensor,
+    triton_to_np_dtype,
+)
+
+from client.tokenizer import BPETokenizer
+from metrics import render
+from models import LatencyModel, Model, Repository, Tensors
+from tracing import TraceFile
+
+HEADER_LENGTH = "Inference-Header-Content-Length"
+# The gRPC compression levels of responses.
+COMPRESSION_LEVELS = {"none": 0, "low": 1, "medium": 2, "high": 3}
+
+
+class SharedMemoryRegions:
+    """The system shared memory regions registered by the clients."""
+
+    def __init__(self) -> None:
+        """Initialize."""
+        # name: (key, the mapped region, offset, byte size)
+        self._regions: Dict[str, Tuple[str, mmap.mmap, int, int]] = {}
+
+    def register(self, name: str, key: str, offset: int, byte_size: int) -> None:
+        """Map a region of /dev/shm."""
+        if name in self._regions:
+            raise ValueError(f"shared memory region '{name}' already in manager")
+        try:
+            with open(f"/dev/shm/{key.lstrip('/')}", "r+b") as file:
+                region = mmap.mmap(file.fileno(), 0)
+        except OSError as exception:
+            raise ValueError(
+                f"Unable to open shared memory region: '{key}': {exception}"
+            ) from exception
+        if offset + byte_size > len(region):
+            region.close()
+            raise ValueError(f"shared memory region '{name}' is out of range")
+        self._regions[name] = (key, region, offset, byte_size)
+
+    def unregister(self, name: str = "") -> None:
+        """Unmap a region, or all of them if the name is empty."""
+        for region_name in [name] if name else list(self._regions):
+            if region_name in self._regions:
+                self._regions.pop(region_name)[1].close()
+
+    def status(self, name: str = "") -> service_pb2.SystemSharedMemoryStatusResponse:
+        """Get the status of a region, or all of them if the name is empty."""
+        response = service_pb2.SystemSharedMemoryStatusResponse()
+        for region_name, (key, _, offset, byte_size) in self._regions.items():
+            if not name or region_name == name:
+                response.regions[region_name].name = region_name
+                response.regions[region_name].key = key
+                response.regions[region_name].offset = offset
+                response.regions[region_name].byte_size = byte_size
+        return response
+
+    def read(self, parameters: Any) -> bytes:
+        """Read the tensor of the shared memory parameters of an input."""
+        region, start, byte_size = self._locate(parameters)
+        return bytes(region[start : start + byte_size])
+
+    def write(self, parameters: Any, data: bytes) -> None:
+        """Write the tensor of an output to its shared memory."""
+        region, start, byte_size = self._locate(parameters)
+        if len(data) > byte_size:
+            raise ValueError(
+                f"shared memory size specified with the request for output is "
+                f"{byte_size} bytes, while the output needs {len(data)} bytes"
+            )
+        region[start : start + len(data)] = data
+
+    def _locate(self, parameters: Any) -> Tuple[mmap.mmap, int, int]:
+        """Get the region, the start and the size of a tensor."""
+        name = parameters["shared_memory_region"].string_param
+        if name not in self._regions:
+            raise ValueError(f"Unable to find system shared memory region: '{name}'")
+        _, region, offset, _ = self._regions[name]
+        start = offset + parameters["shared_memory_offset"].int64_param
+        return region, start, parameters["shared_memory_byte_size"].int64_param
+
+
+def decode_inputs(
+    request: service_pb2.ModelInferRequest, regions: SharedMemoryRegions
+) -> Tensors:
+    """Decode the input tensors of the request, raw or in shared memory."""
+    raw_contents = iter(request.raw_input_contents)
+    tensors = {}
+    for infer_input in request.inputs:
+        if "shared_memory_region" in infer_input.parameters:
+            raw = regions.read(infer_input.parameters)
+        else:
+            raw = next(raw_contents)
+        tensors[infer_input.name] = decode_tensor(
+            raw, infer_input.datatype, infer_input.shape
+        )
+    return tensors
+
+
+def decode_tensor(raw: bytes, datatype: str, shape: Sequence[int]) -> np.ndarray:
+    """Decode the binary data of a tensor."""
+    if datatype == "BYTES":
+        array = deserialize_bytes_tensor(raw)
+    else:
+        array = np.frombuffer(raw, dtype=triton_to_np_dtype(datatype))
+    return array.reshape(shape)
+
+
+def encode_tensor(array: np.ndarray) -> bytes:
+    """Encode the binary data of a tensor."""
+    if array.dtype == np.object_:
+        return serialize_byte_tensor(array).item()
+    return array.tobytes()
+
+
+def encode_outputs(
+    request: service_pb2.ModelInferRequest,
+    tensors: Tensors,
+    regions: SharedMemoryRegions,
+) -> service_pb2.ModelInferResponse:
+    """Encode the requested output tensors as a response to the request.
+
+    Outputs requested in shared memory are written there, and their raw
+    contents are left empty.
+    """
+    response = service_pb2.ModelInferResponse(
+        model_name=request.model_name, model_version="1", id=request.id
+    )
+    parameters = {output.name: output.parameters for output in request.outputs}
+    check_outputs(request.model_name, parameters, tensors)
+    for name in parameters or list(tensors):
+        array = tensors[name]
+        output = response.outputs.add(
+            name=name, datatype=np_to_triton_dtype(array.dtype), shape=array.shape
+        )
+        if name in parameters and "shared_memory_region" in parameters[name]:
+            regions.write(parameters[name], encode_tensor(array))
+            for key in ("shared_memory_region", "shared_memory_byte_size"):
+                output.parameters[key].CopyFrom(parameters[name][key])
+            response.raw_output_contents.append(b"")
+        else:
+            response.raw_output_contents.append(encode_tensor(array))
+    return response
+
+
+def check_outputs(model_name: str, names: Iterable[str], tensors: Tensors) -> None:
+    """Check that the requested outputs were produced.
+
+    The log probs are missing unless is_return_log_probs is set.
+    """
+    for name in names:
+        if name not in tensors:
+            raise ValueError(
+                f"unexpected inference output '{name}' for model '{model_name}'"
+            )
+
+
+class StandInServicer(service_pb2_grpc.GRPCInferenceServiceServicer):
+    """Serve the stand-in models over gRPC."""
+
+    def __init__(self, repository: Repository, finish_cancelled: bool = False) -> None:
+        """Initialize."""
+        self.repository = repository
+        self.regions = SharedMemoryRegions()
+        self.finish_cancelled = finish_cancelled
+
+    async def ServerLive(  # noqa: N802
+        self, request: service_pb2.ServerLiveRequest, context: grpc.ServicerContext
+    ) -> service_pb2.ServerLiveResponse:
+        """Check liveness."""
+        return service_pb2.ServerLiveResponse(live=True)
+
+    async def ServerReady(  # noqa: N802
+        self, request: service_pb2.ServerReadyRequest, context: grpc.ServicerContext
+    ) -> service_pb2.ServerReadyResponse:
+        """Check readiness."""
+        return service_pb2.ServerReadyResponse(ready=True)
+
+    async def ModelReady(  # noqa: N802
+        self, request: service_pb2.ModelReadyRequest, context: grpc.ServicerContext
+    ) -> service_pb2.ModelReadyResponse:
+        """Check the model readiness."""
+        ready = request.name in self.repository.models
+        return service_pb2.ModelReadyResponse(ready=ready)
+
+    async def ModelInfer(  # noqa: N802
+        self, request: service_pb2.ModelInferRequest, context: grpc.ServicerContext
+    ) -> service_pb2.ModelInferResponse:
+        """Run an inference."""
+        model = await self._get_model(request.model_name, context)
+        run = asyncio.ensure_future(self._infer(model, request))
+        try:
+            if self.finish_cancelled:
+                # Like Triton, which runs the request to the end and writes its
+                # shared memory outputs after the client cancelled it.
+                return await asyncio.shield(run)
+            return await run
+        except asyncio.CancelledError:
+            print(f"Cancelled {request.model_name} request {request.id}")
+            raise
+        except Exception as exception:  # pylint: disable=broad-except
+            await context.abort(grpc.StatusCode.INTERNAL, repr(exception))
+
+    async def _infer(
+        self, model: Model, request: service_pb2.ModelInferRequest
+    ) -> service_pb2.ModelInferResponse:
+        """Run the model on the inputs and encode its outputs."""
+        outputs = await model.infer(decode_inputs(request, self.regions), request.id)
+        return encode_outputs(request, outputs, self.regions)
+
+    async def ModelStreamInfer(  # noqa: N802
+        self,
+        request_iterator: AsyncIterator[service_pb2.ModelInferRequest],
+        context: grpc.ServicerContext,
+    ) -> AsyncIterator[service_pb2.ModelStreamInferResponse]:
+        """Send the responses of the streamed requests.
+
+        The ensemble sends the cumulative completion token by token, like a
+        decoupled model, and the other models send a response per request.
+        """
+        async for request in request_iterator:
+            model = self.repository.models.get(request.model_name)
+            if model is None:
+                yield service_pb2.ModelStreamInferResponse(
+                    error_message=f"Request for unknown model '{request.model_name}'"
+                )
+                continue
+            try:
+                inputs = decode_inputs(request, self.regions)
+                if hasattr(model, "stream"):
+                    async for outputs in model.stream(inputs, request.id):
+                        yield service_pb2.ModelStreamInferResponse(
+                            infer_response=encode_outputs(
+                                request, outputs, self.regions
+                            )
+                        )
+                else:
+                    outputs = await model.infer(inputs, request.id)
+                    yield service_pb2.ModelStreamInferResponse(
+                        infer_response=encode_outputs(request, outputs, self.regions)
+                    )
+            except (asyncio.CancelledError, GeneratorExit):
+                print(f"Cancelled {request.model_name} stream {request.id}")
+                raise
+            except Exception as exception:  # pylint: disable=broad-except
+                yield service_pb2.ModelStreamInferResponse(
+                    error_message=repr(exception)
+                )
+
+    async def SystemSharedMemoryRegister(  # noqa: N802
+        self,
+        request: service_pb2.SystemSharedMemoryRegisterRequest,
+        context: grpc.ServicerContext,
+    ) -> service_pb2.SystemSharedMemoryRegisterResponse:
+        """Register a system shared memory region."""
+        try:
+            self.regions.register(
+                request.name, request.key, request.offset, request.byte_size
+            )
+        except ValueError as exception:
+            await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(exception))
+        return service_pb2.SystemSharedMemoryRegisterResponse()
+
+    async def SystemSharedMemoryUnregister(  # noqa: N802
+        self,
+        request: service_pb2.SystemSharedMemoryUnregisterRequest,
+        context: grpc.ServicerContext,
+    ) -> service_pb2.SystemSharedMemoryUnregisterResponse:
+        """Unregister a system shared memory region, or all of them."""
+        self.regions.unregister(request.name)
+        return service_pb2.SystemSharedMemoryUnregisterResponse()
+
+    async def SystemSharedMemoryStatus(  # noqa: N802
+        self,
+        request: service_pb2.SystemSharedMemoryStatusRequest,
+        context: grpc.ServicerContext,
+    ) -> service_pb2.SystemSharedMemoryStatusResponse:
+        """Get the status of the system shared memory regions."""
+        return self.regions.status(request.name)
+
+    async def _get_model(self, name: str, context: grpc.ServicerContext) -> Model:
+        """Get a model or abort the call if it does not exist."""
+        model = self.repository.models.get(name)
+        if model is None:
+            await context.abort(
+                grpc.StatusCode.NOT_FOUND, f"Request for unknown model '{name}'"
+            )
+        return model
+
+
+class HttpFrontend:
+    """Serve the stand-in models over HTTP/REST, and the metrics."""
+
+    def __init__(self, repository: Repository) -> None:
+        """Initialize."""
+        self.repository = repository
+
+    def app(self) -> web.Application:
+        """Create the HTTP application."""
+        app = web.Application(client_max_size=2**30)
+        app.router.add_get("/v2/health/live", self.ready)
+        app.router.add_get("/v2/health/ready", self.ready)
+        app.router.add_get("/v2/models/{model}/ready", self.model_ready)
+        app.router.add_get(
+            "/v2/models/{model}/versions/{version}/ready", self.model_ready
+        )
+        app.router.add_post("/v2/models/{model}/infer", self.infer)
+        app.router.add_post("/v2/models/{model}/versions/{version}/infer", self.infer)
+        app.router.add_get("/metrics", self.metrics)
+        return app
+
+    async def ready(self, request: web.Request) -> web.Response:
+        """Check liveness and readiness."""
+        return web.Response()
+
+    async def model_ready(self, request: web.Request) -> web.Response:
+        """Check the model readiness."""
+        ready = request.match_info["model"] in self.repository.models
+        return web.Response(status=200 if ready else 400)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        """Export the metrics in the Prometheus text format."""
+        return web.Response(text=render(self.repository.stats()))
+
+    async def infer(self, request: web.Request) -> web.Response:
+        """Run an inference."""
+        name = request.match_info["model"]
+        model = self.repository.models.get(name)
+        if model is None:
+            return error_response(f"Request for unknown model '{name}'")
+        try:
+            body = await request.read()
+            header, inputs = parse_http_body(body, request.headers.get(HEADER_LENGTH))
+            outputs = await model.infer(inputs, header.get("id", ""))
+            check_outputs(name, (o["name"] for o in header.get("outputs", [])), outputs)
+        except Exception as exception:  # pylint: disable=broad-except
+            return error_response(repr(exception))
+        response = http_response(name, header, outputs)
+        # Compressed if the request accepts gzip or deflate, like Triton does.
+        response.enable_compression()
+        return response
+
+
+def parse_http_body(body: bytes, header_length: Optional[str]) -> Tuple[Dict, Tensors]:
+    """Parse the JSON header and the inputs of a request body."""
+    size = int(header_length) if header_length else len(body)
+    header = json.loads(body[:size])
+    binary = memoryview(body)[size:]
+    inputs = {}
+    for infer_input in header["inputs"]:
+        datatype, shape = infer_input["datatype"], infer_input["shape"]
+        binary_size = infer_input.get("parameters", {}).get("binary_data_size")
+        if binary_size is not None:
+            raw, binary = bytes(binary[:binary_size]), binary[binary_size:]
+            inputs[infer_input["name"]] = decode_tensor(raw, datatype, shape)
+        elif datatype == "BYTES":
+            data = [item.encode("utf-8") for item in np.ravel(infer_input["data"])]
+            inputs[infer_input["name"]] = np.array(data, dtype=object).reshape(shape)
+        else:
+            dtype = triton_to_np_dtype(datatype)
+            array = np.array(infer_input["data"], dtype=dtype)
+            inputs[infer_input["name"]] = array.reshape(shape)
+    return header, inputs
+
+
+def http_response(name: str, header: Dict, tensors: Tensors) -> web.Response:
+    """Encode the requested outputs, in binary if asked to."""
+    binary_default = header.get("parameters", {}).get("binary_data_output", False)
+    requested = header.get("outputs") or [{"name": output} for output in tensors]
+    outputs: List[Dict] = []
+    raw: List[bytes] = []
+    for output in requested:
+        array = tensors[output["name"]]
+        metadata = {
+            "name": output["name"],
+            "datatype": np_to_triton_dtype(array.dtype),
+            "shape": list(array.shape),
+        }
+        if output.get("parameters", {}).get("binary_data", binary_default):
+            raw.append(encode_tensor(array))
+            metadata["parameters"] = {"binary_data_size": len(raw[-1])}
+        elif array.dtype == np.object_:
+            metadata["data"] = [item.decode("utf-8") for item in array.reshape(-1)]
+        else:
+            metadata["data"] = array.reshape(-1).tolist()
+        outputs.append(metadata)
+    response = json.dumps(
+        {"model_name": name, "model_version": "1", "outputs": outputs}
+    ).encode("utf-8")
+    if not raw:
+        return web.Response(body=response, content_type="application/json")
+    return web.Response(
+        body=response + b"".join(raw),
+        headers={HEADER_LENGTH: str(len(response))},
+        content_type="application/octet-stream",
+    )
+
+
+def error_response(message: str) -> web.Response:
+    """Create an error response like Triton does."""
+    return web.json_response({"error": message}, status=400)
+
+
+async def serve(
+    repository: Repository,
+    grpc_port: int,
+    http_port: int,
+    metrics_port: int,
+    compression_level: str = "none",
+    finish_cancelled: bool = False,
+) -> None:
+    """Serve until interrupted."""
+    server = grpc.aio.server(
+        options=[
+            ("grpc.max_send_message_length", -1),
+            ("grpc.max_receive_message_length", -1),
+            # Like --grpc-infer-response-compression-level of Triton.
+            (
+                "grpc.default_compression_level",
+                COMPRESSION_LEVELS[compression_level],
+            ),
+        ]
+    )
+    service_pb2_grpc.add_GRPCInferenceServiceServicer_to_server(
+        StandInServicer(repository, finish_cancelled), server
+    )
+    server.add_insecure_port(f"[::]:{grpc_port}")
+    await server.start()
+
+    frontend = HttpFrontend(repository)
+    runners = []
+    for port in dict.fromkeys(port for port in (http_port, metrics_port) if port):
+        runner = web.AppRunner(frontend.app())
+        await runner.setup()
+        await web.TCPSite(runner, port=port).start()
+        runners.append(runner)
+    print(
+        f"Stand-in Triton server is listening on gRPC {grpc_port}, "
+        f"HTTP {http_port} and metrics {metrics_port}"
+    )
+    try:
+        await server.wait_for_termination()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grpc-port", type=int, default=8001, help="gRPC port.")
+    parser.add_argument("--http-port", type=int, default=8000, help="0 to disable.")
+    parser.add_argument("--metrics-port", type=int, default=8002, help="0 to disable.")
+    parser.add_argument(
+        "--token-latency-ms",
+        type=float,
+        default=LatencyModel.per_token * 1e3,
+        help="Latency to generate a token.",
+    )
+    parser.add_argument(
+        "--base-latency-ms",
+        type=float,
+        default=LatencyModel.base * 1e3,
+        help="Latency of an execution of the generation model.",
+    )
+    parser.add_argument(
+        "--row-latency-factor",
+        type=float,
+        default=LatencyModel.per_row,
+        help="Extra token latency for each row of a batch after the first.",
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1.0,
+        help="Multiplies every latency.",
+    )
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument(
+        "--max-queue-delay-us",
+        type=float,
+        default=1000,
+        help="Time a request waits for a batch to fill up.",
+    )
+    parser.add_argument("--instances", type=int, default=1, help="Model instances.")
+    parser.add_argument(
+        "--completion-tokens",
+        type=int,
+        default=0,
+        help="End the completion after this many tokens, 0 to run to the length.",
+    )
+    parser.add_argument(
+        "--grpc-infer-response-compression-level",
+        choices=list(COMPRESSION_LEVELS),
+        default="none",
+        help="Compress the gRPC responses, like the option of Triton.",
+    )
+    parser.add_argument(
+        "--tokenizer",
+        help="Directory of a BPE vocabulary, e.g. test/stand_in/tokenizer, to "
+        "tokenize like the client does with CLIENT_TOKENIZER_PATH.",
+    )
+    parser.add_argument(
+        "--trace-file",
+        help="Write the timestamps of every request to the file, like the "
+        "--trace-file of Triton with --trace-level=TIMESTAMPS and --trace-rate=1.",
+    )
+    parser.add_argument(
+        "--finish-cancelled",
+        action="store_true",
+        help="Run the unary requests that the client cancels to the end, like "
+        "Triton does, instead of stopping them.",
+    )
+    args = parser.parse_args()
+    latency = LatencyModel(
+        base=args.base_latency_ms / 1000,
+        per_token=args.token_latency_ms / 1000,
+        per_row=args.row_latency_factor,
+        scale=args.time_scale,
+    )
+    tokenizer = None
+    if args.tokenizer:
+        tokenizer = BPETokenizer.from_directory(args.tokenizer)
+    trace_file = TraceFile(args.trace_file) if args.trace_file else None
+    try:
+        asyncio.run(
+            serve(
+                Repository(
+                    latency,
+                    args.max_batch_size,
+                    args.max_queue_delay_us / 1e6,
+                    args.instances,
+                    args.completion_tokens,
+                    tokenizer,
+                    trace_file,
+                ),
+                args.grpc_port,
+                args.http_port,
+                args.metrics_port,
+                args.grpc_infer_response_compression_level,
+                args.finish_cancelled,
+            )
+        )
+    finally:
+        if trace_file is not None:
+            trace_file.close()
@@ -0,0 +1,86 @@
+"""Check that a cancelled request does not corrupt the shared memory of the next.
+
+Triton runs a request to the end after the client cancels it, and then writes
+its outputs into the shared memory region of the request. A long request is
+cancelled in flight through a transport with a single region, then a short one
+is sent: it must go over the wire while the region is quarantined, and once
+the quarantine is over, its outputs through the region must match the wire.
+Run it against the stand-in with --finish-cancelled, which behaves like Triton:
+
+    PYTHONPATH=src python test/stand_in/server.py --finish-cancelled &
+    PYTHONPATH=src python test/stand_in/shared_memory_check.py
+"""
+import argparse
+import asyncio
+import time
+
+import numpy as np
+import tritonclient.grpc.aio as aiogrpcclient
+
+from client.request_builder import GenerationRequest, RequestTemplate
+from client.shared_memory import SharedMemoryTransport
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Cancel a request in flight and check the outputs of the next one."""
+    client = aiogrpcclient.InferenceServerClient(args.url)
+    template = RequestTemplate()
+    long_inputs = template.inputs(
+        [
+            GenerationRequest(
+                prompt="def cancelled():",
+                max_tokens=args.tokens,
+                beams=2,
+                return_log_probs=True,
+            )
+        ]
+    )
+    next_inputs = template.inputs(
+        [GenerationRequest(prompt="def next():", max_tokens=8, return_log_probs=True)]
+    )
+    start = time.perf_counter()
+    await client.infer("ensemble", long_inputs)
+    seconds = time.perf_counter() - start
+    expected = await client.infer("ensemble", next_inputs)
+
+    transport = SharedMemoryTransport(1, quarantine=2 * seconds)
+    try:
+        cancelled = asyncio.ensure_future(
+            transport.infer(client, "ensemble", long_inputs)
+        )
+        await asyncio.sleep(seconds / 4)
+        cancelled.cancel()
+        try:
+            await cancelled
+        except asyncio.CancelledError:
+            pass
+        else:
+            raise AssertionError("The long request ended before it was cancelled")
+        assert (
+            await transport.infer(client, "ensemble", next_inputs) is None
+        ), "The region of the cancelled request was reused while it ran"
+
+        # Let the cancelled request write its outputs, and the quarantine end.
+        await asyncio.sleep(2 * seconds)
+        result = await transport.infer(client, "ensemble", next_inputs)
+        assert result is not None, "The region was not released after the quarantine"
+        for output in expected.get_response().outputs:
+            assert np.array_equal(
+                result.as_numpy(output.name), expected.as_numpy(output.name)
+            ), f"Output {output.name} differs from the wire"
+        print("The outputs after a cancelled request match the wire")
+    finally:
+        await transport.close(client)
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="localhost:8001")
+    parser.add_argument(
+        "--tokens",
+        type=int,
+        default=512,
+        help="Output length of the cancelled request.",
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,72 @@
+"""The trace file of Triton, written by the stand-in models.
+
+Like tritonserver --trace-file with --trace-level=TIMESTAMPS, it is a JSON
+array with an entry for each traced request to a model, with the request ID
+and the trace of the ensemble request for its composing models, and an entry
+with its timestamps in nanoseconds of the monotonic clock.
+"""
+import itertools
+import json
+from typing import Any, Dict, Sequence, Tuple
+
+# The timestamps of an execution of a model. The ensemble only has the first
+# two and the last.
+TIMESTAMPS = (
+    "REQUEST_START",
+    "QUEUE_START",
+    "COMPUTE_START",
+    "COMPUTE_INPUT_END",
+    "COMPUTE_OUTPUT_START",
+    "COMPUTE_END",
+    "REQUEST_END",
+)
+
+
+class TraceFile:
+    """Write the traces of every request as they start and end."""
+
+    def __init__(self, path: str) -> None:
+        """Initialize."""
+        # pylint: disable=consider-using-with
+        self._file = open(path, "w", encoding="utf-8")
+        self._file.write("[")
+        self._ids = itertools.count(1)
+        self._first = True
+
+    def start(self, model_name: str, parent_id: int = 0, request_id: str = "") -> int:
+        """Write the model of a request and get its trace ID."""
+        trace_id = next(self._ids)
+        entry: Dict[str, Any] = {
+            "id": trace_id,
+            "model_name": model_name,
+            "model_version": 1,
+        }
+        if parent_id:
+            entry["parent_id"] = parent_id
+        if request_id:
+            entry["request_id"] = request_id
+        self._write(entry)
+        return trace_id
+
+    def finish(self, trace_id: int, timestamps: Sequence[Tuple[str, float]]) -> None:
+        """Write the timestamps of a request, given in seconds."""
+        self._write(
+            {
+                "id": trace_id,
+                "timestamps": [
+                    {"name": name, "ns": int(seconds * 1e9)}
+                    for name, seconds in timestamps
+                ],
+            }
+        )
+
+    def close(self) -> None:
+        """End the array."""
+        self._file.write("]")
+        self._file.close()
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        """Append an entry, flushed so that the file can be read while serving."""
+        self._file.write(("" if self._first else ",") + json.dumps(entry))
+        self._file.flush()
+        self._first = False